@@ -0,0 +1,244 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import struct
+
+from nose.tools import *
+
+from arakoon import ArakoonAdmission
+from arakoon.ArakoonAdmission import *
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonProtocol import ARA_CMD_GET, ARA_CMD_RAN, ARA_CMD_SET, ARA_CMD_WHO
+
+_GET = struct.pack("I", ARA_CMD_GET)
+_RANGE = struct.pack("I", ARA_CMD_RAN)
+_SET = struct.pack("I", ARA_CMD_SET)
+_WHO = struct.pack("I", ARA_CMD_WHO)
+
+class _Clock :
+    """
+    Stands in for the time module of ArakoonAdmission: time only passes when
+    a test (or a wait) advances it.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class _Condition :
+    """
+    A condition that doesn't block: a wait advances the clock by its
+    timeout (at least a microsecond, as a real wait takes), after calling
+    the hook (what other threads do meanwhile). A hook that returns a time
+    notifies the waiter after that time.
+    """
+
+    def __init__(self, clock):
+        self._clock = clock
+        self.waits = []
+        self.hook = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def notify_all(self):
+        pass
+
+    def wait(self, timeout = None):
+        assert timeout is not None, "would wait forever"
+        self.waits.append(timeout)
+        if self.hook is not None:
+            notified = self.hook(len(self.waits))
+            if notified is not None:
+                timeout = min(timeout, notified)
+        self._clock.advance(max(timeout, 0.000001))
+
+def _withClock(f):
+    clock = _Clock()
+    saved = ArakoonAdmission.time
+    ArakoonAdmission.time = clock
+    try:
+        f(clock)
+    finally:
+        ArakoonAdmission.time = saved
+
+def _control(clock, maxWait = 1.0):
+    control = AdmissionControl(maxWait)
+    control._cond = _Condition(clock)
+    return control
+
+def _close(a, b):
+    return abs(a - b) < 0.00001
+
+def test_bucket_refill_and_burst():
+    def check(clock):
+        bucket = TokenBucket(10, burst = 20)
+        # Starts full
+        assert_equals( bucket.wait(20, clock.time()), 0.0 )
+        bucket.take(20)
+        assert_true( _close(bucket.wait(1, clock.time()), 0.1) )
+        clock.advance(0.5)
+        assert_equals( bucket.wait(5, clock.time()), 0.0 )
+        assert_true( _close(bucket.wait(6, clock.time()), 0.1) )
+        # Never holds more than the burst
+        clock.advance(100.0)
+        assert_equals( bucket.wait(20, clock.time()), 0.0 )
+        bucket.take(20)
+        assert_true( _close(bucket.wait(1, clock.time()), 0.1) )
+        # More than the burst only waits for a full bucket
+        clock.advance(2.0)
+        assert_equals( bucket.wait(50, clock.time()), 0.0 )
+        # and leaves it in debt
+        bucket.take(50)
+        assert_true( _close(bucket.wait(1, clock.time()), 3.1) )
+        assert_raises( ValueError, TokenBucket, 0 )
+        # One second worth of tokens by default
+        assert_equals( TokenBucket(5)._burst, 5.0 )
+    _withClock(check)
+
+def test_bounded_wait():
+    def check(clock):
+        control = _control(clock, maxWait = 0.5)
+        control.setLimit(CLASS_READ, opsPerSecond = 10)
+        for i in range(10):
+            assert_equals( control.admit(_GET, 10, None), 0.0 )
+        assert_true( _close(control.admit(_GET, 10, None), 0.1) )
+        # Other classes and commands are not limited
+        assert_equals( control.admit(_SET, 10, None), 0.0 )
+        assert_equals( control.admit(_WHO, 10, None), 0.0 )
+        # Rejected right away when the tokens won't come before the deadline
+        waits = len(control._cond.waits)
+        assert_raises( ArakoonThrottled, control.admit, _GET, 10, clock.time() + 0.05 )
+        assert_equals( len(control._cond.waits), waits )
+        statistics = control.statistics()
+        assert_equals( statistics[CLASS_READ]['throttled'], 1 )
+        assert_equals( statistics[CLASS_READ]['rejected'], 1 )
+        assert_true( _close(statistics[CLASS_READ]['throttled_seconds'], 0.1) )
+        assert_equals( statistics[CLASS_WRITE], {'throttled' : 0, 'throttled_seconds' : 0.0,
+                                                 'rejected' : 0} )
+    _withClock(check)
+
+def test_fail_fast():
+    def check(clock):
+        control = _control(clock, maxWait = 0)
+        control.setLimit(CLASS_WRITE, opsPerSecond = 2)
+        control.admit(_SET, 10, None)
+        control.admit(_SET, 10, None)
+        start = clock.time()
+        assert_raises( ArakoonThrottled, control.admit, _SET, 10, None )
+        assert_equals( clock.time(), start )
+        assert_equals( control._cond.waits, [] )
+        assert_equals( control.statistics()[CLASS_WRITE]['rejected'], 1 )
+        # Without a bound, waits as long as needed
+        control.setMaxWait(None)
+        assert_true( _close(control.admit(_SET, 10, None), 0.5) )
+    _withClock(check)
+
+def test_bytes():
+    def check(clock):
+        control = _control(clock)
+        control.setLimit(None, bytesPerSecond = 1000)
+        assert_equals( control.admit(_GET, 600, None), 0.0 )
+        # The reply is charged too, and delays the next request
+        control.charge(_GET, 400)
+        assert_true( _close(control.admit(_SET, 100, None), 0.1) )
+    _withClock(check)
+
+def test_priority_within_bucket():
+    def check(clock):
+        control = _control(clock)
+        control.setLimit(None, opsPerSecond = 100)
+        # An interactive request is waiting for the total bucket
+        interactive = ArakoonAdmission._Waiter(PRIORITY_INTERACTIVE,
+                                               control._costs(CLASS_READ, 10))
+        control._waiters.append(interactive)
+        def admitted(count):
+            # The read is admitted after 0.3s
+            control._waiters.remove(interactive)
+            return 0.3
+        control._cond.hook = admitted
+        # The scan has its tokens, but waits until the read is admitted
+        assert_true( _close(control.admit(_RANGE, 10, None), 0.3) )
+        assert_equals( len(control._cond.waits), 1 )
+        # Until the deadline at most
+        control._waiters.append(interactive)
+        control._cond.hook = None
+        assert_raises( ArakoonThrottled, control.admit, _RANGE, 10, None )
+        assert_equals( control.statistics()[CLASS_SCAN]['rejected'], 1 )
+        control._waiters.remove(interactive)
+    _withClock(check)
+
+def test_priority_other_bucket():
+    def check(clock):
+        control = _control(clock)
+        control.setLimit(CLASS_READ, opsPerSecond = 100)
+        control.setLimit(CLASS_SCAN, opsPerSecond = 100)
+        # A read waiting for the read bucket doesn't hold back a scan
+        interactive = ArakoonAdmission._Waiter(PRIORITY_INTERACTIVE,
+                                               control._costs(CLASS_READ, 10))
+        control._waiters.append(interactive)
+        assert_equals( control.admit(_RANGE, 10, None), 0.0 )
+        assert_equals( control._cond.waits, [] )
+        # Nor does a lower priority waiting for the same bucket
+        control._waiters.remove(interactive)
+        control.setLimit(None, opsPerSecond = 100)
+        control.setPriority(CLASS_SCAN, PRIORITY_INTERACTIVE)
+        control.setPriority(CLASS_READ, PRIORITY_BULK)
+        bulk = ArakoonAdmission._Waiter(PRIORITY_BULK, control._costs(CLASS_READ, 10))
+        control._waiters.append(bulk)
+        assert_equals( control.admit(_RANGE, 10, None), 0.0 )
+        assert_equals( control._cond.waits, [] )
+        assert_raises( ValueError, control.setPriority, CLASS_SCAN, 7 )
+        assert_raises( ValueError, control.setPriority, 'other', PRIORITY_BULK )
+    _withClock(check)
+
+def test_change_limits():
+    def check(clock):
+        control = _control(clock, maxWait = 10.0)
+        control.setLimit(CLASS_READ, opsPerSecond = 1)
+        control.admit(_GET, 10, None)
+        assert_true( _close(control.admit(_GET, 10, None), 1.0) )
+        # A higher rate applies from the next request on
+        control.setLimit(CLASS_READ, opsPerSecond = 100)
+        assert_true( _close(control.admit(_GET, 10, None), 0.01) )
+        # A lower burst drops the tokens above it
+        clock.advance(10.0)
+        control.setLimit(CLASS_READ, opsPerSecond = 100, burst = 0.02)
+        control.admit(_GET, 10, None)
+        control.admit(_GET, 10, None)
+        assert_true( _close(control.admit(_GET, 10, None), 0.01) )
+        assert_raises( ValueError, control.setLimit, 'other', 1 )
+        assert_raises( ValueError, control.setLimit, CLASS_READ, 0 )
+    _withClock(check)
+
+def test_limit_removed_while_waiting():
+    def check(clock):
+        control = _control(clock)
+        control.setLimit(CLASS_READ, opsPerSecond = 1)
+        control.admit(_GET, 10, None)
+        control._cond.hook = lambda count: control.setLimit(CLASS_READ, None)
+        assert_true( _close(control.admit(_GET, 10, None), 1.0) )
+        control._cond.hook = None
+        assert_equals( control.admit(_GET, 10, None), 0.0 )
+    _withClock(check)
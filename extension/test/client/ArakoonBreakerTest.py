@@ -0,0 +1,177 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from nose.tools import *
+
+from arakoon import ArakoonBreaker
+from arakoon.Arakoon import ArakoonClient
+from arakoon.ArakoonBreaker import CircuitBreakers, CLOSED, OPEN, HALF_OPEN
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonProtocol import ArakoonClientConfig
+
+class _Clock :
+    # Stands in for the time module of ArakoonBreaker
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+def _withClock(f):
+    clock = _Clock()
+    saved = ArakoonBreaker.time
+    ArakoonBreaker.time = clock
+    try:
+        f(clock)
+    finally:
+        ArakoonBreaker.time = saved
+
+def _breakers():
+    return CircuitBreakers(failureRate = 0.5, minRequests = 4, window = 8,
+                           consecutiveFailures = 3, cooldown = 1.0, maxCooldown = 3.0)
+
+def test_invalid():
+    assert_raises( ValueError, CircuitBreakers, failureRate = 0.0 )
+    assert_raises( ValueError, CircuitBreakers, minRequests = 20, window = 10 )
+    assert_raises( ValueError, CircuitBreakers, cooldown = 5.0, maxCooldown = 1.0 )
+
+def test_consecutive_failures():
+    def check(clock):
+        # Only failures in a row count
+        breaker = CircuitBreakers(failureRate = 1.0, minRequests = 4, window = 8,
+                                  consecutiveFailures = 3).breaker("n0")
+        assert_equals( breaker.state(), CLOSED )
+        breaker.failure()
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        breaker.failure()
+        assert_equals( breaker.state(), CLOSED )
+        breaker.failure()
+        assert_equals( breaker.state(), OPEN )
+    _withClock(check)
+
+def test_failure_rate():
+    def check(clock):
+        breaker = _breakers().breaker("n0")
+        for i in range(8):
+            breaker.success()
+        # Never 3 in a row: opens once half of the last 8 failed
+        for i in range(3):
+            breaker.failure()
+            breaker.success()
+        assert_equals( breaker.state(), CLOSED )
+        assert_equals( breaker.statistics()['failure_rate'], 3 / 8.0 )
+        breaker.failure()
+        assert_equals( breaker.state(), OPEN )
+        assert_equals( breaker.statistics()['failure_rate'], 4 / 8.0 )
+    _withClock(check)
+
+def test_open_half_open_closed():
+    def check(clock):
+        breakers = _breakers()
+        breaker = breakers.breaker("n0")
+        for i in range(3):
+            breaker.failure()
+        # Rejects until the cooldown passed
+        assert_equals( breaker.acquire(), OPEN )
+        assert_false( breaker.available() )
+        assert_equals( breakers.available(["n0", "n1"]), ["n1"] )
+        clock.advance(1.0)
+        assert_true( breaker.available() )
+        # A single caller probes
+        assert_equals( breaker.acquire(), HALF_OPEN )
+        assert_equals( breaker.acquire(), OPEN )
+        assert_false( breaker.available() )
+        # Outcomes of requests sent before don't count
+        breaker.success()
+        assert_equals( breaker.state(), HALF_OPEN )
+        breaker.probed(True)
+        assert_equals( breaker.state(), CLOSED )
+        assert_equals( breaker.acquire(), CLOSED )
+        statistics = breakers.statistics()["n0"]
+        assert_equals( statistics['opened'], 1 )
+        assert_equals( statistics['rejected'], 2 )
+        assert_equals( statistics['failure_rate'], 0.0 )
+    _withClock(check)
+
+def test_failed_probe_doubles_cooldown():
+    def check(clock):
+        breaker = _breakers().breaker("n0")
+        for i in range(3):
+            breaker.failure()
+        cooldowns = []
+        for i in range(3):
+            clock.advance(breaker.statistics()['cooldown'])
+            assert_equals( breaker.acquire(), HALF_OPEN )
+            breaker.probed(False)
+            assert_equals( breaker.state(), OPEN )
+            cooldowns.append(breaker.statistics()['cooldown'])
+        assert_equals( cooldowns, [2.0, 3.0, 3.0] )
+        clock.advance(2.9)
+        assert_equals( breaker.acquire(), OPEN )
+        clock.advance(0.1)
+        assert_equals( breaker.acquire(), HALF_OPEN )
+        # A successful probe resets it
+        breaker.probed(True)
+        assert_equals( breaker.statistics()['cooldown'], 1.0 )
+    _withClock(check)
+
+def _client(breakers):
+    config = ArakoonClientConfig("breaker", {"node_0" : (["127.0.0.1"], 4000)})
+    client = ArakoonClient(config)
+    client.enableCircuitBreakers(breakers)
+    return client
+
+def test_probe():
+    def check(clock):
+        breakers = _breakers()
+        client = _client(breakers)
+        breaker = breakers.breaker("node_0")
+        for i in range(3):
+            breaker.failure()
+        clock.advance(1.0)
+        client._probe = lambda nodeId: False
+        assert_raises( ArakoonNodeUnavailable, client._passBreaker, "node_0", breaker )
+        assert_equals( breaker.state(), OPEN )
+        clock.advance(2.0)
+        client._probe = lambda nodeId: True
+        client._passBreaker("node_0", breaker)
+        assert_equals( breaker.state(), CLOSED )
+    _withClock(check)
+
+def test_interrupted_probe():
+    # A probe that doesn't return must not leave the breaker half-open
+    def check(clock):
+        breakers = _breakers()
+        client = _client(breakers)
+        breaker = breakers.breaker("node_0")
+        for i in range(3):
+            breaker.failure()
+        clock.advance(1.0)
+        def interrupted(nodeId):
+            raise KeyboardInterrupt()
+        client._probe = interrupted
+        assert_raises( KeyboardInterrupt, client._passBreaker, "node_0", breaker )
+        assert_equals( breaker.state(), OPEN )
+        # The next caller after the cooldown probes again
+        clock.advance(2.0)
+        assert_equals( breaker.acquire(), HALF_OPEN )
+    _withClock(check)
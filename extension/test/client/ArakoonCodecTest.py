@@ -0,0 +1,102 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from nose.tools import *
+
+from arakoon.ArakoonCodec import CompressionCodec, MAGIC, TAG_ESCAPED
+from arakoon.ArakoonCodec import _wrap
+from arakoon.ArakoonExceptions import ArakoonException
+from arakoon.ArakoonProtocol import Sequence, Set, Assert, Delete
+
+_LARGE = "0123456789abcdef" * 256
+
+def test_round_trip():
+    codec = CompressionCodec(threshold = 64)
+    stored = codec.encode(_LARGE)
+    assert_true( stored.startswith(MAGIC + 'z') )
+    assert_true( len(stored) < len(_LARGE) )
+    assert_equals( codec.decode(stored), _LARGE )
+    assert_equals( codec.encode(None), None )
+    assert_equals( codec.decode(None), None )
+
+def test_short_value_stored_as_is():
+    codec = CompressionCodec(threshold = 64)
+    value = "a" * 63
+    assert_equals( codec.encode(value), value )
+    assert_equals( codec.decode(value), value )
+    assert_equals( codec.statistics()['compressed'], 0 )
+
+def test_incompressible_value_stored_as_is():
+    codec = CompressionCodec(threshold = 4)
+    value = "".join(chr(i) for i in range(1, 40))
+    assert_equals( codec.encode(value), value )
+
+def test_plain_value_read():
+    # Written without a codec
+    codec = CompressionCodec()
+    for value in ["", "plain", _LARGE, MAGIC[:2], MAGIC]:
+        assert_equals( codec.decode(value), value )
+
+def test_magic_value_escaped():
+    codec = CompressionCodec(threshold = 64)
+    for value in [MAGIC, MAGIC + "z", MAGIC + "zshort", MAGIC + TAG_ESCAPED + "x",
+                  MAGIC + _LARGE]:
+        stored = codec.encode(value)
+        assert_true( stored.startswith(MAGIC) )
+        assert_equals( codec.decode(stored), value )
+
+def test_plain_value_looking_compressed():
+    # Written without a codec, and starting with MAGIC: there's no checksum
+    codec = CompressionCodec()
+    for value in [MAGIC + TAG_ESCAPED + "legacy", MAGIC + "z" + "not zlib",
+                  MAGIC + "?" + "unknown", MAGIC + "=", MAGIC + "z" + _LARGE]:
+        assert_equals( codec.decode(value), value )
+
+def test_damaged_value():
+    codec = CompressionCodec(threshold = 64)
+    stored = codec.encode(_LARGE)
+    # Not taken for an encoded value once a byte changed
+    damaged = stored[:10] + chr(ord(stored[10]) ^ 1) + stored[11:]
+    assert_equals( codec.decode(damaged), damaged )
+
+def test_undecodable_value():
+    codec = CompressionCodec()
+    assert_raises( ArakoonException, codec.decode, _wrap("z", "not zlib") )
+    assert_raises( ArakoonException, codec.decode, _wrap("?", "unknown") )
+
+def test_encode_sequence():
+    codec = CompressionCodec(threshold = 64)
+    inner = Sequence()
+    inner.addSet("b", MAGIC)
+    seq = Sequence()
+    seq.addSet("a", _LARGE)
+    seq.addAssert("a", _LARGE)
+    seq.addAssert("c", None)
+    seq.addDelete("d")
+    seq.addUpdate(inner)
+    encoded = codec.encodeSequence(seq)
+    updates = encoded._updates
+    assert_equals( [u.__class__ for u in updates], [Set, Assert, Assert, Delete, Sequence] )
+    assert_equals( codec.decode(updates[0]._value), _LARGE )
+    # An assert compares with the stored value, so it is encoded the same way
+    assert_equals( updates[1]._vo, updates[0]._value )
+    assert_equals( updates[2]._vo, None )
+    assert_equals( updates[3]._key, "d" )
+    assert_equals( codec.decode(updates[4]._updates[0]._value), MAGIC )
+    # The original is left alone
+    assert_equals( seq._updates[0]._value, _LARGE )
+    # Only the sets count as written
+    assert_equals( codec.statistics()['values'], 2 )
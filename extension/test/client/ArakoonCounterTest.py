@@ -0,0 +1,177 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+import time
+
+from nose.tools import *
+
+from arakoon.Arakoon import ArakoonClient
+from arakoon.ArakoonCounter import AdaptiveBackoff, compareAndSwap, Counter, ShardedCounter
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonProtocol import ArakoonClientConfig
+
+class _Store :
+    """
+    The keys of a cluster. Another writer changes a key before each of the
+    next 'conflicts' testAndSets.
+    """
+
+    def __init__(self, delay = 0.0):
+        self.data = {}
+        self.conflicts = 0
+        self.testAndSets = 0
+        self.delay = delay
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def client(self):
+        config = ArakoonClientConfig("counter", {"node_0" : (["127.0.0.1"], 4000)})
+        client = ArakoonClient(config)
+        client.testAndSet = self.testAndSet
+        client.multiGetOption = self.multiGetOption
+        client._sleep = self.sleep
+        return client
+
+    def multiGetOption(self, keys):
+        with self._lock:
+            return [self.data.get(key) for key in keys]
+
+    def testAndSet(self, key, oldValue, newValue):
+        time.sleep(self.delay)
+        with self._lock:
+            self.testAndSets += 1
+            if self.conflicts:
+                self.conflicts -= 1
+                self.data[key] = str(int(self.data.get(key) or 0) + 100)
+            current = self.data.get(key)
+            if current == oldValue:
+                if newValue is None:
+                    del self.data[key]
+                else:
+                    self.data[key] = newValue
+            return current
+
+    def sleep(self, period):
+        self.sleeps.append(period)
+        time.sleep(period)
+
+def test_backoff():
+    backoff = AdaptiveBackoff(base = 0.01, cap = 0.04)
+    ceilings = []
+    for i in range(4):
+        assert_true( 0.0 <= backoff.conflict() <= 0.04 )
+        ceilings.append(backoff._ceiling)
+    assert_equals( ceilings, [0.01, 0.02, 0.04, 0.04] )
+    backoff.success()
+    assert_equals( backoff._ceiling, 0.02 )
+    backoff.success()
+    backoff.success()
+    # Below the base: no backoff at all
+    assert_equals( backoff._ceiling, 0.0 )
+
+def test_compare_and_swap():
+    store = _Store()
+    client = store.client()
+    assert_equals( compareAndSwap(client, "k", lambda v: "a"), "a" )
+    assert_equals( compareAndSwap(client, "k", lambda v: v + "b"), "ab" )
+    assert_equals( store.testAndSets, 2 )
+    assert_equals( store.sleeps, [] )
+    assert_equals( compareAndSwap(client, "k", lambda v: None), None )
+    assert_false( "k" in store.data )
+
+def test_compare_and_swap_conflicts():
+    store = _Store()
+    client = store.client()
+    store.data["k"] = "1"
+    store.conflicts = 3
+    # Retries with the value testAndSet returned, without reading again
+    assert_equals( compareAndSwap(client, "k", lambda v: str(int(v) + 1), current = "1"), "302" )
+    assert_equals( store.testAndSets, 4 )
+    # Every sleep went through the client
+    assert_equals( len(store.sleeps), 3 )
+
+def test_compare_and_swap_gives_up():
+    store = _Store()
+    client = store.client()
+    store.conflicts = 1000
+    assert_raises( ArakoonAssertionFailed, compareAndSwap, client, "k", lambda v: "x",
+                   AdaptiveBackoff(0.0001, 0.0001), 5 )
+    assert_equals( store.testAndSets, 5 )
+
+def test_compare_and_swap_timeout():
+    store = _Store()
+    client = store.client()
+    store.conflicts = 1000
+    start = time.time()
+    assert_raises( ArakoonTimeout, compareAndSwap, client, "k", lambda v: "x",
+                   AdaptiveBackoff(0.05, 0.05), 1000, None, 0.2 )
+    assert_true( time.time() - start < 0.5 )
+    # No sleep beyond the deadline
+    assert_true( sum(store.sleeps) <= 0.2 + 1e-6 )
+
+def test_counter():
+    store = _Store()
+    counter = Counter(store.client(), "c")
+    assert_equals( counter.value(), 0 )
+    assert_equals( counter.increment(), 1 )
+    assert_equals( counter.increment(5), 6 )
+    assert_equals( counter.increment(-2), 4 )
+    assert_equals( counter.value(), 4 )
+
+def test_sharded_counter():
+    store = _Store()
+    counter = ShardedCounter(store.client(), "c", shards = 4)
+    for i in range(40):
+        counter.increment()
+    assert_equals( counter.value(), 40 )
+    assert_equals( sorted(store.data.keys()), ["c/0", "c/1", "c/2", "c/3"] )
+    assert_raises( ValueError, ShardedCounter, store.client(), "c", 0 )
+
+def test_sharded_counter_gives_up():
+    store = _Store()
+    counter = ShardedCounter(store.client(), "c", shards = 2, maxAttempts = 3)
+    store.conflicts = 1000
+    assert_raises( ArakoonAssertionFailed, counter.increment )
+    assert_equals( store.testAndSets, 3 )
+
+def test_sharded_counter_timeout():
+    store = _Store()
+    counter = ShardedCounter(store.client(), "c", shards = 2, maxAttempts = 100000)
+    store.conflicts = 100000
+    start = time.time()
+    assert_raises( ArakoonTimeout, counter.increment, 1, 0.2 )
+    assert_true( time.time() - start < 0.5 )
+
+def test_combine():
+    # While one thread updates a shard, the others add up their increments
+    store = _Store(delay = 0.02)
+    counter = ShardedCounter(store.client(), "c", shards = 1, combine = True)
+    threads = [threading.Thread(target = counter.increment) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert_equals( counter.value(), 20 )
+    assert_true( store.testAndSets < 20 )
+
+def test_combine_error():
+    store = _Store()
+    counter = ShardedCounter(store.client(), "c", shards = 1, combine = True, maxAttempts = 1)
+    store.conflicts = 1
+    assert_raises( ArakoonAssertionFailed, counter.increment )
+    counter.increment()
+    assert_equals( counter.value(), 101 )
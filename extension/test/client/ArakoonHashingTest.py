@@ -0,0 +1,72 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from nose.tools import *
+
+from arakoon.ArakoonHashing import HashRing
+
+_KEYS = ["key_%d" % i for i in range(5000)]
+
+def test_invalid():
+    assert_raises( ValueError, HashRing, [] )
+    assert_raises( ValueError, HashRing, ["a"], 0 )
+
+def test_members():
+    ring = HashRing(["c", "a", "b", "a"])
+    assert_equals( ring.members(), ["a", "b", "c"] )
+
+def test_preference():
+    ring = HashRing(["a", "b", "c"])
+    for key in _KEYS[:100]:
+        preference = ring.preference(key)
+        assert_equals( sorted(preference), ["a", "b", "c"] )
+        assert_equals( preference[0], ring.lookup(key) )
+
+def test_stable():
+    # The same members give the same ring, whatever their order
+    one = HashRing(["a", "b", "c"])
+    other = HashRing(["c", "b", "a"])
+    for key in _KEYS:
+        assert_equals( one.preference(key), other.preference(key) )
+
+def test_spread():
+    ring = HashRing(["a", "b", "c", "d"])
+    counts = {}
+    for key in _KEYS:
+        member = ring.lookup(key)
+        counts[member] = counts.get(member, 0) + 1
+    assert_equals( sorted(counts.keys()), ["a", "b", "c", "d"] )
+    for count in counts.values():
+        assert_true( 0.15 * len(_KEYS) < count < 0.35 * len(_KEYS) )
+
+def test_minimal_movement():
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+    moved = 0
+    for key in _KEYS:
+        if before.lookup(key) != after.lookup(key):
+            # Keys only move to the new member
+            assert_equals( after.lookup(key), "d" )
+            moved += 1
+    assert_true( 0.15 * len(_KEYS) < moved < 0.35 * len(_KEYS) )
+
+def test_removal_falls_back():
+    # Without a member, its keys go to the next member of their preference
+    full = HashRing(["a", "b", "c"])
+    reduced = HashRing(["a", "c"])
+    for key in _KEYS[:500]:
+        expected = [m for m in full.preference(key) if m != "b"]
+        assert_equals( reduced.preference(key), expected )
@@ -0,0 +1,94 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from nose.tools import *
+
+from arakoon.ArakoonHedging import HedgePolicy
+
+def _record(policy, latencies):
+    for latency in latencies:
+        policy.record(latency)
+
+def test_invalid():
+    assert_raises( ValueError, HedgePolicy, percentile = 0.0 )
+    assert_raises( ValueError, HedgePolicy, percentile = 100.0 )
+    assert_raises( ValueError, HedgePolicy, minDelay = 1.0, maxDelay = 0.5 )
+
+def test_max_delay_until_enough_samples():
+    policy = HedgePolicy(maxDelay = 0.5)
+    assert_equals( policy.delay(), 0.5 )
+    _record(policy, [0.001] * 19)
+    assert_equals( policy.delay(), 0.5 )
+    policy.record(0.001)
+    assert_equals( policy.delay(), 0.001 )
+
+def test_percentile():
+    # 1ms .. 20ms, in any order
+    latencies = [i / 1000.0 for i in range(20, 0, -1)]
+    policy = HedgePolicy(percentile = 95.0)
+    _record(policy, latencies)
+    assert_equals( policy.delay(), 0.020 )
+    policy = HedgePolicy(percentile = 50.0)
+    _record(policy, latencies)
+    assert_equals( policy.delay(), 0.011 )
+    policy = HedgePolicy(percentile = 10.0)
+    _record(policy, latencies)
+    assert_equals( policy.delay(), 0.003 )
+
+def test_bounds():
+    policy = HedgePolicy(minDelay = 0.005, maxDelay = 0.05)
+    _record(policy, [0.0001] * 20)
+    assert_equals( policy.delay(), 0.005 )
+    _record(policy, [1.0] * 200)
+    assert_equals( policy.delay(), 0.05 )
+
+def test_window():
+    # Only the recent latencies count
+    policy = HedgePolicy(percentile = 50.0, maxDelay = 10.0, window = 100)
+    _record(policy, [1.0] * 100)
+    assert_equals( policy.delay(), 1.0 )
+    _record(policy, [0.01] * 60)
+    assert_equals( policy.delay(), 0.01 )
+    assert_equals( len(policy._samples), 100 )
+
+def test_refreshed_every_tenth_of_the_window():
+    policy = HedgePolicy(percentile = 99.0, maxDelay = 10.0, window = 100)
+    _record(policy, [0.01] * 100)
+    policy._recompute()
+    # The 99th percentile moves with the first slow read, the delay only
+    # after a tenth of the window is new
+    _record(policy, [2.0] * 9)
+    assert_equals( policy.delay(), 0.01 )
+    policy.record(2.0)
+    assert_equals( policy.delay(), 2.0 )
+
+def test_statistics():
+    policy = HedgePolicy()
+    assert_equals( policy.statistics(), {'reads' : 0, 'hedged' : 0, 'hedge_wins' : 0,
+                                         'hedge_rate' : 0.0, 'win_rate' : 0.0,
+                                         'delay' : 0.5} )
+    _record(policy, [0.01] * 40)
+    policy.noteHedged(True)
+    policy.noteHedged(False)
+    policy.noteHedged(False)
+    policy.noteHedged(True)
+    statistics = policy.statistics()
+    assert_equals( statistics['reads'], 40 )
+    assert_equals( statistics['hedged'], 4 )
+    assert_equals( statistics['hedge_wins'], 2 )
+    assert_equals( statistics['hedge_rate'], 0.1 )
+    assert_equals( statistics['win_rate'], 0.5 )
+    assert_equals( statistics['delay'], 0.01 )
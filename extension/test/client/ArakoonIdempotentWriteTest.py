@@ -0,0 +1,106 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+import time
+
+from nose.tools import *
+
+from arakoon import ArakoonProtocol
+from arakoon.Arakoon import ArakoonClient, WRITE_MARKER_PREFIX
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonProtocol import ArakoonClientConfig
+from arakoon.ArakoonRetry import LinearBackoff
+
+_MARKER = re.compile(re.escape(WRITE_MARKER_PREFIX) + "[0-9a-f]{16}/[0-9a-f]{16}")
+
+class _Master :
+    """
+    Stands in for the master: applies the first sequence but loses the
+    reply, then is gone for a while.
+    """
+
+    def __init__(self, downFor):
+        self.downFor = downFor
+        self.downUntil = None
+        self.sequences = []
+        self.markers = set()
+
+    def send(self, msg):
+        if self.downUntil is not None and time.time() < self.downUntil:
+            raise ArakoonNoMaster()
+        return _Connection(self, msg)
+
+class _Connection :
+
+    def __init__(self, master, msg):
+        self._master = master
+        self._marker = _MARKER.search(msg).group(0)
+
+    def decodeVoidResult(self):
+        master = self._master
+        if self._marker in master.markers:
+            raise ArakoonAssertionFailed(self._marker)
+        master.sequences.append(self._marker)
+        master.markers.add(self._marker)
+        if master.downUntil is None:
+            master.downUntil = time.time() + master.downFor
+            raise ArakoonSockReadNoBytes()
+
+    def decodeBoolResult(self):
+        return self._marker in self._master.markers
+
+def _client(master):
+    config = ArakoonClientConfig("idempotent", {"node_0" : (["127.0.0.1"], 4000)})
+    client = ArakoonClient(config)
+    client.setRetryPolicy(LinearBackoff(0.05))
+    client.enableIdempotentWrites()
+    client._sendToMaster = master.send
+    return client
+
+def _withRetryPeriod(period, f):
+    saved = ArakoonProtocol.ARA_CFG_NO_MASTER_RETRY
+    ArakoonProtocol.ARA_CFG_NO_MASTER_RETRY = period
+    try:
+        f()
+    finally:
+        ArakoonProtocol.ARA_CFG_NO_MASTER_RETRY = saved
+
+def test_retry_keeps_marker():
+    master = _Master(0.2)
+    client = _client(master)
+    _withRetryPeriod(5, lambda: client.set("key", "value"))
+    assert_equals( len(master.sequences), 1 )
+
+def test_no_second_write_after_giving_up():
+    # The master is gone longer than the client retries: the write must
+    # not be sent again with a new marker once it is back
+    master = _Master(0.5)
+    client = _client(master)
+    check = lambda: assert_raises( ArakoonNoMaster, client.set, "key", "value" )
+    _withRetryPeriod(0.3, check)
+    assert_equals( len(master.sequences), 1 )
+    assert_equals( len(master.markers), 1 )
+
+def test_delete_and_sequence():
+    master = _Master(0.2)
+    client = _client(master)
+    _withRetryPeriod(5, lambda: client.delete("key"))
+    seq = client.makeSequence()
+    seq.addSet("a", "1")
+    seq.addDelete("b")
+    _withRetryPeriod(5, lambda: client.sequence(seq))
+    assert_equals( len(master.sequences), 2 )
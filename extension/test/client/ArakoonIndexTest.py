@@ -0,0 +1,173 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from nose.tools import *
+
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonIndex import SecondaryIndex, IndexedStore, INDEX_PREFIX
+from arakoon.ArakoonProtocol import Set, Delete, Assert
+
+class _Client :
+    """
+    The keys of a cluster, for the calls of an IndexedStore.
+    """
+
+    def __init__(self):
+        self.data = {}
+        # Called before the next sequence is applied
+        self.interleave = None
+
+    def get(self, key):
+        try:
+            return self.data[key]
+        except KeyError:
+            raise ArakoonNotFound(key)
+
+    def multiGetOption(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def range(self, begin, beginIncluded, end, endIncluded, maxElements):
+        keys = []
+        for key in sorted(self.data):
+            if begin is not None and (key < begin or (key == begin and not beginIncluded)):
+                continue
+            if end is not None and (key > end or (key == end and not endIncluded)):
+                break
+            keys.append(key)
+            if len(keys) == maxElements:
+                break
+        return keys
+
+    def sequence(self, seq, sync = False):
+        interleave = self.interleave
+        if interleave is not None:
+            self.interleave = None
+            interleave()
+        data = dict(self.data)
+        for update in seq._updates:
+            if isinstance(update, Set):
+                data[update._key] = update._value
+            elif isinstance(update, Delete):
+                if update._key not in data:
+                    raise ArakoonNotFound(update._key)
+                del data[update._key]
+            elif isinstance(update, Assert):
+                if data.get(update._key) != update._vo:
+                    raise ArakoonAssertionFailed(update._key)
+        self.data = data
+
+# Records are "city|age|tag,tag"
+
+def _city(value):
+    return [value.split("|")[0]]
+
+def _age(value):
+    return [int(value.split("|")[1])]
+
+def _tags(value):
+    return [tag for tag in value.split("|")[2].split(",") if tag]
+
+def _store():
+    client = _Client()
+    indexes = [SecondaryIndex("city", _city), SecondaryIndex("age", _age),
+               SecondaryIndex("tag", _tags)]
+    return client, IndexedStore(client, indexes)
+
+def _entries(client):
+    return len([k for k in client.data if k.startswith(INDEX_PREFIX)])
+
+def test_invalid():
+    client = _Client()
+    index = SecondaryIndex("city", _city)
+    assert_raises( ValueError, IndexedStore, client, [index, SecondaryIndex("city", _age)] )
+    store = IndexedStore(client, [index])
+    assert_raises( ValueError, store.lookup, "other", "Gent" )
+    assert_raises( ValueError, store.lookupRange, "other", 1, 2 )
+
+def test_put():
+    client, store = _store()
+    store.put("user/1", "Gent|30|a,b")
+    store.put("user/2", "Gent|40|b")
+    store.put("user/3", "Brussel|30|")
+    assert_equals( store.get("user/1"), "Gent|30|a,b" )
+    assert_equals( store.lookup("city", "Gent"), ["user/1", "user/2"] )
+    assert_equals( store.lookup("city", "Brussel"), ["user/3"] )
+    assert_equals( store.lookup("city", "Antwerpen"), [] )
+    assert_equals( store.lookup("age", 30), ["user/1", "user/3"] )
+    assert_equals( store.lookup("tag", "b"), ["user/1", "user/2"] )
+    assert_equals( store.lookup("city", "Gent", maxElements = 1), ["user/1"] )
+    # One entry per attribute of every index
+    assert_equals( _entries(client), 3 + 3 + 3 )
+
+def test_overwrite():
+    client, store = _store()
+    store.put("user/1", "Gent|30|a,b")
+    store.put("user/1", "Brussel|30|b,c")
+    assert_equals( store.lookup("city", "Gent"), [] )
+    assert_equals( store.lookup("city", "Brussel"), ["user/1"] )
+    assert_equals( store.lookup("age", 30), ["user/1"] )
+    assert_equals( store.lookup("tag", "a"), [] )
+    assert_equals( store.lookup("tag", "c"), ["user/1"] )
+    assert_equals( _entries(client), 1 + 1 + 2 )
+
+def test_delete():
+    client, store = _store()
+    store.put("user/1", "Gent|30|a,b")
+    store.put("user/2", "Gent|40|")
+    store.delete("user/1")
+    assert_raises( ArakoonNotFound, store.get, "user/1" )
+    assert_equals( store.lookup("city", "Gent"), ["user/2"] )
+    assert_equals( store.lookup("tag", "a"), [] )
+    assert_equals( _entries(client), 2 )
+    assert_raises( ArakoonNotFound, store.delete, "user/1" )
+
+def test_concurrent_change():
+    # Another writer changed the record between reading and writing it
+    client, store = _store()
+    store.put("user/1", "Gent|30|")
+    client.interleave = lambda: store.put("user/1", "Brussel|30|")
+    assert_raises( ArakoonAssertionFailed, store.put, "user/1", "Antwerpen|30|" )
+    assert_equals( store.lookup("city", "Antwerpen"), [] )
+    assert_equals( store.lookup("city", "Brussel"), ["user/1"] )
+    client.interleave = lambda: store.put("user/1", "Gent|31|")
+    assert_raises( ArakoonAssertionFailed, store.delete, "user/1" )
+    assert_equals( store.lookup("city", "Gent"), ["user/1"] )
+    assert_equals( store.lookup("age", 31), ["user/1"] )
+
+def test_lookup_range():
+    client, store = _store()
+    for (key, age) in (("a", 17), ("b", 30), ("c", 9), ("d", 100), ("e", 30), ("f", -3)):
+        store.put("user/" + key, "Gent|%d|" % age)
+    # In attribute order, numerically
+    assert_equals( store.lookupRange("age", 9, 31), ["user/c", "user/a", "user/b", "user/e"] )
+    assert_equals( store.lookupRange("age", -10, 10), ["user/f", "user/c"] )
+    assert_equals( store.lookupRange("age", 30, 100), ["user/b", "user/e"] )
+    assert_equals( store.lookupRange("age", 0, 1000, maxElements = 2), ["user/c", "user/a"] )
+    assert_equals( store.lookupRange("age", 200, 300), [] )
+
+def test_fetch():
+    client, store = _store()
+    store.put("user/1", "Gent|30|")
+    store.put("user/2", "Gent|40|")
+    store.put("user/3", "Brussel|50|")
+    assert_equals( store.fetch("city", "Gent"),
+                   [("user/1", "Gent|30|"), ("user/2", "Gent|40|")] )
+    assert_equals( store.fetchRange("age", 35, 60),
+                   [("user/2", "Gent|40|"), ("user/3", "Brussel|50|")] )
+    assert_equals( store.fetch("city", "Antwerpen"), [] )
+    # A record deleted since its entry was read is left out
+    del client.data["user/1"]
+    assert_equals( store.fetch("city", "Gent"), [("user/2", "Gent|40|")] )
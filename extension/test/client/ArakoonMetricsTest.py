@@ -0,0 +1,117 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import struct
+
+from nose.tools import *
+
+from arakoon.ArakoonMetrics import *
+from arakoon.ArakoonMetrics import _bucketBounds
+from arakoon.ArakoonProtocol import ARA_CMD_GET, ARA_CMD_SET
+
+_GET = struct.pack("I", ARA_CMD_GET)
+_SET = struct.pack("I", ARA_CMD_SET)
+
+def _bucketOf(seconds):
+    h = LatencyHistogram()
+    h.record(seconds)
+    return [i for (i, n) in enumerate(h._counts) if n][0]
+
+def test_bucket_placement():
+    for micros in range(0, 100) + [127, 128, 129, 1000, 1023, 1024, 65535, 10 ** 6, 10 ** 9]:
+        lower, upper = _bucketBounds(_bucketOf(micros / 1000000.0))
+        value = int(micros / 1000000.0 * 1000000)
+        assert_true( lower <= value < upper )
+        # Within 12.5%
+        assert_true( upper - lower <= max(1, lower / SUB_BUCKETS) )
+
+def test_buckets_are_contiguous():
+    for index in range(1, 40 * SUB_BUCKETS):
+        assert_equals( _bucketBounds(index)[0], _bucketBounds(index - 1)[1] )
+
+def test_percentile():
+    h = LatencyHistogram()
+    assert_equals( h.percentile(50), 0.0 )
+    for i in range(90):
+        h.record(0.001)
+    for i in range(10):
+        h.record(0.1)
+    assert_equals( h.getCount(), 100 )
+    # The upper bound of the bucket
+    assert_equals( h.percentile(50), 0.001024 )
+    assert_equals( h.percentile(90), 0.001024 )
+    # Never more than the maximum
+    assert_equals( h.percentile(99), 0.1 )
+    summary = h.summary()
+    assert_equals( summary['count'], 100 )
+    assert_equals( summary['max'], 0.1 )
+    assert_true( abs(summary['mean'] - 0.0109) < 1e-9 )
+
+def test_count_below():
+    h = LatencyHistogram()
+    for seconds in (0.00005, 0.0003, 0.002, 0.002, 0.7):
+        h.record(seconds)
+    assert_equals( h.countBelow(0.0001), 1 )
+    assert_equals( h.countBelow(0.001), 2 )
+    assert_equals( h.countBelow(0.0025), 4 )
+    assert_equals( h.countBelow(10.0), 5 )
+
+def test_command_name():
+    assert_equals( commandName(_GET), 'get' )
+    assert_equals( commandName(struct.pack("I", 0x7f)), '0x0000007f' )
+
+def _samples(text):
+    samples = {}
+    for line in text.splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = value
+    return samples
+
+def test_prometheus():
+    metrics = ClientMetrics()
+    metrics.recordRequest(_GET, 0.0003, False)
+    metrics.recordRequest(_GET, 0.003, False)
+    metrics.recordRequest(_SET, 0.2, True)
+    metrics.bytesSent = 123L
+    metrics.bytesReceived = 2 ** 70
+    metrics.retrySleep = 0.5
+    text = metrics.prometheus(labels = {'cluster' : 'ricky'})
+    assert_true( text.endswith('\n') )
+    samples = _samples(text)
+    # Cumulative buckets
+    get = 'arakoon_client_request_seconds_bucket{command="get",le="%s",cluster="ricky"}'
+    assert_equals( samples[get % '0.0001'], '0' )
+    assert_equals( samples[get % '0.0005'], '1' )
+    assert_equals( samples[get % '0.0025'], '1' )
+    assert_equals( samples[get % '0.005'], '2' )
+    assert_equals( samples[get % '+Inf'], '2' )
+    assert_equals( samples['arakoon_client_request_seconds_count{command="get",cluster="ricky"}'], '2' )
+    assert_equals( samples['arakoon_client_request_errors_total{command="set",cluster="ricky"}'], '1' )
+    # Integers without the L of a long, floats as floats
+    assert_equals( samples['arakoon_client_bytes_sent_total{cluster="ricky"}'], '123' )
+    assert_equals( samples['arakoon_client_bytes_received_total{cluster="ricky"}'], str(2 ** 70) )
+    assert_equals( samples['arakoon_client_retry_sleep_seconds_total{cluster="ricky"}'], '0.5' )
+    assert_equals( samples['arakoon_client_request_seconds_sum{command="set",cluster="ricky"}'], '0.2' )
+    for value in samples.values():
+        float(value)
+
+def test_prometheus_without_labels():
+    metrics = ClientMetrics()
+    samples = _samples(metrics.prometheus(prefix = 'x'))
+    assert_equals( samples['x_connects_total'], '0' )
+    assert_equals( samples['x_lock_wait_seconds_bucket{le="+Inf"}'], '0' )
+    assert_equals( samples['x_lock_wait_seconds_sum'], '0.0' )
@@ -0,0 +1,188 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import socket
+
+from nose.tools import *
+
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonMultiplexer import Multiplexer
+
+class _Connection :
+    # One end of a socket pair; the test answers on the other end
+
+    def __init__(self):
+        self._socket, self.peer = socket.socketpair()
+        self._connected = True
+        self.sent = []
+
+    def close(self):
+        if self._connected:
+            self._socket.close()
+            self._connected = False
+
+    def _hasBufferedReply(self):
+        return False
+
+class _FakeClient :
+
+    def __init__(self):
+        self._connections = {}
+        self._masterId = "master"
+        self.failSends = 0
+
+    def _determineMaster(self):
+        pass
+
+    def _sendMessage(self, nodeId, msg):
+        connection = self._connections.get(nodeId)
+        if connection is None:
+            connection = _Connection()
+            self._connections[nodeId] = connection
+        if self.failSends:
+            # As ArakoonClient does: the connection is dropped
+            self.failSends -= 1
+            connection.close()
+            del self._connections[nodeId]
+            raise ArakoonSockSendError()
+        connection.sent.append(msg)
+        return connection
+
+    def _dropConnection(self, nodeId):
+        connection = self._connections.pop(nodeId, None)
+        if connection is not None:
+            connection.close()
+
+def _decode(connection):
+    # Replies are 4 bytes
+    reply = connection._socket.recv(4)
+    if not reply:
+        raise ArakoonSockReadNoBytes()
+    return reply
+
+def _answer(client, nodeId, replies):
+    client._connections[nodeId].peer.sendall("".join(replies))
+
+def test_replies_in_order():
+    client = _FakeClient()
+    mux = Multiplexer()
+    try:
+        replies = [mux.submit(client, "req%d" % i, _decode, "n0", tag = i) for i in range(3)]
+        others = [mux.submit(client, "req%d" % i, _decode, "n1", tag = i) for i in range(2)]
+        assert_equals( mux.outstanding(), 5 )
+        _answer(client, "n1", ["b000", "b001"])
+        _answer(client, "n0", ["a000", "a001", "a002"])
+        completed = mux.waitAll(5.0)
+        assert_equals( len(completed), 5 )
+        assert_equals( [r.result() for r in replies], ["a000", "a001", "a002"] )
+        assert_equals( [r.result() for r in others], ["b000", "b001"] )
+        assert_equals( [r.tag for r in replies], [0, 1, 2] )
+        assert_equals( mux.outstanding(), 0 )
+    finally:
+        mux.close()
+
+def test_error_reply_keeps_connection():
+    client = _FakeClient()
+    def decode(connection):
+        if _decode(connection) == "fail":
+            raise ArakoonNotFound()
+        return "ok"
+    mux = Multiplexer()
+    try:
+        first = mux.submit(client, "req0", decode, "n0")
+        second = mux.submit(client, "req1", decode, "n0")
+        connection = client._connections["n0"]
+        _answer(client, "n0", ["fail", "good"])
+        mux.waitAll(5.0)
+        assert_true( isinstance(first.getError(), ArakoonNotFound) )
+        assert_equals( second.result(), "ok" )
+        assert_true( client._connections["n0"] is connection )
+    finally:
+        mux.close()
+
+def test_peer_reset():
+    client = _FakeClient()
+    mux = Multiplexer()
+    try:
+        lost = [mux.submit(client, "req%d" % i, _decode, "n0") for i in range(3)]
+        kept = mux.submit(client, "req", _decode, "n1")
+        client._connections["n0"].peer.close()
+        _answer(client, "n1", ["b000"])
+        completed = mux.waitAll(5.0)
+        assert_equals( len(completed), 4 )
+        for reply in lost:
+            assert_true( reply.done )
+            assert_true( isinstance(reply.getError(), ArakoonSocketException) )
+        assert_equals( kept.result(), "b000" )
+        assert_false( "n0" in client._connections )
+    finally:
+        mux.close()
+
+def test_reconnect_fails_queued_replies():
+    # A failed send drops the connection and the next one reconnects,
+    # usually on the same fd: what was queued on the old one must fail
+    client = _FakeClient()
+    mux = Multiplexer()
+    try:
+        queued = [mux.submit(client, "req%d" % i, _decode, "n0") for i in range(2)]
+        client.failSends = 1
+        failed = mux.submit(client, "req2", _decode, "n0")
+        assert_true( isinstance(failed.getError(), ArakoonSockSendError) )
+        last = mux.submit(client, "req3", _decode, "n0")
+        _answer(client, "n0", ["a003"])
+        completed = mux.waitAll(5.0)
+        assert_equals( len(completed), 3 )
+        for reply in queued:
+            assert_true( isinstance(reply.getError(), ArakoonSocketException) )
+        assert_equals( last.result(), "a003" )
+        assert_equals( mux.outstanding(), 0 )
+    finally:
+        mux.close()
+
+def test_close():
+    client = _FakeClient()
+    mux = Multiplexer()
+    replies = [mux.submit(client, "req%d" % i, _decode) for i in range(2)]
+    connection = client._connections["master"]
+    mux.close()
+    for reply in replies:
+        assert_true( reply.done )
+        assert_raises( ArakoonException, reply.result )
+    # Replies that still come can't be matched with requests anymore
+    assert_false( "master" in client._connections )
+    assert_false( connection._connected )
+
+def test_submit_failure():
+    client = _FakeClient()
+    client.failSends = 1
+    mux = Multiplexer()
+    try:
+        reply = mux.submit(client, "req", _decode, "n0")
+        assert_true( reply.done )
+        assert_equals( mux.outstanding(), 0 )
+        assert_equals( mux.waitAll(1.0), [] )
+    finally:
+        mux.close()
+
+def test_wait_timeout():
+    client = _FakeClient()
+    mux = Multiplexer()
+    try:
+        mux.submit(client, "req", _decode, "n0")
+        assert_equals( mux.wait(0.01), [] )
+        assert_raises( ArakoonTimeout, mux.waitAll, 0.05 )
+    finally:
+        mux.close()
@@ -0,0 +1,171 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+
+from nose.tools import *
+
+from arakoon.Arakoon import ArakoonClient
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonProtocol import ArakoonClientConfig, Sequence, Set, Delete, Assert
+from arakoon.ArakoonQueue import WorkQueue
+
+class _Store :
+    """
+    The keys of a cluster, for the range queries and sequences of a queue.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.sleeps = []
+        # Called before the next sequence is applied
+        self.interleave = None
+
+    def client(self):
+        config = ArakoonClientConfig("queue", {"node_0" : (["127.0.0.1"], 4000)})
+        client = ArakoonClient(config)
+        client.range_entries = self.range_entries
+        client.sequence = self.sequence
+        client._sleep = self.sleep
+        return client
+
+    def range_entries(self, begin, beginIncluded, end, endIncluded, maxElements):
+        entries = []
+        for key in sorted(self.data):
+            if begin is not None and (key < begin or (key == begin and not beginIncluded)):
+                continue
+            if end is not None and (key > end or (key == end and not endIncluded)):
+                break
+            entries.append((key, self.data[key]))
+            if len(entries) == maxElements:
+                break
+        return entries
+
+    def sequence(self, seq, sync = False):
+        interleave = self.interleave
+        if interleave is not None:
+            self.interleave = None
+            interleave()
+        data = dict(self.data)
+        for update in seq._updates:
+            if isinstance(update, Set):
+                data[update._key] = update._value
+            elif isinstance(update, Delete):
+                if update._key not in data:
+                    raise ArakoonNotFound(update._key)
+                del data[update._key]
+            elif isinstance(update, Assert):
+                if data.get(update._key) != update._vo:
+                    raise ArakoonAssertionFailed(update._key)
+        self.data = data
+
+    def sleep(self, period):
+        self.sleeps.append(period)
+        time.sleep(period)
+
+def _keepChanging(store):
+    # Somebody else changes the jobs before every claim
+    def collide():
+        for key in store.data:
+            store.data[key] = store.data[key] + "!"
+        store.interleave = collide
+    store.interleave = collide
+
+def test_claim_in_order():
+    store = _Store()
+    queue = WorkQueue(store.client(), "q")
+    ids = queue.enqueue(["a", "b", "c"])
+    assert_equals( len(ids), 3 )
+    assert_equals( queue.enqueue([]), [] )
+    jobs = queue.claim(1, window = 1)
+    assert_equals( [job.payload for job in jobs], ["a"] )
+    assert_equals( jobs[0].id, ids[0] )
+    jobs = queue.claim(5)
+    assert_equals( [job.payload for job in jobs], ["b", "c"] )
+    assert_equals( queue.claim(), [] )
+
+def test_ack():
+    store = _Store()
+    queue = WorkQueue(store.client(), "q")
+    queue.enqueue(["a", "b"])
+    jobs = queue.claim(2)
+    queue.ack(jobs)
+    assert_equals( store.data, {} )
+    # Acknowledged already
+    assert_raises( ArakoonAssertionFailed, queue.ack, jobs )
+
+def test_release():
+    store = _Store()
+    queue = WorkQueue(store.client(), "q")
+    queue.enqueue(["a", "b"])
+    first = queue.claim(1, window = 1)
+    queue.release(first)
+    # Back at its original place, ahead of b
+    jobs = queue.claim(1, window = 1)
+    assert_equals( [job.payload for job in jobs], ["a"] )
+    assert_equals( jobs[0].id, first[0].id )
+
+def test_requeue_expired():
+    store = _Store()
+    client = store.client()
+    queue = WorkQueue(client, "q", visibilityTimeout = 0.05)
+    other = WorkQueue(client, "q", visibilityTimeout = 60.0)
+    queue.enqueue(["a", "b"])
+    expiring = queue.claim(1, window = 1)
+    kept = other.claim(1, window = 1)
+    assert_equals( queue.requeueExpired(), 0 )
+    time.sleep(0.1)
+    assert_equals( queue.requeueExpired(), 1 )
+    # The claim was taken over
+    assert_raises( ArakoonAssertionFailed, queue.ack, expiring )
+    jobs = other.claim(1)
+    assert_equals( [job.payload for job in jobs], ["a"] )
+    other.ack(kept + jobs)
+    assert_equals( store.data, {} )
+
+def test_colliding_consumers():
+    store = _Store()
+    client = store.client()
+    queue = WorkQueue(client, "q")
+    other = WorkQueue(client, "q")
+    queue.enqueue(["a", "b"])
+    taken = []
+    # The other consumer claims the head between our read and our claim
+    store.interleave = lambda: taken.extend(other.claim(1, window = 1))
+    jobs = queue.claim(1, window = 1)
+    assert_equals( [job.payload for job in taken], ["a"] )
+    assert_equals( [job.payload for job in jobs], ["b"] )
+    # The retry slept through the client
+    assert_equals( len(store.sleeps), 1 )
+
+def test_claim_gives_up():
+    store = _Store()
+    client = store.client()
+    queue = WorkQueue(client, "q")
+    queue.enqueue(["a"])
+    _keepChanging(store)
+    assert_raises( ArakoonAssertionFailed, queue.claim, 1, None, 3 )
+    assert_equals( len(store.sleeps), 2 )
+
+def test_claim_timeout():
+    store = _Store()
+    client = store.client()
+    queue = WorkQueue(client, "q")
+    queue.enqueue(["a"])
+    _keepChanging(store)
+    start = time.time()
+    assert_raises( ArakoonTimeout, queue.claim, 1, None, 1000000, 0.1 )
+    assert_true( time.time() - start < 0.5 )
@@ -0,0 +1,128 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from nose.tools import *
+
+from arakoon.Arakoon import ArakoonClient, retryDuringMasterReelection
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonProtocol import ArakoonClientConfig
+from arakoon.ArakoonRetry import RetryPolicy, LinearBackoff, ExponentialBackoff, DecorrelatedJitter
+
+class _Calls :
+    # Raises the given errors, one per call, then returns "ok"
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.count = 0
+
+    def __call__(self, client):
+        self.count += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+def _client():
+    config = ArakoonClientConfig("retry", {"node_0" : (["127.0.0.1"], 4000)})
+    client = ArakoonClient(config)
+    client.setRetryPolicy(LinearBackoff(step = 0.001))
+    return client
+
+def _wrapped(is_read_only, calls):
+    @retryDuringMasterReelection(is_read_only)
+    def call(self):
+        return calls(self)
+    return call
+
+def test_first_attempt():
+    calls = _Calls()
+    assert_equals( _wrapped(False, calls)(_client()), "ok" )
+    assert_equals( calls.count, 1 )
+
+def test_retried_after_first_failure():
+    calls = _Calls(ArakoonNoMaster(), ArakoonNodeNotMaster())
+    assert_equals( _wrapped(False, calls)(_client()), "ok" )
+    assert_equals( calls.count, 3 )
+    calls = _Calls(ArakoonSockSendError(), ArakoonGoingDown())
+    assert_equals( _wrapped(True, calls)(_client()), "ok" )
+    assert_equals( calls.count, 3 )
+
+def test_write_not_resent():
+    # A write that may have reached the master raises the error of the
+    # first attempt itself
+    error = ArakoonSockRecvError()
+    calls = _Calls(error)
+    try:
+        _wrapped(False, calls)(_client())
+    except ArakoonSockRecvError, ex:
+        assert_true( ex is error )
+    else:
+        assert_true( False )
+    assert_equals( calls.count, 1 )
+
+def test_not_retriable():
+    calls = _Calls(ArakoonNotFound("k"))
+    assert_raises( ArakoonNotFound, _wrapped(True, calls), _client() )
+    assert_equals( calls.count, 1 )
+
+def test_timeout():
+    calls = _Calls(*[ArakoonNoMaster() for i in range(1000)])
+    call = _wrapped(True, calls)
+    assert_raises( ArakoonTimeout, call, _client(), timeout = 0.05 )
+    assert_true( 1 < calls.count < 1000 )
+
+def _delays(policy, count):
+    delays = []
+    previous = 0.0
+    for attempt in range(count):
+        previous = policy.delay(attempt, previous)
+        delays.append(previous)
+    return delays
+
+def test_abstract_policy():
+    assert_raises( NotImplementedError, RetryPolicy().delay, 0, 0.0 )
+
+def test_linear_backoff():
+    delays = _delays(LinearBackoff(step = 0.2), 5)
+    expected = [0.0, 0.2, 0.4, 0.6, 0.8]
+    for (delay, e) in zip(delays, expected):
+        assert_true( abs(delay - e) < 1e-9 )
+
+def test_exponential_backoff():
+    assert_equals( _delays(ExponentialBackoff(base = 0.05, cap = 2.0, jitter = False), 8),
+                   [0.05, 0.1, 0.2, 0.4, 0.8, 1.6, 2.0, 2.0] )
+    # Huge attempt counts stay capped
+    assert_equals( ExponentialBackoff(jitter = False).delay(10000, 0.0), 2.0 )
+    policy = ExponentialBackoff(base = 0.05, cap = 2.0, jitter = True)
+    for attempt in range(12):
+        ceiling = min(2.0, 0.05 * 2 ** attempt)
+        delays = [policy.delay(attempt, 0.0) for i in range(200)]
+        assert_true( min(delays) >= 0.0 )
+        assert_true( max(delays) <= ceiling )
+        # Full jitter: spread over the whole range
+        assert_true( max(delays) - min(delays) > ceiling / 2 )
+
+def test_decorrelated_jitter():
+    policy = DecorrelatedJitter(base = 0.05, cap = 2.0)
+    for run in range(50):
+        previous = 0.0
+        for attempt in range(20):
+            delay = policy.delay(attempt, previous)
+            assert_true( 0.05 <= delay <= min(2.0, max(0.05, previous * 3)) )
+            previous = delay
+    # The first sleep is the base, later ones grow towards the cap
+    assert_equals( policy.delay(0, 0.0), 0.05 )
+    assert_true( max(max(_delays(policy, 50)) for run in range(10)) > 1.0 )
+    assert_true( policy.delay(5, 100.0) <= 2.0 )
@@ -0,0 +1,307 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+
+from nose.tools import *
+
+from arakoon import ArakoonSharding
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonProtocol import ArakoonClientConfig, Sequence, Set, Delete, Assert
+from arakoon.ArakoonSharding import ShardedClient, MOVED_PREFIX
+
+class _FakeClient :
+    """
+    A cluster in memory, for the calls ShardedClient makes on one key or
+    one cluster.
+    """
+
+    def __init__(self, config):
+        self.clusterId = config.getClusterId()
+        self.data = {}
+        self._writeMarkerPrefix = None
+        self._codec = None
+
+    def get(self, key):
+        try:
+            return self.data[key]
+        except KeyError:
+            raise ArakoonNotFound(key)
+
+    def exists(self, key):
+        return key in self.data
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.get(key)
+        del self.data[key]
+
+    def testAndSet(self, key, oldValue, newValue):
+        current = self.data.get(key)
+        if current == oldValue:
+            if newValue is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = newValue
+        return current
+
+    def multiGetOption(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def sequence(self, seq, sync = False):
+        data = dict(self.data)
+        self._apply(seq, data)
+        self.data = data
+
+    def _apply(self, seq, data):
+        for update in seq._updates:
+            if isinstance(update, Set):
+                data[update._key] = update._value
+            elif isinstance(update, Delete):
+                if update._key not in data:
+                    raise ArakoonNotFound(update._key)
+                del data[update._key]
+            elif isinstance(update, Assert):
+                if data.get(update._key) != update._vo:
+                    raise ArakoonAssertionFailed(update._key)
+            elif isinstance(update, Sequence):
+                self._apply(update, data)
+
+    def range_entries(self, begin, beginIncluded, end, endIncluded, maxElements):
+        keys = sorted(k for k in self.data
+                      if begin is None or k > begin or (k == begin and beginIncluded))
+        return [(k, self.data[k]) for k in keys[:maxElements]]
+
+    def deletePrefix(self, prefix):
+        keys = [k for k in self.data if k.startswith(prefix)]
+        for k in keys:
+            del self.data[k]
+        return len(keys)
+
+    def dropConnections(self):
+        pass
+
+def _config(clusterId):
+    return ArakoonClientConfig(clusterId, {"%s_0" % clusterId : (["127.0.0.1"], 4000)})
+
+def _withFakes(f, *args):
+    # Clusters the ShardedClient creates are fakes
+    saved = ArakoonSharding.ArakoonClient
+    ArakoonSharding.ArakoonClient = _FakeClient
+    try:
+        return f(*args)
+    finally:
+        ArakoonSharding.ArakoonClient = saved
+
+def _sharded(n):
+    return _withFakes(ShardedClient, [_config("shard%d" % i) for i in range(n)])
+
+def _addShard(client, clusterId):
+    _withFakes(client.addShard, _config(clusterId))
+
+def _keyOn(client, shard, exclude = ()):
+    for i in range(10000):
+        key = "key_%d" % i
+        if client.getShard(key) == shard and key not in exclude:
+            return key
+
+def test_duplicate_cluster():
+    assert_raises( ArakoonInvalidConfig, _withFakes, ShardedClient, [_config("a"), _config("a")] )
+
+def test_keys_go_to_their_shard():
+    client = _sharded(3)
+    for i in range(300):
+        client.set("key_%d" % i, "value_%d" % i)
+    clients = client.getClients()
+    for shard, c in clients.items():
+        assert_true( c.data )
+        for key in c.data:
+            assert_equals( client.getShard(key), shard )
+    assert_equals( client.get("key_7"), "value_7" )
+    assert_true( client.exists("key_7") )
+    client.delete("key_7")
+    assert_false( client.exists("key_7") )
+    assert_raises( ArakoonNotFound, client.get, "key_7" )
+    assert_raises( ArakoonNotFound, client.delete, "key_7" )
+
+def test_single_shard_sequence():
+    client = _sharded(3)
+    first = _keyOn(client, "shard1")
+    second = _keyOn(client, "shard1", [first])
+    seq = client.makeSequence()
+    seq.addSet(first, "1")
+    seq.addSet(second, "2")
+    client.sequence(seq)
+    missing = _keyOn(client, "shard1", [first, second])
+    assert_equals( client.multiGetOption([first, second, missing]), ["1", "2", None] )
+    assert_raises( ArakoonNotFound, client.multiGet, [first, missing] )
+    seq = client.makeSequence()
+    seq.addAssert(first, "wrong")
+    seq.addDelete(second)
+    assert_raises( ArakoonAssertionFailed, client.sequence, seq )
+    assert_equals( client.get(second), "2" )
+
+def test_sequence_rejects_unkeyed_updates():
+    client = _sharded(2)
+    seq = client.makeSequence()
+    seq.addUpdate(Sequence())
+    client.sequence(seq)
+    class Unkeyed(Set):
+        def __init__(self):
+            pass
+    seq.addUpdate(Unkeyed())
+    assert_raises( ArakoonBadInput, client.sequence, seq )
+
+def test_rebalance():
+    client = _sharded(3)
+    keys = ["key_%d" % i for i in range(300)]
+    for key in keys:
+        client.set(key, key)
+    _addShard(client, "shard3")
+    assert_raises( ArakoonException, _addShard, client, "shard4" )
+    moving = [key for key in keys if client.getShard(key) == "shard3"]
+    assert_true( moving )
+    # Readable while they are still on the old cluster
+    for key in moving:
+        assert_equals( client.get(key), key )
+        assert_true( client.exists(key) )
+    # A write moves the key first
+    client.set(moving[0], "new")
+    client.delete(moving[1])
+    assert_equals( client.rebalance(), len(moving) - 2 )
+    for shard, c in client.getClients().items():
+        for key in c.data:
+            assert_equals( client.getShard(key), shard )
+    assert_equals( client.get(moving[0]), "new" )
+    assert_false( client.exists(moving[1]) )
+    assert_equals( client.get(moving[2]), moving[2] )
+    assert_equals( client.rebalance(), 0 )
+
+def test_no_resurrection():
+    # A move that read the value before the key was moved and deleted by
+    # another write must not bring it back
+    client = _sharded(3)
+    keys = ["key_%d" % i for i in range(300)]
+    for key in keys:
+        client.set(key, key)
+    _addShard(client, "shard3")
+    key = [k for k in keys if client.getShard(k) == "shard3"][0]
+    source = client._source(key)
+    client.delete(key)
+    client._move(key, source, key)
+    assert_false( client.exists(key) )
+    # Nor overwrite a newer value
+    other = [k for k in keys if client.getShard(k) == "shard3"][1]
+    client.set(other, "newer")
+    client._move(other, client._source(other), other)
+    assert_equals( client.get(other), "newer" )
+    client.rebalance()
+    assert_false( client.exists(key) )
+    for c in client.getClients().values():
+        assert_false( [k for k in c.data if k.startswith(MOVED_PREFIX)] )
+
+# The branch that sends to several clusters at once needs real connections:
+# these tests run against stand-in clusters
+
+def _standin():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', '..', '..', 'tools', 'benchmark')
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    import standin_server
+    return standin_server
+
+def _withClusters(n, f):
+    standin = _standin()
+    clusters = [standin.Cluster("shard%d" % i, 1) for i in range(n)]
+    for cluster in clusters:
+        cluster.start()
+    try:
+        f(clusters)
+    finally:
+        for cluster in clusters:
+            cluster.stop()
+
+def _standinConfig(cluster):
+    return ArakoonClientConfig(cluster.clusterId, cluster.clientNodes())
+
+def _requests(clusters):
+    return [c.node("sturdy_0").requests for c in clusters]
+
+def test_multi_shard_multi_get():
+    def check(clusters):
+        client = ShardedClient([_standinConfig(c) for c in clusters[:3]])
+        keys = ["key_%d" % i for i in range(60)]
+        for key in keys:
+            client.set(key, "v" + key)
+        before = _requests(clusters)
+        values = client.multiGetOption(keys + ["missing"])
+        assert_equals( values, ["v" + key for key in keys] + [None] )
+        # One request per cluster
+        assert_equals( [a - b for (a, b) in zip(_requests(clusters), before)], [1, 1, 1] )
+        assert_raises( ArakoonNotFound, client.multiGet, keys + ["missing"] )
+        client.dropConnections()
+    _withClusters(3, check)
+
+def test_multi_shard_sequence():
+    def check(clusters):
+        client = ShardedClient([_standinConfig(c) for c in clusters])
+        keys = ["key_%d" % i for i in range(30)]
+        seq = client.makeSequence()
+        for key in keys:
+            seq.addSet(key, key)
+        client.sequence(seq)
+        for cluster in clusters:
+            assert_true( cluster.store.data )
+            for key in cluster.store.data:
+                assert_equals( client.getShard(key), cluster.clusterId )
+        # An assert only guards the part on its own cluster
+        failing = keys[0]
+        elsewhere = [k for k in keys if client.getShard(k) != client.getShard(failing)][0]
+        seq = client.makeSequence()
+        seq.addAssert(failing, "wrong")
+        seq.addSet(failing, "changed")
+        seq.addSet(elsewhere, "changed")
+        assert_raises( ArakoonAssertionFailed, client.sequence, seq )
+        assert_equals( client.get(failing), failing )
+        assert_equals( client.get(elsewhere), "changed" )
+        client.dropConnections()
+    _withClusters(3, check)
+
+def test_multi_shard_rebalance():
+    def check(clusters):
+        client = ShardedClient([_standinConfig(c) for c in clusters[:3]])
+        keys = ["key_%d" % i for i in range(200)]
+        for key in keys:
+            client.set(key, key)
+        client.addShard(_standinConfig(clusters[3]))
+        assert_false( clusters[3].store.data )
+        # Reads during the rebalance find the keys on their old cluster
+        assert_equals( client.multiGetOption(keys), keys )
+        moving = [k for k in keys if client.getShard(k) == "shard3"]
+        client.delete(moving[0])
+        assert_equals( client.rebalance(), len(moving) - 1 )
+        for cluster in clusters:
+            for key in cluster.store.data:
+                assert_equals( client.getShard(key), cluster.clusterId )
+        expected = list(keys)
+        expected[keys.index(moving[0])] = None
+        assert_equals( client.multiGetOption(keys), expected )
+        client.dropConnections()
+    _withClusters(4, check)
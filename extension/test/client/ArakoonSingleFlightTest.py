@@ -0,0 +1,140 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+import time
+
+from nose.tools import *
+
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonSingleFlight import SingleFlight
+
+class _Read :
+    """
+    A read that blocks until the test releases it, then returns (or raises)
+    what the test set.
+    """
+
+    def __init__(self, result = None, error = None):
+        self.result = result
+        self.error = error
+        self.release = threading.Event()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        with self._lock:
+            self.calls += 1
+            first = self.calls == 1
+        if first:
+            # Only the first call is slow, later ones are the waiters' own
+            self.release.wait(5.0)
+            if self.error is not None:
+                raise self.error
+        return self.result
+
+def _start(group, read, count, key = "k", deadline = None):
+    # The first caller leads, the others wait for it; returns their outcomes
+    outcomes = [None] * count
+    def run(i):
+        try:
+            outcomes[i] = ('ok', group.do(key, deadline, read, i))
+        except Exception, ex:
+            outcomes[i] = ('error', ex)
+    threads = [threading.Thread(target = run, args = (i,)) for i in range(count)]
+    threads[0].start()
+    _until(lambda: read.calls == 1)
+    for t in threads[1:]:
+        t.start()
+    _until(lambda: group.statistics()['shared'] >= count - 1)
+    return threads, outcomes
+
+def _until(condition):
+    limit = time.time() + 5.0
+    while not condition():
+        assert_true( time.time() < limit )
+        time.sleep(0.001)
+
+def _join(threads):
+    for t in threads:
+        t.join(5.0)
+        assert_false( t.isAlive() )
+
+def test_shared_result():
+    group = SingleFlight()
+    read = _Read(result = ["a", "b"])
+    threads, outcomes = _start(group, read, 5)
+    read.release.set()
+    _join(threads)
+    assert_equals( read.calls, 1 )
+    assert_equals( outcomes, [('ok', ["a", "b"])] * 5 )
+    # Each caller has its own copy of a list
+    assert_equals( len(set(id(result) for (kind, result) in outcomes[1:])), 4 )
+    statistics = group.statistics()
+    assert_equals( statistics['reads'], 5 )
+    assert_equals( statistics['shared'], 4 )
+    assert_equals( statistics['shared_ratio'], 0.8 )
+    # Once done, the next read sends a request of its own
+    assert_equals( group.do("k", None, read), ["a", "b"] )
+    assert_equals( read.calls, 2 )
+
+def test_other_keys_not_shared():
+    group = SingleFlight()
+    read = _Read(result = "v")
+    threads, outcomes = _start(group, read, 1)
+    assert_equals( group.do("other", None, read), "v" )
+    assert_equals( read.calls, 2 )
+    read.release.set()
+    _join(threads)
+
+def test_shared_error():
+    group = SingleFlight()
+    error = ArakoonNotFound("k")
+    read = _Read(error = error)
+    threads, outcomes = _start(group, read, 4)
+    read.release.set()
+    _join(threads)
+    assert_equals( read.calls, 1 )
+    for (kind, ex) in outcomes:
+        assert_equals( kind, 'error' )
+        assert_true( ex is error )
+
+def test_leader_timeout_not_shared():
+    # The leader ran out of its own time: the waiters read themselves
+    group = SingleFlight()
+    read = _Read(result = "v", error = ArakoonTimeout())
+    threads, outcomes = _start(group, read, 4)
+    read.release.set()
+    _join(threads)
+    assert_equals( read.calls, 4 )
+    assert_equals( outcomes[0][0], 'error' )
+    assert_true( isinstance(outcomes[0][1], ArakoonTimeout) )
+    assert_equals( outcomes[1:], [('ok', "v")] * 3 )
+
+def test_waiter_deadline():
+    # A waiter gives up at its own deadline, the leader carries on
+    group = SingleFlight()
+    read = _Read(result = "v")
+    threads, outcomes = _start(group, read, 1)
+    start = time.time()
+    assert_raises( ArakoonTimeout, group.do, "k", time.time() + 0.05, read )
+    assert_true( 0.04 < time.time() - start < 1.0 )
+    # Already past its deadline: doesn't wait at all
+    assert_raises( ArakoonTimeout, group.do, "k", time.time() - 1.0, read )
+    read.release.set()
+    _join(threads)
+    assert_equals( outcomes, [('ok', "v")] )
+    assert_equals( read.calls, 1 )
@@ -0,0 +1,185 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from nose.tools import *
+
+from arakoon.Arakoon import ArakoonClient
+from arakoon.ArakoonExceptions import *
+from arakoon.ArakoonProtocol import ArakoonClientConfig, Set, Delete, Assert
+from arakoon.ArakoonTransaction import Transaction, runTransaction
+
+class _Store :
+    """
+    The keys of a cluster, for the reads and the commit of a transaction.
+    """
+
+    def __init__(self, data = None):
+        self.data = dict(data or {})
+        self.reads = []
+        self.sequences = []
+        self.sleeps = []
+        # Called before the next sequence is applied
+        self.interleave = None
+
+    def client(self):
+        config = ArakoonClientConfig("tx", {"node_0" : (["127.0.0.1"], 4000)})
+        client = ArakoonClient(config)
+        client.multiGetOption = self.multiGetOption
+        client.sequence = self.sequence
+        client._sleep = self.sleeps.append
+        return client
+
+    def multiGetOption(self, keys):
+        self.reads.append(list(keys))
+        return [self.data.get(key) for key in keys]
+
+    def sequence(self, seq, sync = False):
+        self.sequences.append(seq)
+        interleave = self.interleave
+        if interleave is not None:
+            self.interleave = None
+            interleave()
+        data = dict(self.data)
+        for update in seq._updates:
+            if isinstance(update, Set):
+                data[update._key] = update._value
+            elif isinstance(update, Delete):
+                if update._key not in data:
+                    raise ArakoonNotFound(update._key)
+                del data[update._key]
+            elif isinstance(update, Assert):
+                if data.get(update._key) != update._vo:
+                    raise ArakoonAssertionFailed(update._key)
+        self.data = data
+
+def _asserted(seq):
+    return sorted(u._key for u in seq._updates if isinstance(u, Assert))
+
+def test_read_your_writes():
+    store = _Store({"a" : "1", "b" : "2"})
+    tx = Transaction(store.client())
+    tx.set("a", "10")
+    assert_equals( tx.get("a"), "10" )
+    tx.delete("b")
+    assert_false( tx.exists("b") )
+    assert_equals( tx.getOption("b"), None )
+    assert_raises( ArakoonNotFound, tx.get, "b" )
+    assert_equals( tx.multiGetOption(["a", "b", "c"]), ["10", None, None] )
+    # Nothing is written before the commit
+    assert_equals( store.data, {"a" : "1", "b" : "2"} )
+    tx.commit()
+    assert_equals( store.data, {"a" : "10"} )
+    assert_raises( ArakoonException, tx.get, "a" )
+    assert_raises( ArakoonException, tx.commit )
+
+def test_reads_once():
+    store = _Store({"a" : "1", "b" : "2"})
+    tx = Transaction(store.client())
+    assert_equals( tx.multiGetOption(["a", "b", "a"]), ["1", "2", "1"] )
+    assert_equals( tx.get("a"), "1" )
+    assert_equals( tx.getOption("c"), None )
+    assert_equals( [sorted(keys) for keys in store.reads], [["a", "b"], ["c"]] )
+
+def test_commit_asserts_reads():
+    store = _Store({"a" : "1", "b" : "2"})
+    tx = Transaction(store.client())
+    tx.get("a")
+    tx.getOption("missing")
+    tx.set("b", "3")
+    tx.commit()
+    # Only what was read is asserted, the blind write isn't
+    assert_equals( _asserted(store.sequences[0]), ["a", "missing"] )
+    assert_equals( store.data, {"a" : "1", "b" : "3"} )
+
+def test_conflict():
+    store = _Store({"a" : "1"})
+    tx = Transaction(store.client())
+    tx.set("b", tx.get("a"))
+    store.data["a"] = "changed"
+    assert_raises( ArakoonAssertionFailed, tx.commit )
+    assert_false( "b" in store.data )
+
+def test_read_only_commit():
+    store = _Store({"a" : "1"})
+    tx = Transaction(store.client())
+    tx.get("a")
+    store.data["a"] = "changed"
+    assert_raises( ArakoonAssertionFailed, tx.commit )
+    assert_equals( store.sequences, [] )
+    Transaction(store.client()).commit()
+    assert_equals( len(store.reads), 2 )
+
+def test_delete():
+    store = _Store({"a" : "1"})
+    tx = Transaction(store.client())
+    tx.delete("a")
+    assert_raises( ArakoonNotFound, tx.delete, "a" )
+    assert_raises( ArakoonNotFound, tx.delete, "missing" )
+    tx.commit()
+    assert_equals( store.data, {} )
+
+def test_delete_own_write():
+    # Deleting what the transaction wrote doesn't read the stored value
+    store = _Store({"a" : "1"})
+    tx = Transaction(store.client())
+    tx.set("a", "2")
+    tx.set("b", "2")
+    tx.delete("a")
+    tx.delete("b")
+    assert_equals( store.reads, [] )
+    assert_raises( ArakoonNotFound, tx.delete, "a" )
+    tx.commit()
+    assert_equals( _asserted(store.sequences[0]), [] )
+    assert_equals( store.data, {} )
+
+def test_run_transaction_retries():
+    store = _Store({"counter" : "0"})
+    client = store.client()
+    calls = []
+    def increment(tx):
+        calls.append(tx)
+        value = int(tx.get("counter")) + 1
+        tx.set("counter", str(value))
+        return value
+    # Another writer commits between our read and our commit, twice
+    def collide():
+        store.data["counter"] = str(int(store.data["counter"]) + 10)
+        if len(store.sequences) < 2:
+            store.interleave = collide
+    store.interleave = collide
+    assert_equals( runTransaction(client, increment), 21 )
+    assert_equals( store.data["counter"], "21" )
+    assert_equals( len(calls), 3 )
+    # A fresh transaction each time, and a sleep between attempts
+    assert_equals( len(set(id(tx) for tx in calls)), 3 )
+    assert_equals( len(store.sleeps), 2 )
+
+def test_run_transaction_gives_up():
+    store = _Store({"a" : "0"})
+    client = store.client()
+    def collide():
+        store.data["a"] = store.data["a"] + "!"
+        store.interleave = collide
+    store.interleave = collide
+    def update(tx):
+        tx.set("b", tx.get("a"))
+    assert_raises( ArakoonAssertionFailed, runTransaction, client, update, 3 )
+    assert_equals( len(store.sequences), 3 )
+    assert_equals( len(store.sleeps), 2 )
+    # Other errors aren't retried
+    def missing(tx):
+        tx.get("missing")
+    assert_raises( ArakoonNotFound, runTransaction, client, missing )
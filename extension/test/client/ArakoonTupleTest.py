@@ -0,0 +1,87 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import random
+
+from nose.tools import *
+
+from arakoon import ArakoonTuple
+
+UT_TUPLES = [
+    (),
+    (None,),
+    ("",),
+    ("a\x00b",),
+    (u"caf\xe9",),
+    (0,), (1,), (-1,), (255,), (256,), (-255,), (-256,),
+    (2**63,), (-2**63,), (2**70,), (-2**70,),
+    (0.0,), (-0.0,), (1.5,), (-1.5,), (1e300,), (-1e-300,),
+    (True,), (False,),
+    (("nested", None, (1, 2)), "after"),
+    ("user", 17, 1404000000.25, u"event"),
+    ]
+
+def test_pack_unpack():
+    for t in UT_TUPLES:
+        assert_equals( ArakoonTuple.unpack( ArakoonTuple.pack( t ) ), t )
+
+def test_known_encodings():
+    assert_equals( ArakoonTuple.pack( ("a\x00b", 1, -1, None) ),
+                   "\x01a\x00\xffb\x00\x15\x01\x13\xfe\x00" )
+    assert_equals( ArakoonTuple.pack( ((None,),) ), "\x05\x00\xff\x00" )
+
+def test_order_of_ints_and_floats():
+    rnd = random.Random(42)
+    ints = [rnd.randint(-2**80, 2**80) >> rnd.randint(0, 80) for i in range(500)]
+    floats = [rnd.uniform(-1e6, 1e6) * 10 ** rnd.randint(-20, 20) for i in range(500)]
+    for values in (ints, floats):
+        tuples = [("k", v, "x") for v in values]
+        by_key = sorted(tuples, key = ArakoonTuple.pack)
+        assert_equals( by_key, sorted(tuples) )
+
+def test_order_of_strings():
+    strings = ["", "\x00", "\x00\x00", "\x00\xff", "\x01", "a", "a\x00", "ab", "b", "\xff"]
+    tuples = [(s, 1) for s in strings]
+    assert_equals( sorted(tuples, key = ArakoonTuple.pack), sorted(tuples) )
+
+def test_prefix_range():
+    begin, bi, end, ei = ArakoonTuple.prefixRange( ("user",) )
+    inside = [("user", 0), ("user", None), ("user", "x", 3), ("user", (1,))]
+    outside = [("user",), ("user2", 1), ("usea", 1), ("user\x00", 1)]
+    for t in inside:
+        k = ArakoonTuple.pack( t )
+        assert_true( begin <= k < end, t )
+    for t in outside:
+        k = ArakoonTuple.pack( t )
+        assert_false( begin <= k < end, t )
+
+def test_between_range():
+    begin, bi, end, ei = ArakoonTuple.betweenRange( ("user",), 10, 20, prefix = "events/" )
+    assert_true( bi )
+    assert_false( ei )
+    for ts in (10, 11, 19):
+        k = ArakoonTuple.pack( ("user", ts, "id"), "events/" )
+        assert_true( begin <= k < end, ts )
+    for ts in (9, -10, 20, 21):
+        k = ArakoonTuple.pack( ("user", ts, "id"), "events/" )
+        assert_false( begin <= k < end, ts )
+
+def test_invalid():
+    assert_raises( ValueError, ArakoonTuple.pack, ([1],) )
+    assert_raises( ValueError, ArakoonTuple.unpack, "\x01abc" )
+    assert_raises( ValueError, ArakoonTuple.unpack, "\x16\x01" )
+    assert_raises( ValueError, ArakoonTuple.unpack, "\x99" )
+    assert_raises( ValueError, ArakoonTuple.unpack, "\x01a\x00", "x/" )
@@ -0,0 +1,130 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import inspect
+
+from nose.tools import *
+
+from arakoon import utils
+from arakoon.ArakoonExceptions import ArakoonInvalidArguments
+from arakoon.ArakoonProtocol import Sequence
+from arakoon.ArakoonValidators import SignatureValidator
+
+class _Target :
+
+    @SignatureValidator( 'string', 'string_option', 'bool' )
+    def put(self, key, value, sync = False):
+        return (key, value, sync)
+
+    @SignatureValidator( 'int' )
+    def count(self, n = 10):
+        return n
+
+    @SignatureValidator( 'int' )
+    def limit(self, n = None):
+        return n
+
+    @SignatureValidator( 'sequence' )
+    def apply(self, seq):
+        return seq
+
+def test_positional():
+    assert_equals( _Target().put("k", "v", True), ("k", "v", True) )
+    assert_equals( _Target().put("k", None), ("k", None, False) )
+
+def test_keyword():
+    assert_equals( _Target().put(key = "k", value = "v"), ("k", "v", False) )
+    assert_equals( _Target().put("k", sync = True, value = None), ("k", None, True) )
+
+def test_default():
+    assert_equals( _Target().count(), 10 )
+    assert_equals( _Target().count(3), 3 )
+    # A default that isn't of the type is not validated
+    assert_equals( _Target().limit(), None )
+    assert_equals( _Target().limit(None), None )
+    assert_raises( ArakoonInvalidArguments, _Target().limit, "3" )
+
+def test_unknown_keyword():
+    assert_raises( ArakoonInvalidArguments, _Target().put, "k", "v", colour = "red" )
+
+def test_invalid_type():
+    target = _Target()
+    assert_raises( ArakoonInvalidArguments, target.put, 1, "v" )
+    assert_raises( ArakoonInvalidArguments, target.put, "k", 2 )
+    assert_raises( ArakoonInvalidArguments, target.put, "k", "v", "yes" )
+    assert_raises( ArakoonInvalidArguments, target.count, "3" )
+    assert_raises( ArakoonInvalidArguments, target.apply, [] )
+    seq = Sequence()
+    assert_true( target.apply(seq) is seq )
+
+def test_invalid_type_message():
+    try:
+        _Target().put(1, "v", "yes")
+    except ArakoonInvalidArguments, ex:
+        assert_true( "key=1" in str(ex) )
+        assert_true( "sync=yes" in str(ex) )
+        assert_false( "value" in str(ex) )
+    else:
+        assert_true( False )
+
+def test_missing_argument():
+    # Still a TypeError, as for an undecorated method
+    assert_raises( TypeError, _Target().put, "k" )
+
+def test_argspec_kept():
+    spec = inspect.getargspec(_Target.put.im_func)
+    assert_equals( (spec.args, spec.defaults), (['self', 'key', 'value', 'sync'], (False,)) )
+    assert_equals( _Target.put.__name__, 'put' )
+
+def test_update_argspec():
+    @utils.update_argspec('self', 'first', ('second', 2))
+    def f(**kwargs):
+        return (kwargs['first'], kwargs['second'])
+
+    assert_equals( inspect.getargspec(f), (['self', 'first', 'second'], None, None, (2,)) )
+    assert_equals( f(None, 1), (1, 2) )
+    assert_equals( f(None, second = 3, first = 1), (1, 3) )
+    assert_equals( f.__name__, 'f' )
+
+def test_make_function_reuses_code():
+    # Wrappers with the same argument names share one compiled template,
+    # each with its own name and defaults
+    compiled = len(utils._compiled)
+
+    @utils.update_argspec('self', 'reuse_a', ('reuse_b', 1))
+    def g(**kwargs):
+        return kwargs['reuse_b']
+
+    @utils.update_argspec('self', 'reuse_a', ('reuse_b', 2))
+    def h(**kwargs):
+        return kwargs['reuse_b']
+
+    assert_equals( len(utils._compiled), compiled + 1 )
+    assert_true( g.func_code.co_code is h.func_code.co_code )
+    assert_equals( (g.__name__, h.__name__), ('g', 'h') )
+    assert_equals( (g(None, 0), h(None, 0)), (1, 2) )
+
+def test_validator_reuses_code():
+    compiled = len(utils._compiled)
+
+    class Other :
+        @SignatureValidator( 'int' )
+        def count(self, n = 10):
+            return n
+
+    assert_equals( len(utils._compiled), compiled )
+    assert_equals( Other().count(), 10 )
+    assert_equals( _Target().count(), 10 )
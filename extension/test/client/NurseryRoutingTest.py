@@ -0,0 +1,60 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import random
+
+from nose.tools import *
+
+from arakoon.NurseryRouting import RoutingInfo, LeafRoutingNode
+
+def _routing(boundaries):
+    routing = RoutingInfo(LeafRoutingNode("c0"))
+    for i, boundary in enumerate(boundaries):
+        routing.split(boundary, "c%d" % (i + 1))
+    return routing
+
+def _walk(routing, key):
+    # The tree lookup the compiled one replaces
+    return routing._RoutingInfo__root.getClusterId(key)
+
+def test_compile():
+    routing = _routing(["m", "f", "t"])
+    boundaries, clusters = routing.compile()
+    assert_equals( boundaries, ["f", "m", "t"] )
+    assert_equals( clusters, ["c0", "c2", "c1", "c3"] )
+
+def test_lookup_matches_tree():
+    boundaries = ["%04d" % i for i in range(0, 1000, 7)]
+    random.shuffle(boundaries)
+    routing = _routing(boundaries)
+    keys = ["%04d" % i for i in range(1000)] + ["", "0", "9999", "zzz"]
+    for key in keys:
+        assert_equals( routing.getClusterId(key), _walk(routing, key) )
+    random.shuffle(keys)
+    assert_equals( routing.getClusterIds(keys), [_walk(routing, k) for k in keys] )
+
+def test_split_recompiles():
+    routing = _routing(["m"])
+    assert_equals( routing.getClusterId("x"), "c1" )
+    routing.split("w", "c2")
+    assert_equals( routing.getClusterId("x"), "c2" )
+    assert_equals( routing.getClusterIds(["a", "x", "n"]), ["c0", "c2", "c1"] )
+
+def test_unbalanced():
+    # Splits in increasing order make one long chain
+    routing = _routing(["%06d" % i for i in range(500)])
+    assert_equals( routing.getClusterId("000250"), "c251" )
+    assert_equals( routing.getClusterIds(["", "000499x"]), ["c0", "c500"] )
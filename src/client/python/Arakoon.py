@@ -21,6 +21,7 @@ Arakoon client module
 """
 
 
+import os
 import sys
 import time
 import random
@@ -32,6 +33,19 @@ from ArakoonExceptions import *
 from ArakoonClientConnection import *
 from ArakoonValidators import SignatureValidator
 from ArakoonProtocol import ArakoonClientConfig
+from ArakoonHedging import HedgePolicy
+from ArakoonReplication import ReplicationTracker
+from ArakoonRetry import DecorrelatedJitter, FailoverEvent
+from ArakoonMetrics import ClientMetrics
+from ArakoonHooks import Request, PHASE_DISCOVER, PHASE_ENCODE, \
+    PHASE_RETRY_SLEEP, traced
+from ArakoonCodec import CompressionCodec
+from ArakoonBlob import putBlob, getBlob, deleteBlob, DEFAULT_CHUNK_SIZE
+from ArakoonTransaction import Transaction, runTransaction
+from ArakoonSingleFlight import SingleFlight
+from ArakoonBreaker import CircuitBreakers, CLOSED, HALF_OPEN
+from ArakoonMaintainer import ConnectionMaintainer
+from ArakoonHashing import HashRing
 
 from functools import wraps
 
@@ -51,45 +65,130 @@ def dump(src, length=8):
         N += length
     return result
 
+# Keys written by idempotent writes, see ArakoonClient.enableIdempotentWrites
+WRITE_MARKER_PREFIX = "@@arakoon_write_marker/"
+
 # Seed the random generator
 random.seed ( time.time() )
 
 
-def retryDuringMasterReelection (is_read_only = False):
+def honourTimeout(f):
+    """
+    Lets f take a 'timeout' keyword argument: a budget (in seconds) for the
+    whole call, covering connecting, sending, every receive and all retries.
+    When it runs out, L{ArakoonTimeout} is raised.
+    """
+    @wraps(f)
+    def timed_f(self, *args, **kwargs):
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            return f(self, *args, **kwargs)
+        return self._callWithin(timeout, f, args, kwargs)
+
+    return timed_f
+
+# Errors after which a call can be retried (depending on whether it is read-only)
+_RETRIABLE = (ArakoonNoMaster, ArakoonNodeNotMaster, ArakoonNodeNoLongerMaster,
+              ArakoonSocketException, ArakoonNotConnected, ArakoonGoingDown,
+              ArakoonNodeUnavailable)
+
+def _firstKey(keys):
+    # Routes a read of several keys by key affinity
+    if keys:
+        return keys[0]
+    return None
+
+def retryDuringMasterReelection (is_read_only = False, idempotent = False):
+    """
+    @param idempotent: f retries by itself once idempotent writes are enabled
+        (see L{ArakoonClient.enableIdempotentWrites}), and must not be sent
+        again from here: that would be a new write
+    """
     def wrap(f):
         @wraps(f)
         def retrying_f (self,*args,**kwargs):
-            start = time.time()
-            tryCount = 0.0
-            backoffPeriod = 0.2
-            callSucceeded = False
-            retryPeriod = ArakoonClientConfig.getNoMasterRetryPeriod ()
-            deadline = start + retryPeriod
-            while( not callSucceeded and time.time() < deadline ):
-                try :
-                    retVal = f(self,*args,**kwargs)
-                    callSucceeded = True
-                except (ArakoonNoMaster, ArakoonNodeNotMaster, ArakoonSocketException, ArakoonNotConnected, ArakoonGoingDown) as ex:
-                    if not is_read_only and \
-                       isinstance(ex, (ArakoonSocketException, ArakoonGoingDown)):
-                        raise
-                    if len( self._config.getNodes().keys()) == 0 :
-                        raise ArakoonInvalidConfig( "Empty client configuration" )
-                    self._masterId = None
-                    self.dropConnections()
-                    sleepPeriod = backoffPeriod * tryCount
-                    if time.time() + sleepPeriod > deadline :
-                        raise
-                    tryCount += 1.0
-                    ArakoonClientLogger.logWarning( "Master not found (%s). Retrying in %0.2f sec." % (ex, sleepPeriod) )
-                    time.sleep( sleepPeriod )
-            return retVal
+            # Everything beyond the first attempt is left to _callRetrying,
+            # so a call that succeeds right away costs next to nothing here
+            timeout = kwargs.pop('timeout', None)
+            if idempotent and self._writeMarkerPrefix is not None:
+                if timeout is not None:
+                    return self._callWithin(timeout, f, args, kwargs)
+                return f(self, *args, **kwargs)
+            if timeout is not None:
+                return self._callWithin(timeout, _callRetrying,
+                                        (f, is_read_only, args, kwargs), {})
+            if self._hooks is not None:
+                return _callRetrying(self, f, is_read_only, args, kwargs)
+            try:
+                return f(self,*args,**kwargs)
+            except _RETRIABLE, ex:
+                return _callRetrying(self, f, is_read_only, args, kwargs, ex)
 
         return retrying_f
     return wrap
 
+def _callRetrying(self, f, is_read_only, args, kwargs, error = None):
+    tryCount = 0
+    sleepPeriod = 0.0
+    deadline = None
+    while True:
+        try :
+            if error is not None:
+                # The first attempt already failed in the caller
+                failed = error
+                error = None
+                raise failed
+            if self._hooks is None:
+                return f(self,*args,**kwargs)
+            return self._tracedAttempt(f, args, kwargs)
+        except _RETRIABLE as ex:
+            if deadline is None:
+                deadline = time.time() + ArakoonClientConfig.getNoMasterRetryPeriod ()
+                callDeadline = self._getDeadline()
+                if callDeadline is not None and callDeadline < deadline:
+                    deadline = callDeadline
+            if not is_read_only and \
+               isinstance(ex, (ArakoonSocketException, ArakoonGoingDown,
+                               ArakoonNodeNoLongerMaster)):
+                raise
+            if len( self._config.getNodes().keys()) == 0 :
+                raise ArakoonInvalidConfig( "Empty client configuration" )
+            # Only a failure of the master means it may have changed, e.g.
+            # not a dirty read on a slave. Connections to other nodes are
+            # fine: only the one to the master is suspect, and only if it broke.
+            masterId = self._masterId
+            if masterId is not None and \
+               getattr(self._local, 'lastNode', None) == masterId:
+                self._forgetMaster(ex)
+                if not isinstance(ex, (ArakoonNoMaster, ArakoonNodeNotMaster)):
+                    self._dropConnection(masterId)
+            sleepPeriod = self._retryPolicy.delay(tryCount, sleepPeriod)
+            if time.time() + sleepPeriod > deadline :
+                if deadline == callDeadline:
+                    raise ArakoonTimeout("Timeout expired while retrying (%s: %s)" %
+                                         (ex.__class__.__name__, ex))
+                raise
+            tryCount += 1
+            metrics = self._metrics
+            if metrics is not None:
+                metrics.retries += 1
+                metrics.retrySleep += sleepPeriod
+            ArakoonClientLogger.logWarning( "Master not found (%s). Retrying in %0.2f sec." % (ex, sleepPeriod) )
+            hooks = self._hooks
+            if hooks is None:
+                time.sleep( sleepPeriod )
+            else:
+                traced(hooks, PHASE_RETRY_SLEEP, None, time.sleep, sleepPeriod)
+
      
 class ArakoonClient :
+    """
+    Client for an Arakoon cluster.
+
+    Methods that talk to the cluster accept an optional 'timeout' keyword
+    argument: the number of seconds the whole call (connect, send, receive
+    and retries) may take before L{ArakoonTimeout} is raised.
+    """
 
     def __init__ (self, config=None):
         """
@@ -107,9 +206,29 @@ class ArakoonClient :
             config = ArakoonClientConfig()
         self._initialize( config )
         self.__lock = threading.RLock()
+        self._local = threading.local()
         self._masterId = None
         self._connections = dict()
         self._consistency = Consistent()
+        self._hedging = None
+        self._replication = ReplicationTracker()
+        self._replicationProbeInterval = None
+        self._replicationProbeTimeout = 0.25
+        self._lastReplicationProbe = 0.0
+        self._probeFailed = set()
+        self._retryPolicy = DecorrelatedJitter()
+        self._failover = None
+        self._failoverCallback = None
+        self._writeMarkerPrefix = None
+        self._metrics = ClientMetrics()
+        self._hooks = None
+        self._codec = None
+        self._singleFlight = None
+        self._admission = None
+        self._breakers = None
+        self._maintainer = None
+        self._affinity = None
+        self._pid = os.getpid()
         nodeList = self._config.getNodes().keys()
         if len(nodeList) == 0:
             raise ArakoonInvalidConfig("Node list empty.")
@@ -141,12 +260,482 @@ class ArakoonClient :
     def _initialize(self, config ):
         self._config = config
 
-    def __send__(self,msg):
-        if self._consistency.isDirty():
-            conn = self._sendMessage(self._dirtyReadNode, msg)
+    def setRetryPolicy(self, policy):
+        """
+        Set the policy deciding how long to sleep between attempts while the
+        master is unavailable (and between attempts to send a message).
+
+        @type policy: L{RetryPolicy}
+        @param policy: e.g. L{DecorrelatedJitter} (the default), L{ExponentialBackoff} or L{LinearBackoff}
+        """
+        self._retryPolicy = policy
+
+    def setFailoverCallback(self, callback):
+        """
+        Register a function to be called with a L{FailoverEvent} each time
+        the client found a master after losing contact with the previous one.
+
+        @type callback: callable taking a L{FailoverEvent}, or None
+        """
+        self._failoverCallback = callback
+
+    def _forgetMaster(self, cause):
+        if self._masterId is not None and self._failover is None:
+            self._failover = FailoverEvent(self._masterId, time.time(),
+                                           "%s: %s" % (cause.__class__.__name__, cause))
+        self._masterId = None
+
+    def _foundMaster(self):
+        event = self._failover
+        if event is None:
+            return
+        self._failover = None
+        event.newMaster = self._masterId
+        event.duration = time.time() - event.started
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.failovers += 1
+            if event.newMaster != event.oldMaster:
+                metrics.masterChanges += 1
+        ArakoonClientLogger.logWarning("Master %s -> %s after %0.3f sec",
+                                       event.oldMaster, event.newMaster, event.duration)
+        callback = self._failoverCallback
+        if callback is not None:
+            try:
+                callback(event)
+            except Exception, ex:
+                ArakoonClientLogger.logError("Failover callback failed (%s: %s)",
+                                             ex.__class__.__name__, ex)
+
+    def enableMetrics(self):
+        """
+        (Re)start collecting metrics from scratch. Metrics are enabled by default.
+
+        Connections opened before metrics were enabled are not accounted for.
+        """
+        self._metrics = ClientMetrics()
+        self.dropConnections()
+
+    def disableMetrics(self):
+        """
+        Stop collecting metrics, for connections opened from now on.
+        """
+        self._metrics = None
+        self.dropConnections()
+
+    def getMetrics(self):
+        """
+        Returns a snapshot of the metrics collected by this client: latency
+        percentiles and error counts per command, bytes sent and received,
+        connects, retries and the time slept for them, failovers and master
+        changes, and time spent waiting for the client lock.
+
+        @rtype: dict
+        @return: the metrics, or None if they are disabled
+        """
+        if self._metrics is None:
+            return None
+        return self._metrics.snapshot()
+
+    def getPrometheusMetrics(self, prefix = 'arakoon_client'):
+        """
+        @rtype: string
+        @return: the metrics in the Prometheus text exposition format, labeled with the cluster id
+        """
+        if self._metrics is None:
+            return ''
+        return self._metrics.prometheus(prefix, {'cluster' : self._config.getClusterId()})
+
+    def setHooks(self, hooks):
+        """
+        Install lifecycle hooks, receiving start and end events for every
+        request to a node and for the phases of a call: master discovery,
+        connect, TLS handshake, encode, send, wait, decode and retry sleeps.
+
+        @type hooks: L{ClientHooks}
+        @param hooks: The hooks to call, or None to remove them
+        """
+        self._hooks = hooks
+        self.dropConnections()
+
+    def setAdmissionControl(self, admission):
+        """
+        Limit the rate of requests and bytes of this client, see
+        L{AdmissionControl}. Requests that are not admitted in time fail
+        with L{ArakoonThrottled}; the time requests wait is part of the
+        metrics.
+
+        @type admission: L{AdmissionControl}
+        @param admission: The limits to apply, or None to remove them
+        """
+        self._admission = admission
+        self.dropConnections()
+
+    def getAdmissionControl(self):
+        """
+        @rtype: L{AdmissionControl}
+        @return: the limits applied to this client, or None
+        """
+        return self._admission
+
+    def enableCircuitBreakers(self, breakers = None):
+        """
+        Stop sending requests to nodes that keep failing, see
+        L{CircuitBreakers}. Requests for such a node fail with
+        L{ArakoonNodeUnavailable} without waiting for a timeout, and master
+        discovery and dirty reads skip it until a probe finds it back.
+
+        @type breakers: L{CircuitBreakers}
+        @param breakers: The thresholds to use, defaults to L{CircuitBreakers}()
+        """
+        if breakers is None:
+            breakers = CircuitBreakers()
+        self._breakers = breakers
+        self.dropConnections()
+
+    def disableCircuitBreakers(self):
+        """
+        Send requests to every node again.
+        """
+        self._breakers = None
+        self.dropConnections()
+
+    def getCircuitBreakerStatistics(self):
+        """
+        @rtype: dict
+        @return: the state of the breaker of every node, see L{CircuitBreakers.statistics}, or None if not enabled
+        """
+        breakers = self._breakers
+        if breakers is None:
+            return None
+        return breakers.statistics()
+
+    def startMaintainer(self, interval = 5.0):
+        """
+        Start a background thread that connects to every node right away,
+        and from then on pings idle connections, reconnects broken ones and
+        keeps track of the master, see L{ConnectionMaintainer}.
+
+        @type interval: float
+        @param interval: The time (in seconds) between two rounds
+        """
+        self.stopMaintainer()
+        maintainer = ConnectionMaintainer(self, interval)
+        self._maintainer = maintainer
+        maintainer.start()
+
+    def stopMaintainer(self):
+        """
+        Stop the background thread started by L{startMaintainer}, if any.
+        """
+        maintainer = self._maintainer
+        self._maintainer = None
+        if maintainer is not None:
+            maintainer.stop()
+
+    def getMaintainerStatistics(self):
+        """
+        @rtype: dict
+        @return: see L{ConnectionMaintainer.statistics}, or None if no maintainer runs
+        """
+        maintainer = self._maintainer
+        if maintainer is None:
+            return None
+        return maintainer.statistics()
+
+    def enableKeyAffinity(self, vnodes = 160):
+        """
+        Route the dirty reads of a key to the same replica, so every node
+        only needs to cache its share of the keys. Keys are spread over
+        the nodes by consistent hashing; when the replica of a key is down
+        (or behind an open circuit breaker), the next one on the ring
+        serves the read. Reads from the master are not affected.
+
+        @type vnodes: int
+        @param vnodes: The number of points per node on the hash ring, see L{HashRing}
+        """
+        self._affinity = HashRing(self._config.getNodes().keys(), vnodes)
+
+    def disableKeyAffinity(self):
+        """
+        Send dirty reads to the dirty read node again.
+        """
+        self._affinity = None
+
+    def _available(self, nodeIds):
+        breakers = self._breakers
+        if breakers is None:
+            return nodeIds
+        return breakers.available(nodeIds)
+
+    def _tracedAttempt(self, f, args, kwargs):
+        local = self._local
+        if getattr(local, 'encoding', False):
+            # Nested call: part of the encode phase of the outer one
+            return f(self, *args, **kwargs)
+        local.encoding = True
+        self._hooks.phaseStart(PHASE_ENCODE, None)
+        try:
+            result = f(self, *args, **kwargs)
+        except Exception, ex:
+            self._encoded(ex)
+            raise
+        self._encoded(None)
+        return result
+
+    def _encoded(self, error):
+        # Ends the encode phase of the current call, if it is still open
+        local = self._local
+        if getattr(local, 'encoding', False):
+            local.encoding = False
+            hooks = self._hooks
+            if hooks is not None:
+                hooks.phaseEnd(PHASE_ENCODE, None, error)
+
+    def enableHedgedReads(self, policy = None):
+        """
+        Hedge dirty reads (NoGuarantee, AtLeast) against a second replica.
+
+        If the dirty read node did not reply within the delay given by the
+        policy, the same request is sent to another node and whichever
+        reply arrives first is used. The connection that lost is drained if
+        its reply is already there, and closed otherwise, so a late reply can
+        never be mistaken for the answer to a next request.
+
+        @type policy: L{HedgePolicy}
+        @param policy: Defaults to a L{HedgePolicy} hedging at the 95th percentile
+        """
+        if policy is None:
+            policy = HedgePolicy()
+        self._hedging = policy
+
+    def disableHedgedReads(self):
+        """
+        Send dirty reads to the dirty read node only.
+        """
+        self._hedging = None
+
+    def getHedgeStatistics(self):
+        """
+        @rtype: dict
+        @return: hedge and win rates, or None if hedged reads are not enabled
+        """
+        if self._hedging is None:
+            return None
+        return self._hedging.statistics()
+
+    def enableCompression(self, codec = None):
+        """
+        Compress large values on the client: values written are encoded by
+        the codec, values read are decoded. Values written without
+        compression still read correctly, so compression can be enabled
+        over existing data: the codec only decodes a value that starts with
+        its marker and ends with a checksum of the rest (see
+        L{ArakoonCodec}), and returns any other value as it is. Clients
+        without the codec read the encoded bytes, so enable it on all
+        clients of the data before writing through any of them.
+
+        Comparisons done by the server (confirm, aSSert, testAndSet, and
+        asserts in a sequence) only match values that were written with the
+        same codec settings.
+
+        @type codec: L{CompressionCodec}
+        @param codec: Defaults to a L{CompressionCodec} compressing values of 1KiB and more with zlib
+        """
+        if codec is None:
+            codec = CompressionCodec()
+        self._codec = codec
+
+    def disableCompression(self):
+        """
+        Write values as is. Compressed values can no longer be read.
+        """
+        self._codec = None
+
+    def getCompressionStatistics(self):
+        """
+        @rtype: dict
+        @return: counters and the compression ratio of the values written, or None if compression is not enabled
+        """
+        if self._codec is None:
+            return None
+        return self._codec.statistics()
+
+    def enableSingleFlight(self, group = None):
+        """
+        Let concurrent identical reads share one request: a read that is
+        identical (same request, same consistency) to one in flight waits
+        for it and gets the same result or error.
+
+        @type group: L{SingleFlight}
+        @param group: Share a group between the clients of a pool; defaults to a new group
+        """
+        if group is None:
+            group = SingleFlight()
+        self._singleFlight = group
+
+    def disableSingleFlight(self):
+        """
+        Send a request for every read.
+        """
+        self._singleFlight = None
+
+    def getSingleFlightStatistics(self):
+        """
+        @rtype: dict
+        @return: the number of reads and shared reads, or None if single-flight reads are not enabled
+        """
+        if self._singleFlight is None:
+            return None
+        return self._singleFlight.statistics()
+
+    def __read__(self, msg, decode, key = None):
+        flight = self._singleFlight
+        if flight is not None:
+            flightKey = (self._config.getClusterId(), msg, decode)
+            return flight.do(flightKey, self._getDeadline(), self._readOnce, msg, decode, key)
+        return self._readOnce(msg, decode, key)
+
+    def _readOnce(self, msg, decode, key = None):
+        consistency = self._consistency
+        if not consistency.isDirty():
+            conn = self._sendToMaster(msg)
+        elif isinstance(consistency, AtLeast):
+            return self._readAtLeast(consistency.getI(), msg, decode, key)
+        elif key is not None and self._affinity is not None:
+            return self._readNear(key, msg, decode)
+        else:
+            nodeId, conn = self._sendDirty(self._dirtyNode(), msg, decode)
+        return decode(conn)
+
+    def _readNear(self, key, msg, decode):
+        # The replica the key hashes to, or else the next one on the ring
+        preference = self._affinity.preference(key)
+        nodeIds = self._available(preference) or preference
+        for n, nodeId in enumerate(nodeIds):
+            try:
+                nodeId, conn = self._sendDirty(nodeId, msg, decode, nodeIds[n + 1:n + 2])
+            except (ArakoonSocketException, ArakoonNotConnected, ArakoonNodeUnavailable), ex:
+                if n + 1 == len(nodeIds):
+                    raise
+                ArakoonClientLogger.logDebug("Could not read from '%s' (%s: %s), trying the next replica",
+                                             nodeId, ex.__class__.__name__, ex)
+                continue
+            return decode(conn)
+
+    def _dirtyNode(self):
+        nodeId = self._dirtyReadNode
+        breakers = self._breakers
+        if breakers is None or breakers.breaker(nodeId).available():
+            return nodeId
+        others = breakers.available(self._config.getNodes().keys())
+        if others:
+            return random.choice(others)
+        return nodeId
+
+    def _readAtLeast(self, i, msg, decode, key = None):
+        self._maybeProbeReplication()
+        tried = []
+        while True:
+            nodeId, backups = self._routeAtLeast(i, tried, key)
+            nodeId, conn = self._sendDirty(nodeId, msg, decode, backups)
+            try:
+                result = decode(conn)
+            except ArakoonInconsistentRead:
+                self._replication.noteBehind(nodeId, i)
+                tried.append(nodeId)
+                if len(tried) >= len(self._config.getNodes()):
+                    raise
+                ArakoonClientLogger.logDebug("Node '%s' has not applied %d yet, rerouting", nodeId, i)
+                continue
+            self._replication.noteApplied(nodeId, i)
+            return result
+
+    def _routeAtLeast(self, i, exclude, key = None):
+        nodeIds = [n for n in self._config.getNodes().keys() if n not in exclude]
+        nodeIds = self._available(nodeIds)
+        caughtUp = self._replication.caughtUp(i, nodeIds)
+        preferred = self._dirtyReadNode
+        if key is not None and self._affinity is not None:
+            # The first replica on the ring that can serve the read
+            preference = self._affinity.preference(key)
+            for nodeId in preference:
+                if nodeId in caughtUp:
+                    return nodeId, caughtUp
+            for nodeId in preference:
+                if nodeId in nodeIds:
+                    preferred = nodeId
+                    break
+        if preferred in caughtUp:
+            return preferred, caughtUp
+        if caughtUp:
+            return random.choice(caughtUp), caughtUp
+        if preferred in nodeIds and \
+           not self._replication.isBehind(preferred, i):
+            return preferred, []
+        # Nobody is known to have applied i, but the master has
+        self._determineMaster()
+        return self._masterId, []
+
+    def _sendDirty(self, nodeId, msg, decode, backups = None):
+        if self._hedging is None:
+            return nodeId, self._sendMessage(nodeId, msg)
+        return self._sendHedged(nodeId, msg, decode, backups)
+
+    def _sendHedged(self, nodeId, msg, decode, backups):
+        policy = self._hedging
+        start = time.time()
+        first = self._sendMessage(nodeId, msg)
+        if waitForReply([first], min(policy.delay(), self._remaining())):
+            policy.record(time.time() - start)
+            return nodeId, first
+
+        if backups is None:
+            backups = self._config.getNodes().keys()
+        others = self._available([n for n in backups if n != nodeId])
+        if not others:
+            return nodeId, first
+        backupId = random.choice(others)
+        try:
+            second = self._sendMessage(backupId, msg)
+        except ArakoonException, ex:
+            ArakoonClientLogger.logDebug("Could not hedge read to '%s' (%s: %s)",
+                                         backupId, ex.__class__.__name__, ex)
+            return nodeId, first
+
+        try:
+            ready = waitForReply([first, second], self._remaining())
+        except ArakoonTimeout:
+            ready = []
+        if not ready:
+            self._dropConnection(nodeId)
+            self._dropConnection(backupId)
+            first._checkDeadline()
+            raise ArakoonSockNotReadable()
+        if ready[0] is first:
+            winner = (nodeId, first)
+            loser = (backupId, second)
         else:
-            conn = self._sendToMaster (msg)
-        return conn
+            winner = (backupId, second)
+            loser = (nodeId, first)
+        policy.noteHedged(winner[1] is second)
+        policy.record(time.time() - start)
+        self._abandon(loser[0], loser[1], decode)
+        return winner
+
+    def _abandon(self, nodeId, conn, decode):
+        # The losing request of a hedged read still has a reply underway.
+        # Consume it if it is already there, otherwise give up on the
+        # connection: reading it later would pair it with the wrong request.
+        if waitForReply([conn], 0.0):
+            try:
+                decode(conn)
+                return
+            except ArakoonSocketException:
+                pass
+            except ArakoonException:
+                return
+        self._dropConnection(nodeId)
 
     @utils.update_argspec('self', 'node')
     def setDirtyReadNode(self, node):
@@ -161,7 +750,7 @@ class ArakoonClient :
             raise ArakoonUnknownNode( node )
         self._dirtyReadNode = node
 
-    @utils.update_argspec('self')
+    @utils.update_argspec('self', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     def getKeyCount (self) :
         """
@@ -182,7 +771,7 @@ class ArakoonClient :
         """
         return self._dirtyReadNode
 
-    @utils.update_argspec('self', 'clientId', ('clusterId', 'arakoon'))
+    @utils.update_argspec('self', 'clientId', ('clusterId', 'arakoon'), ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string', 'string' )
     def hello (self, clientId, clusterId = 'arakoon'):
@@ -203,6 +792,7 @@ class ArakoonClient :
         return conn.decodeStringResult()
 
 
+    @honourTimeout
     def getVersion(self, nodeId = None):
         """
         will return a tuple containing major, minor and patch level versions of the server side
@@ -222,6 +812,7 @@ class ArakoonClient :
 
         return result
 
+    @honourTimeout
     def getCurrentState(self,nodeId = None):
         """
         will return a string denoting the current state of the node.
@@ -239,7 +830,7 @@ class ArakoonClient :
         return result
 
 
-    @utils.update_argspec('self', 'key')
+    @utils.update_argspec('self', 'key', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string' )
     def exists(self, key):
@@ -249,10 +840,9 @@ class ArakoonClient :
         @return : True if there is a value for that key, False otherwise
         """
         msg = ArakoonProtocol.encodeExists(key, self._consistency)
-        conn = self.__send__(msg)
-        return conn.decodeBoolResult()
+        return self.__read__(msg, ArakoonClientConnection.decodeBoolResult, key)
 
-    @utils.update_argspec('self', 'key')
+    @utils.update_argspec('self', 'key', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string' )
     def get(self, key):
@@ -267,11 +857,12 @@ class ArakoonClient :
         @return: The value associated with the given key
         """
         msg = ArakoonProtocol.encodeGet(key, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringResult()
-        return result
+        value = self.__read__(msg, ArakoonClientConnection.decodeStringResult, key)
+        if self._codec is not None:
+            value = self._codec.decode(value)
+        return value
 
-    @utils.update_argspec('self', 'keys')
+    @utils.update_argspec('self', 'keys', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     def multiGet(self,keys):
         """
@@ -282,11 +873,13 @@ class ArakoonClient :
         @return: the values associated with the respective keys
         """
         msg = ArakoonProtocol.encodeMultiGet(keys, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringListResult()
-        return result
+        values = self.__read__(msg, ArakoonClientConnection.decodeStringListResult,
+                               _firstKey(keys))
+        if self._codec is not None:
+            values = self._codec.decodeList(values)
+        return values
 
-    @utils.update_argspec('self','keys')
+    @utils.update_argspec('self','keys', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     def multiGetOption(self,keys):
         """
@@ -299,12 +892,14 @@ class ArakoonClient :
         """
 
         msg = ArakoonProtocol.encodeMultiGetOption(keys, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringOptionArrayResult()
-        return result
-
-    @utils.update_argspec('self', 'key', 'value')
-    @retryDuringMasterReelection()
+        values = self.__read__(msg, ArakoonClientConnection.decodeStringOptionArrayResult,
+                               _firstKey(keys))
+        if self._codec is not None:
+            values = self._codec.decodeList(values)
+        return values
+
+    @utils.update_argspec('self', 'key', 'value', ('timeout', None))
+    @retryDuringMasterReelection(idempotent = True)
     @SignatureValidator( 'string', 'string' )
     def set(self, key, value):
         """
@@ -321,6 +916,13 @@ class ArakoonClient :
 
         @rtype: void
         """
+        if self._codec is not None:
+            value = self._codec.encode(value)
+        if self._writeMarkerPrefix is not None:
+            seq = Sequence()
+            seq.addSet(key, value)
+            self._sequenceOnce(seq, False)
+            return
         conn = self._sendToMaster ( ArakoonProtocol.encodeSet( key, value ) )
         conn.decodeVoidResult()
 
@@ -336,12 +938,93 @@ class ArakoonClient :
     def get_txid(self):
         """
         returns the current transaction id for later usage
+
+        str() of the result is a session token: see L{getSessionToken}
         """
         conn = self._sendToMaster(ArakoonProtocol.encodeGetTxid())
         result = conn.decodeGetTxidResult()
+        if isinstance(result, AtLeast):
+            self._replication.noteApplied(self._masterId, result.getI())
         return result
 
-    @utils.update_argspec('self', 'key', 'value')
+    def getSessionToken(self):
+        """
+        Returns a token that captures everything written so far.
+
+        Passing it to L{setSessionToken}, possibly in another process, makes
+        subsequent reads observe at least those writes, while still allowing
+        them to be served by slaves that have caught up.
+
+        @rtype: string
+        """
+        return str(self.get_txid())
+
+    def setSessionToken(self, token):
+        """
+        Use the consistency captured by L{getSessionToken} for subsequent reads.
+
+        @type token: string
+        """
+        self.setConsistency(parseConsistency(token))
+
+    @honourTimeout
+    def probeReplication(self):
+        """
+        Ask every node which transaction it has applied.
+
+        The answers are used to route AtLeast reads to nodes that can serve
+        them. Every node gets the probe timeout to answer (see
+        L{setReplicationProbeInterval}). Nodes that did not answer the
+        previous probe are skipped once, as are nodes behind an open
+        circuit breaker.
+
+        @rtype: dict
+        @return: the highest applied i known per node
+        """
+        self._lastReplicationProbe = time.time()
+        skipped = self._probeFailed
+        failed = set()
+        for nodeId in self._available(self._config.getNodes().keys()):
+            if nodeId in skipped:
+                continue
+            try:
+                result = self._callWithin(self._replicationProbeTimeout,
+                                          ArakoonClient._probeTxid, (nodeId,), {})
+            except ArakoonException, ex:
+                ArakoonClientLogger.logDebug("Could not probe node '%s' (%s: %s)",
+                                             nodeId, ex.__class__.__name__, ex)
+                failed.add(nodeId)
+                continue
+            if isinstance(result, AtLeast):
+                self._replication.noteApplied(nodeId, result.getI())
+        self._probeFailed = failed
+        return self._replication.statistics()
+
+    def _probeTxid(self, nodeId):
+        conn = self._sendMessage(nodeId, ArakoonProtocol.encodeGetTxid(), 1)
+        return conn.decodeGetTxidResult()
+
+    def setReplicationProbeInterval(self, interval, timeout = 0.25):
+        """
+        Probe the nodes (see L{probeReplication}) if the last probe is older
+        than interval seconds. The background maintainer (see
+        L{startMaintainer}) probes at every round, otherwise an AtLeast read
+        probes before it is sent. None disables probing.
+
+        @type interval: float
+        @type timeout: float
+        @param timeout: The time (in seconds) a node gets to answer a probe
+        """
+        self._replicationProbeInterval = interval
+        self._replicationProbeTimeout = timeout
+
+    def _maybeProbeReplication(self):
+        interval = self._replicationProbeInterval
+        if interval is not None and \
+           time.time() - self._lastReplicationProbe > interval:
+            self.probeReplication()
+
+    @utils.update_argspec('self', 'key', 'value', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator('string','string')
     def confirm(self, key,value):
@@ -350,11 +1033,13 @@ class ArakoonClient :
         otherwise, behave as set(key,value)
         @rtype: void
         """
+        if self._codec is not None:
+            value = self._codec.encodeExpected(value)
         msg = ArakoonProtocol.encodeConfirm(key,value)
         conn = self._sendToMaster(msg)
         conn.decodeVoidResult()
 
-    @utils.update_argspec('self', 'key', 'vo')
+    @utils.update_argspec('self', 'key', 'vo', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator('string','string_option')
     def aSSert(self, key, vo):
@@ -366,12 +1051,12 @@ class ArakoonClient :
         @param vo: what the value should be (can be None)
         @rtype: void
         """
+        if self._codec is not None:
+            vo = self._codec.encodeExpected(vo)
         msg = ArakoonProtocol.encodeAssert(key, vo, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeVoidResult()
-        return result
+        return self.__read__(msg, ArakoonClientConnection.decodeVoidResult, key)
 
-    @utils.update_argspec('self', 'key')
+    @utils.update_argspec('self', 'key', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator('string')
     def aSSert_exists(self, key):
@@ -382,12 +1067,10 @@ class ArakoonClient :
         @rtype: void
         """
         msg = ArakoonProtocol.encodeAssertExists(key, self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeVoidResult()
-        return result
+        return self.__read__(msg, ArakoonClientConnection.decodeVoidResult, key)
 
-    @utils.update_argspec('self', 'seq', ('sync', False))
-    @retryDuringMasterReelection()
+    @utils.update_argspec('self', 'seq', ('sync', False), ('timeout', None))
+    @retryDuringMasterReelection(idempotent = True)
     @SignatureValidator( 'sequence', 'bool' )
     def sequence(self, seq, sync = False):
         """
@@ -398,6 +1081,11 @@ class ArakoonClient :
         It's all-or-nothing: either all updates succeed, or they all fail.
         @type seq: Sequence
         """
+        if self._codec is not None:
+            seq = self._codec.encodeSequence(seq)
+        if self._writeMarkerPrefix is not None:
+            self._sequenceOnce(seq, sync)
+            return
         encoded = ArakoonProtocol.encodeSequence(seq, sync)
         conn = self._sendToMaster(encoded)
         conn.decodeVoidResult()
@@ -408,8 +1096,121 @@ class ArakoonClient :
         """
         return Sequence()
 
-    @utils.update_argspec('self', 'key')
+    def makeTransaction(self):
+        """
+        Factory method for optimistic transactions, see L{Transaction}
+        """
+        return Transaction(self)
+
+    @honourTimeout
+    def runTransaction(self, f, maxAttempts = 10):
+        """
+        Run a read-modify-write over any number of keys as one sequence.
+
+        f is called with a fresh L{Transaction}, which records the values f
+        reads and buffers what it writes. The writes are committed in one
+        sequence that asserts all values read are unchanged. When one did
+        change, f is called again with a new transaction, after a backoff.
+
+        @type f: function
+        @param f: Takes a L{Transaction}; can be called more than once
+        @type maxAttempts: int
+        @param maxAttempts: The maximum number of times f is run
+        @return: what f returned in the attempt that committed
+        @raise ArakoonAssertionFailed: the last attempt lost a race as well
+        """
+        return runTransaction(self, f, maxAttempts)
+
+    def enableIdempotentWrites(self, markerPrefix = WRITE_MARKER_PREFIX):
+        """
+        Make set, delete and sequence safe to retry when the connection to
+        the master is lost while they are underway.
+
+        Each such write is sent as a sequence that also asserts a unique
+        marker key to be absent and sets it. When the outcome of an attempt is
+        unknown (connection lost, master going down or no longer master), the
+        client looks for the marker on the (new) master: if it is there the
+        write was applied, otherwise it is sent again, and the assert ensures
+        it can never be applied twice.
+
+        Markers accumulate under markerPrefix; remove old ones with
+        L{purgeWriteMarkers}.
+
+        @type markerPrefix: string
+        @param markerPrefix: keys starting with this prefix are reserved for markers
+        """
+        self._writeMarkerPrefix = markerPrefix
+
+    def disableIdempotentWrites(self):
+        """
+        Send set, delete and sequence as is: they fail when the connection is
+        lost while they are underway.
+        """
+        self._writeMarkerPrefix = None
+
+    @utils.update_argspec('self', ('maxAge', 3600), ('markerPrefix', WRITE_MARKER_PREFIX),
+                          ('timeout', None))
     @retryDuringMasterReelection()
+    def purgeWriteMarkers(self, maxAge = 3600, markerPrefix = WRITE_MARKER_PREFIX):
+        """
+        Delete the markers left by idempotent writes that are older than maxAge.
+
+        A marker must outlive every retry of its write, so maxAge should be
+        well above the no master retry period.
+
+        @type maxAge: int
+        @param maxAge: age in seconds
+        @rtype: int
+        @return: the number of markers deleted
+        """
+        cutoff = markerPrefix + "%016x" % int((time.time() - maxAge) * 1000)
+        count = 0
+        while True:
+            msg = ArakoonProtocol.encodeRange(markerPrefix, True, cutoff, False,
+                                              1000, Consistent())
+            keys = self._sendToMaster(msg).decodeStringListResult()
+            if not keys:
+                return count
+            seq = Sequence()
+            for key in keys:
+                seq.addDelete(key)
+            self._sendToMaster(ArakoonProtocol.encodeSequence(seq, False)).decodeVoidResult()
+            count += len(keys)
+
+    def _sequenceOnce(self, seq, sync):
+        # The only retry loop of the write: every attempt carries the same
+        # marker, so it is applied once at most
+        marker = "%s%016x/%s" % (self._writeMarkerPrefix, int(time.time() * 1000),
+                                 os.urandom(8).encode('hex'))
+        guarded = Sequence()
+        guarded.addAssert(marker, None)
+        guarded.addUpdate(seq)
+        guarded.addSet(marker, "")
+        encoded = ArakoonProtocol.encodeSequence(guarded, sync)
+        attempts = [0]
+
+        def attempt(self):
+            if attempts[0] > 0 and self._markerWritten(marker):
+                return
+            attempts[0] += 1
+            conn = self._sendToMaster(encoded)
+            try:
+                conn.decodeVoidResult()
+            except ArakoonAssertionFailed:
+                # Either one of the asserts in seq, or an earlier attempt
+                # that was applied after all
+                if attempts[0] > 1 and self._markerWritten(marker):
+                    return
+                raise
+
+        _callRetrying(self, attempt, True, (), {})
+
+    def _markerWritten(self, marker):
+        msg = ArakoonProtocol.encodeExists(marker, Consistent())
+        return self._sendToMaster(msg).decodeBoolResult()
+
+    @utils.update_argspec('self', 'key', ('timeout', None))
+    @retryDuringMasterReelection(idempotent = True)
     @SignatureValidator( 'string' )
     def delete(self, key):
         """
@@ -420,10 +1221,15 @@ class ArakoonClient :
 
         @rtype: void
         """
+        if self._writeMarkerPrefix is not None:
+            seq = Sequence()
+            seq.addDelete(key)
+            self._sequenceOnce(seq, False)
+            return
         conn = self._sendToMaster ( ArakoonProtocol.encodeDelete( key ) )
         conn.decodeVoidResult()
 
-    @utils.update_argspec('self','prefix')
+    @utils.update_argspec('self','prefix', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator('string')
     def deletePrefix(self, prefix):
@@ -445,7 +1251,7 @@ class ArakoonClient :
     __contains__ = exists
 
     @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey',
-                          'endKeyIncluded', ('maxElements', 1000))
+                          'endKeyIncluded', ('maxElements', 1000), ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int' )
     def range(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements = 1000 ):
@@ -472,11 +1278,10 @@ class ArakoonClient :
         """
         msg = ArakoonProtocol.encodeRange( beginKey, beginKeyIncluded, endKey,
                                            endKeyIncluded, maxElements, self._consistency)
-        conn = self.__send__(msg)
-        return conn.decodeStringListResult()
+        return self.__read__(msg, ArakoonClientConnection.decodeStringListResult, beginKey)
 
     @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey',
-                          'endKeyIncluded', ('maxElements', 1000))
+                          'endKeyIncluded', ('maxElements', 1000), ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string_option', 'bool', 'string_option', 'bool', 'int' )
     def range_entries(self,
@@ -512,12 +1317,13 @@ class ArakoonClient :
                                                  endKeyIncluded,
                                                  maxElements,
                                                  self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringPairListResult()
-        return result
+        entries = self.__read__(msg, ArakoonClientConnection.decodeStringPairListResult, beginKey)
+        if self._codec is not None:
+            entries = self._codec.decodePairs(entries)
+        return entries
 
     @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey',
-                          'endKeyIncluded', ('maxElements', 1000))
+                          'endKeyIncluded', ('maxElements', 1000), ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator('string_option', 'bool', 'string_option', 'bool','int')
     def rev_range_entries(self,
@@ -542,12 +1348,13 @@ class ArakoonClient :
                                                         endKeyIncluded,
                                                         maxElements,
                                                         self._consistency)
-        conn = self.__send__(msg)
-        result = conn.decodeStringPairListResult()
-        return result
+        entries = self.__read__(msg, ArakoonClientConnection.decodeStringPairListResult, beginKey)
+        if self._codec is not None:
+            entries = self._codec.decodePairs(entries)
+        return entries
 
 
-    @utils.update_argspec('self', 'keyPrefix', ('maxElements', 1000))
+    @utils.update_argspec('self', 'keyPrefix', ('maxElements', 1000), ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     @SignatureValidator( 'string', 'int' )
     def prefix(self, keyPrefix , maxElements = 1000 ):
@@ -566,13 +1373,14 @@ class ArakoonClient :
         @return: Returns a list of keys matching the provided prefix
         """
         msg = ArakoonProtocol.encodePrefixKeys( keyPrefix, maxElements, self._consistency)
-        conn = self.__send__(msg)
-        return conn.decodeStringListResult( )
+        return self.__read__(msg, ArakoonClientConnection.decodeStringListResult, keyPrefix)
 
+    @honourTimeout
     def whoMaster(self):
         self._determineMaster()
         return self._masterId
 
+    @honourTimeout
     def expectProgressPossible(self):
         """
         @return: true if the master thinks progress is possible, false otherwise
@@ -585,6 +1393,7 @@ class ArakoonClient :
             return False
 
 
+    @honourTimeout
     def statistics(self):
         """
         @return a dictionary with some statistics about the master
@@ -593,7 +1402,7 @@ class ArakoonClient :
         conn = self._sendToMaster(msg)
         return conn.decodeStatistics()
 
-    @utils.update_argspec('self', 'key', 'oldValue', 'newValue')
+    @utils.update_argspec('self', 'key', 'oldValue', 'newValue', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator( 'string', 'string_option', 'string_option' )
     def testAndSet(self, key, oldValue, newValue):
@@ -614,11 +1423,18 @@ class ArakoonClient :
         @rtype: string
         @return: The value that was associated with the key prior to this operation
         """
+        codec = self._codec
+        if codec is not None:
+            oldValue = codec.encodeExpected(oldValue)
+            newValue = codec.encode(newValue)
         msg = ArakoonProtocol.encodeTestAndSet( key, oldValue, newValue )
         conn = self._sendToMaster( msg )
-        return conn.decodeStringOptionResult()
+        previous = conn.decodeStringOptionResult()
+        if codec is not None:
+            previous = codec.decode(previous)
+        return previous
 
-    @utils.update_argspec('self','key','wanted')
+    @utils.update_argspec('self','key','wanted', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator('string','string_option')
     def replace(self,key,wanted):
@@ -631,11 +1447,68 @@ class ArakoonClient :
         @rtype: string option
         @return: the previous binding (if any)
         """
+        codec = self._codec
+        if codec is not None:
+            wanted = codec.encode(wanted)
         msg = ArakoonProtocol.encodeReplace(key,wanted)
         conn = self._sendToMaster( msg )
-        return conn.decodeStringOptionResult()
+        previous = conn.decodeStringOptionResult()
+        if codec is not None:
+            previous = codec.decode(previous)
+        return previous
+
+    @honourTimeout
+    def put_blob(self, key, fob, chunkSize = DEFAULT_CHUNK_SIZE):
+        """
+        Store a value too large for a single update, read from a file-like object.
 
-    @utils.update_argspec('self', 'name', 'argument')
+        The value is split in chunks of chunkSize bytes that are written one
+        by one; the last one is written in a sequence with the manifest that
+        makes the new blob visible, replacing any previous blob under key.
+        Blobs live apart from the other values: get(key) doesn't see them.
+
+        @type key: string
+        @param key: The key of the blob
+        @param fob: File-like object the value is read from, until its end
+        @type chunkSize: int
+        @param chunkSize: The size of a chunk, in bytes
+        @rtype: int
+        @return: the size of the blob
+        @raise ArakoonAssertionFailed: another put or delete of the same blob finished first
+        """
+        return putBlob(self, key, fob, chunkSize)
+
+    @honourTimeout
+    def get_blob(self, key, fob):
+        """
+        Write a blob stored by L{put_blob} to a file-like object.
+
+        Chunks are fetched with pipelined multiGets and checked against the
+        checksums in the manifest before they are written.
+
+        @type key: string
+        @param key: The key of the blob
+        @param fob: File-like object the value is written to
+        @rtype: int
+        @return: the size of the blob
+        @raise ArakoonNotFound: there is no blob under key
+        @raise ArakoonBlobChanged: the blob was replaced or deleted while it was being read
+        @raise ArakoonBlobCorrupted: a chunk does not match its checksum
+        """
+        return getBlob(self, key, fob)
+
+    @honourTimeout
+    def delete_blob(self, key):
+        """
+        Remove a blob stored by L{put_blob}, and all of its chunks.
+
+        @type key: string
+        @param key: The key of the blob
+        @raise ArakoonNotFound: there is no blob under key
+        """
+        deleteBlob(self, key)
+
+    @utils.update_argspec('self', 'name', 'argument', ('timeout', None))
     @retryDuringMasterReelection()
     @SignatureValidator('string', 'string_option')
     def userFunction(self, name, argument): #pylint: disable-msg=C0103
@@ -653,13 +1526,88 @@ class ArakoonClient :
         conn = self._sendToMaster(msg)
         return conn.decodeStringOptionResult()
 
-    @utils.update_argspec('self')
+    @utils.update_argspec('self', ('timeout', None))
     @retryDuringMasterReelection(is_read_only=True)
     def getNurseryConfig(self):
         msg = ArakoonProtocol.encodeGetNurseryCfg()
         con = self._sendToMaster(msg)
         return con.decodeNurseryCfgResult()
 
+    def prepareForFork(self):
+        """
+        Make sure the master is known before forking worker processes.
+
+        A client detects by itself that it is used in a forked child, and
+        reconnects there without touching the sockets of the parent. The
+        master it knew at the time of the fork is kept, so when this is
+        called in the parent before forking, the workers don't all have to
+        ask the cluster who is master at once.
+
+        @rtype: tuple
+        @return: the master hint, see L{getMasterHint}
+        """
+        self._determineMaster()
+        return self.getMasterHint()
+
+    def getMasterHint(self):
+        """
+        Returns what this client knows about the master, to hand to clients
+        in other processes (e.g. through the initializer of a process pool).
+
+        @rtype: tuple
+        @return: (cluster id, master node id), or None if the master is not known
+        """
+        masterId = self._masterId
+        if masterId is None:
+            return None
+        return (self._config.getClusterId(), masterId)
+
+    def setMasterHint(self, hint):
+        """
+        Start from the master another client found, instead of asking the
+        cluster. Should the hint be outdated, the client finds out on its
+        first request and looks for the master as usual.
+
+        @type hint: tuple
+        @param hint: A hint obtained from L{getMasterHint}; None is ignored
+        """
+        if hint is None:
+            return
+        clusterId, masterId = hint
+        if clusterId != self._config.getClusterId():
+            raise ValueError("Master hint for cluster '%s', this client is for '%s'" %
+                             (clusterId, self._config.getClusterId()))
+        if not self._config.getNodes().has_key(masterId):
+            raise ValueError("Master hint names unknown node '%s'" % masterId)
+        if self._masterId is None:
+            self._masterId = masterId
+
+    def _checkFork(self):
+        if self._pid != os.getpid():
+            self._afterFork()
+
+    def _afterFork(self):
+        # The sockets are shared with the parent: using them would mix up
+        # replies. Closing them here only closes the child's descriptors.
+        # Locks could have been held by threads that don't exist here.
+        self._pid = os.getpid()
+        self.__lock = threading.RLock()
+        self._local = threading.local()
+        connections = self._connections
+        self._connections = dict()
+        for connection in connections.values():
+            connection.close()
+        self._failover = None
+        maintainer = self._maintainer
+        if maintainer is not None:
+            # Its thread was left behind in the parent
+            self._maintainer = None
+            self.startMaintainer(maintainer.interval)
+        # Retry jitter is drawn from random: don't sleep in step with siblings
+        random.seed()
+        ArakoonClientLogger.logDebug("Client used in forked process %d, dropped %d inherited connections",
+                                     self._pid, len(connections))
+
     def dropConnections(self):
         '''Drop all connections to the Arakoon servers'''
         keysToRemove = self._connections.keys()
@@ -668,40 +1616,54 @@ class ArakoonClient :
             self._connections[key].close()
             del self._connections[ key ]
 
-    def _determineMaster(self):
-        nodeIds = []
+    def _dropConnection(self, nodeId):
+        with self.__lock:
+            connection = self._connections.pop(nodeId, None)
+        if connection is not None:
+            connection.close()
 
+    def _determineMaster(self):
         if self._masterId is None:
-            # Prepare to ask random nodes who is master
-            nodeIds = self._config.getNodes().keys()
-            random.shuffle( nodeIds )
+            hooks = self._hooks
+            if hooks is None:
+                self._discoverMaster()
+            else:
+                self._encoded(None)
+                traced(hooks, PHASE_DISCOVER, None, self._discoverMaster)
+        if self._failover is not None:
+            self._foundMaster()
+
+    def _discoverMaster(self):
+        # Ask random nodes who is master
+        # Nodes behind an open breaker would only cost a timeout
+        nodeIds = self._available(self._config.getNodes().keys())
+        random.shuffle( nodeIds )
+
+        while self._masterId is None and len(nodeIds) > 0 :
+            node = nodeIds.pop()
+            try :
+                self._masterId = self._getMasterIdFromNode( node )
+                tmpMaster = self._masterId
 
-            while self._masterId is None and len(nodeIds) > 0 :
-                node = nodeIds.pop()
                 try :
-                    self._masterId = self._getMasterIdFromNode( node )
-                    tmpMaster = self._masterId
-
-                    try :
-                        if self._masterId is not None :
-                            if self._masterId != node and not self._validateMasterId ( self._masterId ) :
-                                self._masterId = None
-                        else :
-                            ArakoonClientLogger.logWarning( "Node '%s' does not know who the master is", node )
-
-                    except Exception, ex :
-
-                        ArakoonClientLogger.logWarning( "Could not validate master on node '%s'", tmpMaster )
-                        ArakoonClientLogger.logDebug( "%s: %s" % (ex.__class__.__name__, ex))
-                        self._masterId = None
-
+                    if self._masterId is not None :
+                        if self._masterId != node and not self._validateMasterId ( self._masterId ) :
+                            self._masterId = None
+                    else :
+                        ArakoonClientLogger.logWarning( "Node '%s' does not know who the master is", node )
 
                 except Exception, ex :
-                    # Exceptions will occur when nodes are down, simply ignore and try the next node
-                    ArakoonClientLogger.logWarning( "Could not query node '%s' to see who is master", node )
+
+                    ArakoonClientLogger.logWarning( "Could not validate master on node '%s'", tmpMaster )
                     ArakoonClientLogger.logDebug( "%s: %s" % (ex.__class__.__name__, ex))
+                    self._masterId = None
 
 
+            except Exception, ex :
+                # Exceptions will occur when nodes are down, simply ignore and try the next node
+                ArakoonClientLogger.logWarning( "Could not query node '%s' to see who is master", node )
+                ArakoonClientLogger.logDebug( "%s: %s" % (ex.__class__.__name__, ex))
+
         if self._masterId is None:
             ArakoonClientLogger.logError( "Could not determine master."  )
             raise ArakoonNoMaster()
@@ -731,57 +1693,204 @@ class ArakoonClient :
     def _sleep(self, timeout):
         time.sleep( timeout )
 
+    def _getDeadline(self):
+        return getattr(self._local, 'deadline', None)
+
+    def _remaining(self):
+        """
+        Time left for the call in progress: the connection timeout, capped by
+        the deadline given by the caller (if any).
+        """
+        timeout = ArakoonClientConfig.getConnectionTimeout()
+        deadline = self._getDeadline()
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise ArakoonTimeout()
+        return min(timeout, remaining)
+
+    def _callWithin(self, timeout, f, args, kwargs):
+        outer = self._getDeadline()
+        deadline = time.time() + timeout
+        if outer is not None and outer < deadline:
+            deadline = outer
+        self._local.deadline = deadline
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            self._local.deadline = outer
+
     def _sendMessage(self, nodeId, msgBuffer, tryCount = -1):
 
         result = None
+        sleepPeriod = 0.0
 
         if tryCount == -1 :
             tryCount = self._config.getTryCount()
 
-        for i in range(tryCount) :
-
-            if i > 0:
-                maxSleep = i * ArakoonClientConfig.getBackoffInterval()
-                self._sleep( random.randint(0, maxSleep) )
-
-            with self.__lock :
+        self._checkFork()
+        # The node a failure of the call came from, see _callRetrying
+        self._local.lastNode = nodeId
+        breaker = None
+        breakers = self._breakers
+        if breakers is not None:
+            breaker = breakers.breaker(nodeId)
+            self._passBreaker(nodeId, breaker)
+        admission = self._admission
+        if admission is not None:
+            self._admit(admission, msgBuffer)
+        hooks = self._hooks
+        request = None
+        if hooks is not None:
+            self._encoded(None)
+            request = Request(msgBuffer[:4], nodeId, len(msgBuffer))
+            hooks.requestStart(request)
 
-                try :
-                    connection = self._getConnection( nodeId )
-                    connection.send( msgBuffer )
+        try:
+            for i in range(tryCount) :
+
+                if i > 0:
+                    maxSleep = i * ArakoonClientConfig.getBackoffInterval()
+                    sleepPeriod = self._retryPolicy.delay(i - 1, sleepPeriod)
+                    period = min(sleepPeriod, maxSleep, self._remaining())
+                    if hooks is None:
+                        self._sleep( period )
+                    else:
+                        request.attempt = i
+                        traced(hooks, PHASE_RETRY_SLEEP, request, self._sleep, period)
+
+                metrics = self._metrics
+                if metrics is not None:
+                    waitStart = time.time()
+                with self.__lock :
+                    if metrics is not None:
+                        metrics.lockWait.record(time.time() - waitStart)
 
-                    # Message sent correctly, return client connection so result
-                    # can be read
-                    result = connection
-                    break
+                    try :
+                        connection = self._getConnection( nodeId, request )
+                        connection.send( msgBuffer, self._getDeadline(), request )
+
+                        # Message sent correctly, return client connection so result
+                        # can be read
+                        result = connection
+                        break
+
+                    except Exception, ex:
+                        fmt = "Attempt %d to exchange message with node %s failed with error (%s: '%s')."
+                        ArakoonClientLogger.logWarning( fmt , i, nodeId,
+                                                        ex.__class__.__name__, ex )
+
+                        # Get rid of the connection in case of an exception
+                        self._connections[nodeId].close()
+                        del self._connections[ nodeId ]
+                        if nodeId == self._masterId:
+                            self._forgetMaster(ex)
+                        if breaker is not None:
+                            breaker.failure()
+                            if breaker.state() != CLOSED:
+                                break
+
+            if result is None:
+                # If result is None, this means that all retries failed.
+                # Re-raise the last exception to escalate the problem
+                raise
+        except Exception, ex:
+            # Also when the deadline runs out or the sleep between attempts fails
+            if hooks is not None:
+                hooks.requestEnd(request, ex)
+            raise
 
-                except Exception, ex:
-                    fmt = "Attempt %d to exchange message with node %s failed with error (%s: '%s')."
-                    ArakoonClientLogger.logWarning( fmt , i, nodeId,
-                                                    ex.__class__.__name__, ex )
+        return result
 
-                    # Get rid of the connection in case of an exception
-                    self._connections[nodeId].close()
-                    del self._connections[ nodeId ]
-                    self._masterId = None
+    def _passBreaker(self, nodeId, breaker):
+        state = breaker.acquire()
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN:
+            ok = False
+            try:
+                ok = self._probe(nodeId)
+            finally:
+                # Also if the probe is interrupted: a breaker left half-open
+                # would reject every request for the node from then on
+                breaker.probed(ok)
+            if ok:
+                ArakoonClientLogger.logWarning("Node '%s' answers again, closed its circuit breaker", nodeId)
+                return
+            ArakoonClientLogger.logWarning("Node '%s' still fails, circuit breaker stays open", nodeId)
+        raise ArakoonNodeUnavailable(nodeId)
+
+    def _probe(self, nodeId):
+        try:
+            self._callWithin(self._breakers.probeTimeout, ArakoonClient._probeOnce, (nodeId,), {})
+            return True
+        except Exception, ex:
+            ArakoonClientLogger.logDebug("Probe of node '%s' failed (%s: %s)",
+                                         nodeId, ex.__class__.__name__, ex)
+            return False
 
-        if result is None:
-            # If result is None, this means that all retries failed.
-            # Re-raise the last exception to escalate the problem
+    def _probeOnce(self, nodeId):
+        # A single whoMaster, not through _sendMessage: that would consult
+        # the breaker again
+        try:
+            with self.__lock:
+                connection = self._getConnection(nodeId)
+                connection.send(ArakoonProtocol.encodeWhoMaster(), self._getDeadline())
+            connection.decodeStringOptionResult()
+        except Exception:
+            self._dropConnection(nodeId)
             raise
 
-        return result
+    def _admit(self, admission, msgBuffer):
+        metrics = self._metrics
+        try:
+            waited = admission.admit(msgBuffer[:4], len(msgBuffer), self._getDeadline())
+        except ArakoonThrottled:
+            if metrics is not None:
+                metrics.throttleRejections += 1
+            raise
+        if waited and metrics is not None:
+            metrics.throttleWait.record(waited)
 
-    def _getConnection(self, nodeId):
+    def _getConnection(self, nodeId, request = None):
         connection = None
         if self._connections.has_key( nodeId ) :
             connection = self._connections [ nodeId ]
 
         if connection is None:
-            nodeLocations = self._config.getNodeLocations( nodeId )
-            clusterId = self._config.getClusterId()
-            connection = ArakoonClientConnection ( nodeLocations , clusterId,
-                self._config)
+            connection = self._newConnection(nodeId, request)
             self._connections[ nodeId ] = connection
 
         return connection
+
+    def _newConnection(self, nodeId, request = None):
+        nodeLocations = self._config.getNodeLocations( nodeId )
+        clusterId = self._config.getClusterId()
+        breaker = None
+        if self._breakers is not None:
+            breaker = self._breakers.breaker(nodeId)
+        return ArakoonClientConnection ( nodeLocations , clusterId,
+            self._config, self._getDeadline(), self._metrics,
+            self._hooks, request, self._admission, breaker)
+
+    def _takeIdleConnection(self, nodeId, idle):
+        # For the maintainer: the connection to nodeId if it is broken, or
+        # has no reply outstanding and was not used for idle seconds. The
+        # client makes a new one should it need one meanwhile.
+        with self.__lock:
+            connection = self._connections.get(nodeId)
+            if connection is not None:
+                if connection._outstanding or \
+                   (connection._connected and time.time() - connection._lastUsed < idle):
+                    return None
+                del self._connections[nodeId]
+                return connection
+        return self._newConnection(nodeId)
+
+    def _returnConnection(self, nodeId, connection):
+        with self.__lock:
+            if self._pid == os.getpid() and nodeId not in self._connections:
+                self._connections[nodeId] = connection
+                return
+        connection.close()
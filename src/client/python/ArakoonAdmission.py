@@ -0,0 +1,306 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Client side admission control: token buckets limiting the requests and
+bytes per second of a client, in total and per class of operations.
+
+A request waits for tokens for at most a bounded time, and is rejected with
+L{ArakoonThrottled} if they don't come in time. Waiting requests are
+admitted by priority: a request of a class with a lower priority waits as
+long as requests of a higher priority are waiting that take from one of
+its buckets (e.g. the total bucket). The bytes of a request
+are charged before it is sent; the bytes of its reply once it is read,
+which delays the requests that follow.
+"""
+
+import struct
+import threading
+import time
+
+from ArakoonExceptions import ArakoonThrottled
+import ArakoonProtocol as _ArakoonProtocol
+
+CLASS_READ = 'read'
+CLASS_SCAN = 'scan'
+CLASS_WRITE = 'write'
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+def _classes():
+    p = _ArakoonProtocol
+    classes = {}
+    for (cls, commands) in (
+        (CLASS_READ, (p.ARA_CMD_GET, p.ARA_CMD_EXISTS, p.ARA_CMD_MULTI_GET,
+                      p.ARA_CMD_MULTI_GET_OPTION, p.ARA_CMD_ASSERT,
+                      p.ARA_CMD_ASSERT_EXISTS, p.ARA_CMD_KEY_COUNT)),
+        (CLASS_SCAN, (p.ARA_CMD_RAN, p.ARA_CMD_RAN_E, p.ARA_CMD_REV_RAN_E,
+                      p.ARA_CMD_PRE)),
+        (CLASS_WRITE, (p.ARA_CMD_SET, p.ARA_CMD_DEL, p.ARA_CMD_SEQ,
+                       p.ARA_CMD_SYNCED_SEQUENCE, p.ARA_CMD_TAS, p.ARA_CMD_REPLACE,
+                       p.ARA_CMD_CONFIRM, p.ARA_CMD_DELETE_PREFIX,
+                       p.ARA_CMD_USER_FUNCTION, p.ARA_CMD_NOP))):
+        for command in commands:
+            classes[struct.pack("I", command)] = cls
+    return classes
+
+# Request header -> class; requests of other commands (whoMaster, hello,
+# statistics, ...) are not limited
+_CLASSES = _classes()
+
+class TokenBucket :
+
+    def __init__(self, rate, burst = None):
+        """
+        @type rate: float
+        @param rate: Tokens added per second
+        @type burst: float
+        @param burst: The most tokens the bucket holds, defaults to one second worth of tokens
+        """
+        self._rate = 0.0
+        self._burst = 0.0
+        self._tokens = 0.0
+        self._last = time.time()
+        self.setRate(rate, burst)
+        self._tokens = self._burst
+
+    def setRate(self, rate, burst = None):
+        if rate <= 0:
+            raise ValueError("rate should be positive, got %s" % rate)
+        if burst is None:
+            burst = rate
+        self._refill(time.time())
+        self._rate = float(rate)
+        self._burst = max(1.0, float(burst))
+        self._tokens = min(self._tokens, self._burst)
+
+    def _refill(self, now):
+        if now > self._last:
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def wait(self, n, now):
+        """
+        @return: the time until n tokens are available (0.0 if they are)
+        """
+        self._refill(now)
+        # A request larger than the burst only waits for a full bucket
+        n = min(n, self._burst)
+        if self._tokens >= n:
+            return 0.0
+        return (n - self._tokens) / self._rate
+
+    def take(self, n):
+        # Can leave the bucket in debt
+        self._tokens -= n
+
+class _Limit :
+
+    def __init__(self):
+        self.ops = None
+        self.bytes = None
+
+class _Waiter :
+
+    def __init__(self, priority, costs):
+        self.priority = priority
+        self.buckets = [bucket for (bucket, n) in costs]
+
+class AdmissionControl :
+    """
+    Limits for one or more clients. Configure it, then install it with
+    L{ArakoonClient.setAdmissionControl}. Limits can be changed at any time.
+    """
+
+    def __init__(self, maxWait = 1.0):
+        """
+        @type maxWait: float
+        @param maxWait: The longest time (in seconds) a request waits to be
+            admitted; 0 rejects requests right away, None waits as long as the
+            timeout of the call allows
+        """
+        self._cond = threading.Condition()
+        self._maxWait = maxWait
+        self._total = _Limit()
+        self._limits = dict((cls, _Limit()) for cls in (CLASS_READ, CLASS_SCAN, CLASS_WRITE))
+        self._priorities = {CLASS_READ : PRIORITY_INTERACTIVE,
+                            CLASS_SCAN : PRIORITY_BULK,
+                            CLASS_WRITE : PRIORITY_NORMAL}
+        self._waiters = []
+        self._throttled = dict((cls, 0) for cls in self._limits)
+        self._throttledTime = dict((cls, 0.0) for cls in self._limits)
+        self._rejected = dict((cls, 0) for cls in self._limits)
+
+    def setMaxWait(self, maxWait):
+        self._maxWait = maxWait
+
+    def setLimit(self, opClass = None, opsPerSecond = None, bytesPerSecond = None,
+                 burst = 1.0):
+        """
+        Set (or with None, remove) the limits for a class of operations.
+
+        @type opClass: string
+        @param opClass: L{CLASS_READ}, L{CLASS_SCAN}, L{CLASS_WRITE}, or None for the total of all classes
+        @type opsPerSecond: float
+        @type bytesPerSecond: float
+        @param bytesPerSecond: Bytes of requests and replies
+        @type burst: float
+        @param burst: The size of the buckets, in seconds worth of tokens
+        """
+        with self._cond:
+            limit = self._limit(opClass)
+            limit.ops = self._bucket(limit.ops, opsPerSecond, burst)
+            limit.bytes = self._bucket(limit.bytes, bytesPerSecond, burst)
+            self._cond.notify_all()
+
+    def _limit(self, opClass):
+        if opClass is None:
+            return self._total
+        try:
+            return self._limits[opClass]
+        except KeyError:
+            raise ValueError("Unknown operation class %r" % opClass)
+
+    def _bucket(self, bucket, rate, burst):
+        if rate is None:
+            return None
+        if bucket is None:
+            return TokenBucket(rate, rate * burst)
+        bucket.setRate(rate, rate * burst)
+        return bucket
+
+    def setPriority(self, opClass, priority):
+        """
+        @type priority: int
+        @param priority: L{PRIORITY_INTERACTIVE}, L{PRIORITY_NORMAL} or L{PRIORITY_BULK}
+        """
+        if priority not in (PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BULK):
+            raise ValueError("Unknown priority %r" % priority)
+        if opClass not in self._limits:
+            raise ValueError("Unknown operation class %r" % opClass)
+        with self._cond:
+            self._priorities[opClass] = priority
+            self._cond.notify_all()
+
+    def _costs(self, cls, size):
+        # The buckets a request of class cls takes from, with the number of tokens
+        costs = []
+        for limit in (self._total, self._limits[cls]):
+            if limit.ops is not None:
+                costs.append((limit.ops, 1))
+            if limit.bytes is not None:
+                costs.append((limit.bytes, size))
+        return costs
+
+    def admit(self, header, size, deadline):
+        """
+        Wait until a request may be sent.
+
+        @type header: string
+        @param header: The first 4 bytes of the request
+        @type size: int
+        @param size: The size of the request
+        @type deadline: float
+        @param deadline: The deadline of the call, or None
+        @rtype: float
+        @return: the time the request waited
+        @raise ArakoonThrottled: the request can't be admitted in time
+        """
+        cls = _CLASSES.get(header)
+        if cls is None:
+            return 0.0
+        with self._cond:
+            costs = self._costs(cls, size)
+            if not costs:
+                return 0.0
+            start = time.time()
+            limit = deadline
+            if self._maxWait is not None:
+                limit = start + self._maxWait
+                if deadline is not None and deadline < limit:
+                    limit = deadline
+            waiter = _Waiter(self._priorities[cls], costs)
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    now = time.time()
+                    ahead = self._ahead(waiter)
+                    wait = None
+                    if not ahead:
+                        # No costs left if the limits were removed meanwhile
+                        wait = max([0.0] + [bucket.wait(n, now) for (bucket, n) in costs])
+                        if wait == 0.0:
+                            break
+                    if limit is not None:
+                        if now >= limit or (wait is not None and now + wait > limit):
+                            self._rejected[cls] += 1
+                            self._throttledTime[cls] += now - start
+                            raise ArakoonThrottled("%s request not admitted within %.3fs" %
+                                                   (cls, now - start))
+                        if wait is None:
+                            # Until the requests ahead are admitted
+                            wait = limit - now
+                    self._cond.wait(wait)
+                    costs = self._costs(cls, size)
+                    waiter.buckets = [bucket for (bucket, n) in costs]
+                for (bucket, n) in costs:
+                    bucket.take(n)
+            finally:
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+            waited = now - start
+            if waited > 0.0:
+                self._throttled[cls] += 1
+                self._throttledTime[cls] += waited
+            return waited
+
+    def _ahead(self, waiter):
+        # Priority only orders requests that take from the same bucket
+        for other in self._waiters:
+            if other.priority < waiter.priority:
+                for bucket in other.buckets:
+                    if bucket in waiter.buckets:
+                        return True
+        return False
+
+    def charge(self, header, size):
+        """
+        Take the bytes of a reply from the byte buckets.
+        """
+        cls = _CLASSES.get(header)
+        if cls is None:
+            return
+        with self._cond:
+            for bucket in (self._total.bytes, self._limits[cls].bytes):
+                if bucket is not None:
+                    bucket.take(size)
+
+    def statistics(self):
+        """
+        @rtype: dict
+        @return: per class, the number of requests that waited and the time they waited, and the number rejected
+        """
+        with self._cond:
+            result = {}
+            for cls in self._limits:
+                result[cls] = {'throttled' : self._throttled[cls],
+                               'throttled_seconds' : self._throttledTime[cls],
+                               'rejected' : self._rejected[cls]}
+            return result
@@ -0,0 +1,270 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Blobs: values too large for a single update, stored as a series of chunk
+keys and a manifest.
+
+Every put writes its chunks under a fresh generation, so chunks are never
+overwritten. The last chunk is set in one sequence with the manifest, which
+only succeeds if the earlier chunks exist and the manifest is still the one
+the put started from; the chunks of the previous generation are deleted in
+that same sequence. Readers see either the old blob or the new one.
+"""
+
+import os
+import struct
+import zlib
+
+from ArakoonExceptions import *
+from ArakoonProtocol import ArakoonProtocol, ArakoonClientLogger, Sequence, \
+     _packInt, _packInt64, _packString, _unpackInt, _unpackInt64, _unpackString
+from ArakoonClientConnection import ArakoonClientConnection
+from ArakoonMultiplexer import Multiplexer
+
+# Manifests are kept under MANIFEST_PREFIX + key, chunks under
+# CHUNK_PREFIX + key + '\x00' + generation + '/' + index
+MANIFEST_PREFIX = "@@arakoon_blob/m/"
+CHUNK_PREFIX = "@@arakoon_blob/c/"
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_MANIFEST_MAGIC = "ABM\x01"
+
+class Manifest :
+    """
+    Description of a stored blob.
+
+    @ivar generation: identifies the put that wrote the blob
+    @ivar chunkSize: size of every chunk but the last
+    @ivar size: size of the blob
+    @ivar checksums: CRC-32 of every chunk
+    """
+
+    def __init__(self, generation, chunkSize, size, checksums):
+        self.generation = generation
+        self.chunkSize = chunkSize
+        self.size = size
+        self.checksums = checksums
+
+    def chunkKeys(self, key):
+        return [chunkKey(key, self.generation, i) for i in range(len(self.checksums))]
+
+    def encode(self):
+        parts = [_MANIFEST_MAGIC,
+                 _packString(self.generation),
+                 _packInt(self.chunkSize),
+                 _packInt64(self.size),
+                 _packInt(len(self.checksums))]
+        parts.extend(_packInt(c) for c in self.checksums)
+        return ''.join(parts)
+
+    @staticmethod
+    def decode(buf):
+        if not buf.startswith(_MANIFEST_MAGIC):
+            raise ArakoonException("Not a blob manifest")
+        offset = len(_MANIFEST_MAGIC)
+        generation, offset = _unpackString(buf, offset)
+        chunkSize, offset = _unpackInt(buf, offset)
+        size, offset = _unpackInt64(buf, offset)
+        count, offset = _unpackInt(buf, offset)
+        checksums = list(struct.unpack_from("%dI" % count, buf, offset))
+        return Manifest(generation, chunkSize, size, checksums)
+
+def manifestKey(key):
+    return MANIFEST_PREFIX + key
+
+def chunkKey(key, generation, index):
+    return "%s%s\x00%s/%08x" % (CHUNK_PREFIX, key, generation, index)
+
+def _checksum(data):
+    return zlib.crc32(data) & 0xffffffff
+
+def _readChunk(fob, size):
+    # Streams like sockets and pipes can return less than asked for
+    parts = []
+    while size > 0:
+        data = fob.read(size)
+        if not data:
+            break
+        parts.append(data)
+        size -= len(data)
+    return ''.join(parts)
+
+def _getManifest(client, key):
+    stored = client.multiGetOption([manifestKey(key)])[0]
+    if stored is None:
+        return None, None
+    return stored, Manifest.decode(stored)
+
+def putBlob(client, key, fob, chunkSize = DEFAULT_CHUNK_SIZE):
+    """
+    Store the contents of fob under key, replacing the blob stored there.
+
+    @raise ArakoonAssertionFailed: another put or delete of the same key finished first
+    @rtype: int
+    @return: the size of the blob
+    """
+    if chunkSize <= 0:
+        raise ValueError("chunkSize should be positive, got %s" % chunkSize)
+    oldStored, old = _getManifest(client, key)
+    generation = os.urandom(8).encode('hex')
+    checksums = []
+    written = []
+    size = 0
+    committed = False
+    try:
+        chunk = _readChunk(fob, chunkSize)
+        while True:
+            following = _readChunk(fob, chunkSize)
+            if not following:
+                break
+            ck = chunkKey(key, generation, len(checksums))
+            client.set(ck, chunk)
+            written.append(ck)
+            checksums.append(_checksum(chunk))
+            size += len(chunk)
+            chunk = following
+
+        seq = Sequence()
+        seq.addAssert(manifestKey(key), oldStored)
+        for ck in written:
+            seq.addAssertExists(ck)
+        if chunk:
+            ck = chunkKey(key, generation, len(checksums))
+            seq.addSet(ck, chunk)
+            checksums.append(_checksum(chunk))
+            size += len(chunk)
+        manifest = Manifest(generation, chunkSize, size, checksums)
+        seq.addSet(manifestKey(key), manifest.encode())
+        if old is not None:
+            for ck in old.chunkKeys(key):
+                seq.addDelete(ck)
+        try:
+            client.sequence(seq)
+        except (ArakoonAssertionFailed, ArakoonAssertExistsFailed):
+            # Certainly not applied
+            raise
+        except ArakoonException:
+            # The outcome is unknown: the chunks might be in use
+            committed = True
+            raise
+        committed = True
+    finally:
+        if not committed:
+            _deleteChunks(client, written)
+    return size
+
+def _deleteChunks(client, keys):
+    for ck in keys:
+        try:
+            client.delete(ck)
+        except ArakoonException, ex:
+            ArakoonClientLogger.logWarning("Could not delete blob chunk %r (%s: %s)",
+                                           ck, ex.__class__.__name__, ex)
+
+def getBlob(client, key, fob, window = 4, batch = 4):
+    """
+    Write the blob stored under key to fob.
+
+    @raise ArakoonNotFound: there is no blob under key
+    @raise ArakoonBlobChanged: the blob was replaced or deleted while it was being read
+    @raise ArakoonBlobCorrupted: a chunk did not match its checksum
+    @rtype: int
+    @return: the size of the blob
+    """
+    stored, manifest = _getManifest(client, key)
+    if manifest is None:
+        raise ArakoonNotFound(key)
+    keys = manifest.chunkKeys(key)
+    batches = [keys[i:i + batch] for i in range(0, len(keys), batch)]
+    index = 0
+    fetched = _fetch(client, batches, window)
+    try:
+        for values in fetched:
+            for data in values:
+                if _checksum(data) != manifest.checksums[index]:
+                    raise ArakoonBlobCorrupted("Chunk %d of %r" % (index, key))
+                fob.write(data)
+                index += 1
+    except ArakoonNotFound:
+        raise ArakoonBlobChanged()
+    finally:
+        fetched.close()
+    return manifest.size
+
+def _fetch(client, batches, window):
+    # Yields the values of every batch, in order. Up to window multiGets are
+    # in flight at once. The multiplexer doesn't retry: once a request
+    # fails, the rest is fetched one batch at a time by multiGet.
+    codec = client._codec
+    received = {}
+    submitted = 0
+    index = 0
+    failed = False
+    mux = Multiplexer()
+    try:
+        while index < len(batches) and not failed:
+            while submitted < len(batches) and submitted - index < window:
+                msg = ArakoonProtocol.encodeMultiGet(batches[submitted], client._consistency)
+                mux.submit(client, msg, ArakoonClientConnection.decodeStringListResult,
+                           tag = submitted)
+                submitted += 1
+            if index in received:
+                yield received.pop(index)
+                index += 1
+                continue
+            completed = mux.wait(client._remaining())
+            if not completed:
+                raise ArakoonTimeout("No blob chunks received")
+            for reply in completed:
+                error = reply.getError()
+                if error is None:
+                    values = reply.result()
+                    if codec is not None:
+                        values = codec.decodeList(values)
+                    received[reply.tag] = values
+                elif isinstance(error, ArakoonNotFound):
+                    raise error
+                else:
+                    failed = True
+    finally:
+        mux.close()
+    while index < len(batches):
+        values = received.pop(index, None)
+        if values is None:
+            values = client.multiGet(batches[index])
+        yield values
+        index += 1
+
+def deleteBlob(client, key):
+    """
+    Remove the blob stored under key.
+
+    @raise ArakoonNotFound: there is no blob under key
+    @raise ArakoonAssertionFailed: the blob was replaced by a put that finished first
+    """
+    stored, manifest = _getManifest(client, key)
+    if manifest is None:
+        raise ArakoonNotFound(key)
+    seq = Sequence()
+    seq.addAssert(manifestKey(key), stored)
+    seq.addDelete(manifestKey(key))
+    for ck in manifest.chunkKeys(key):
+        seq.addDelete(ck)
+    client.sequence(seq)
@@ -0,0 +1,210 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Per-node circuit breakers.
+
+A breaker is closed while its node answers. Once too many of the recent
+exchanges with the node failed, it opens: requests for the node fail at
+once, and master discovery and dirty reads go to other nodes. After a
+cooldown a single caller probes the node with a whoMaster request (the
+breaker is half-open meanwhile); if the node answers the breaker closes,
+otherwise it opens again for twice as long.
+"""
+
+import collections
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker :
+
+    def __init__(self, breakers):
+        self._breakers = breakers
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._outcomes = collections.deque()
+        self._failed = 0
+        self._consecutive = 0
+        self._openedAt = 0.0
+        self._cooldown = breakers.cooldown
+        self._opened = 0
+        self._rejected = 0
+
+    def state(self):
+        return self._state
+
+    def available(self, now = None):
+        """
+        @rtype: bool
+        @return: False if requests for the node would be rejected
+        """
+        if self._state == CLOSED:
+            return True
+        if now is None:
+            now = time.time()
+        return self._state == OPEN and now - self._openedAt >= self._cooldown
+
+    def acquire(self):
+        """
+        Decide what to do with a request for the node.
+
+        @rtype: string
+        @return: L{CLOSED} to send it, L{HALF_OPEN} to probe the node first
+            (see L{probed}), or L{OPEN} to reject it
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return CLOSED
+            if self._state == OPEN and time.time() - self._openedAt >= self._cooldown:
+                self._state = HALF_OPEN
+                return HALF_OPEN
+            self._rejected += 1
+            return OPEN
+
+    def probed(self, ok):
+        """
+        Register the outcome of the probe of a half-open breaker.
+        """
+        with self._lock:
+            if ok:
+                self._state = CLOSED
+                self._cooldown = self._breakers.cooldown
+                self._outcomes.clear()
+                self._failed = 0
+                self._consecutive = 0
+            else:
+                self._cooldown = min(self._breakers.maxCooldown, self._cooldown * 2)
+                self._open()
+
+    def success(self):
+        self._record(False)
+
+    def failure(self):
+        self._record(True)
+
+    def _record(self, failed):
+        with self._lock:
+            if self._state != CLOSED:
+                # Requests sent before the breaker opened, probes decide now
+                return
+            breakers = self._breakers
+            outcomes = self._outcomes
+            outcomes.append(failed)
+            if failed:
+                self._failed += 1
+                self._consecutive += 1
+            else:
+                self._consecutive = 0
+            if len(outcomes) > breakers.window:
+                if outcomes.popleft():
+                    self._failed -= 1
+            if self._consecutive >= breakers.consecutiveFailures or \
+               (len(outcomes) >= breakers.minRequests and
+                self._failed >= breakers.failureRate * len(outcomes)):
+                self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._openedAt = time.time()
+        self._opened += 1
+
+    def statistics(self):
+        with self._lock:
+            rate = 0.0
+            if self._outcomes:
+                rate = float(self._failed) / len(self._outcomes)
+            return {'state' : self._state,
+                    'failure_rate' : rate,
+                    'opened' : self._opened,
+                    'rejected' : self._rejected,
+                    'cooldown' : self._cooldown}
+
+class CircuitBreakers :
+    """
+    The breakers of the nodes of a cluster, and the thresholds they share.
+    """
+
+    def __init__(self, failureRate = 0.5, minRequests = 10, window = 50,
+                 consecutiveFailures = 3, cooldown = 1.0, maxCooldown = 30.0,
+                 probeTimeout = 0.5):
+        """
+        @type failureRate: float
+        @param failureRate: Open once this fraction of the recent exchanges failed
+        @type minRequests: int
+        @param minRequests: The number of recent exchanges needed before the failure rate counts
+        @type window: int
+        @param window: The number of recent exchanges the failure rate is computed over
+        @type consecutiveFailures: int
+        @param consecutiveFailures: Open after this many failures in a row, whatever the rate
+        @type cooldown: float
+        @param cooldown: The time (in seconds) an opened breaker waits before probing
+        @type maxCooldown: float
+        @param maxCooldown: Upper bound on the cooldown, which doubles with every failed probe
+        @type probeTimeout: float
+        @param probeTimeout: The time (in seconds) a probe may take
+        """
+        if not 0.0 < failureRate <= 1.0:
+            raise ValueError("failureRate should be in ]0,1], got %s" % failureRate)
+        if minRequests > window:
+            raise ValueError("minRequests %s exceeds window %s" % (minRequests, window))
+        if cooldown > maxCooldown:
+            raise ValueError("cooldown %s exceeds maxCooldown %s" % (cooldown, maxCooldown))
+        self.failureRate = failureRate
+        self.minRequests = minRequests
+        self.window = window
+        self.consecutiveFailures = consecutiveFailures
+        self.cooldown = cooldown
+        self.maxCooldown = maxCooldown
+        self.probeTimeout = probeTimeout
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def breaker(self, nodeId):
+        """
+        @rtype: L{CircuitBreaker}
+        """
+        breaker = self._breakers.get(nodeId)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(nodeId)
+                if breaker is None:
+                    breaker = CircuitBreaker(self)
+                    self._breakers[nodeId] = breaker
+        return breaker
+
+    def available(self, nodeIds):
+        """
+        @rtype: list
+        @return: the nodes of nodeIds whose breaker would let a request through
+        """
+        now = time.time()
+        return [n for n in nodeIds if self.breaker(n).available(now)]
+
+    def statistics(self):
+        """
+        @rtype: dict
+        @return: per node, the state of its breaker, the recent failure rate,
+            the number of times it opened and the number of requests it rejected
+        """
+        with self._lock:
+            breakers = self._breakers.items()
+        return dict((nodeId, breaker.statistics()) for (nodeId, breaker) in breakers)
@@ -16,14 +16,20 @@ limitations under the License.
 
 
 
-import ssl
+import math
+import time
 import socket
+import select
 from ArakoonProtocol import *
 from ArakoonExceptions import *
+from ArakoonHooks import PHASE_CONNECT, PHASE_TLS, PHASE_SEND, PHASE_WAIT, \
+    PHASE_DECODE, traced
 
 class ArakoonClientConnection :
 
-    def __init__ (self, nodeLocations, clusterId, config):
+    def __init__ (self, nodeLocations, clusterId, config, deadline = None,
+                  metrics = None, hooks = None, request = None, admission = None,
+                  breaker = None):
         self._clusterId = clusterId
         self._nodeIPs = nodeLocations[0]
         self._nodePort = nodeLocations[1]
@@ -32,17 +38,57 @@ class ArakoonClientConnection :
         self._connected = False
         self._socket = None
         self._socketInfo = None
+        self._socketTimeout = None
+        self._tls = False
         self._config = config
+        self._deadline = deadline
+        self._metrics = metrics
+        self._request = None
+        self._sentAt = 0.0
+        self._received = 0
+        self._hooks = hooks
+        self._hookRequest = request
+        self._admission = admission
+        self._breaker = breaker
+        # Replies still to be read, and when the connection was last used
+        self._outstanding = 0
+        self._lastUsed = time.time()
         self._reconnect()
 
+    def _timeout(self):
+        """
+        Time left for the next socket operation: the connection timeout,
+        capped by the deadline of the call in progress.
+        """
+        timeout = ArakoonClientConfig.getConnectionTimeout()
+        if self._deadline is None:
+            return timeout
+        remaining = self._deadline - time.time()
+        if remaining <= 0:
+            raise ArakoonTimeout()
+        return min(timeout, remaining)
+
+    def _checkDeadline(self):
+        if self._deadline is not None and time.time() >= self._deadline:
+            raise ArakoonTimeout()
+
     def _reconnect(self):
         self.close()
         try :
             ip = self._nodeIPs[self._index]
-            sock = socket.create_connection((ip , self._nodePort),
-                                                    ArakoonClientConfig.getConnectionTimeout())
+            timeout = self._timeout()
+            if self._hooks is None:
+                sock = socket.create_connection((ip , self._nodePort), timeout)
+            else:
+                sock = traced(self._hooks, PHASE_CONNECT, self._hookRequest,
+                              socket.create_connection, (ip , self._nodePort), timeout)
+            self._socketTimeout = timeout
+            if self._metrics is not None:
+                self._metrics.connects += 1
 
             if self._config.tls:
+                # Most clusters don't use TLS: only load ssl when needed
+                import ssl
                 kwargs = {
                     'ssl_version': ssl.PROTOCOL_TLSv1,
                     'cert_reqs': ssl.CERT_OPTIONAL,
@@ -58,9 +104,15 @@ class ArakoonClientConnection :
                     kwargs['keyfile'] = key
                     kwargs['certfile'] = cert
 
-                self._socket = ssl.wrap_socket(sock, **kwargs)
+                if self._hooks is None:
+                    self._socket = ssl.wrap_socket(sock, **kwargs)
+                else:
+                    self._socket = traced(self._hooks, PHASE_TLS, self._hookRequest,
+                                          ssl.wrap_socket, sock, **kwargs)
+                self._tls = True
             else:
                 self._socket = sock
+                self._tls = False
 
             self._socketInfo = (ip, self._nodePort)
             sendPrologue(self._socket, self._clusterId)
@@ -74,18 +126,42 @@ class ArakoonClientConnection :
             self._index = (self._index + 1) % self._nIPs
 
 
-    def send(self, msg):
+    def send(self, msg, deadline = None, request = None):
 
+        self._deadline = deadline
+        self._hookRequest = request
         if not self._connected :
             self._reconnect()
             if not self._connected :
+                self._checkDeadline()
                 raise ArakoonNotConnected( (self._nodeIPs, self._nodePort) )
         try:
-            self._socket.sendall( msg )
+            timeout = self._timeout()
+            if timeout != self._socketTimeout:
+                self._socket.settimeout(timeout)
+                self._socketTimeout = timeout
+            metrics = self._metrics
+            if metrics is not None:
+                self._request = msg[:4]
+                self._sentAt = time.time()
+                metrics.bytesSent += len(msg)
+            self._received = 0
+            if self._admission is not None:
+                self._request = msg[:4]
+            self._outstanding += 1
+            self._lastUsed = time.time()
+            if self._hooks is None:
+                self._socket.sendall( msg )
+            else:
+                traced(self._hooks, PHASE_SEND, request, self._socket.sendall, msg)
+        except ArakoonTimeout:
+            self.close()
+            raise
         except Exception, ex:
             self.close()
             ArakoonClientLogger.logWarning( "Error while sending data to (%s,%s) => %s: '%s'" ,
                 self._nodeIPs[self._index], self._nodePort, ex.__class__.__name__, ex  )
+            self._checkDeadline()
             raise ArakoonSockSendError ()
 
     def close(self):
@@ -97,46 +173,161 @@ class ArakoonClientConnection :
                     self._nodeIPs[self._index], self._nodePort, ex.__class__.__name__, ex  )
             self._socketInfo = None
             self._connected = False
+        self._outstanding = 0
 
-    def decodeStringResult(self) :
-        return ArakoonProtocol.decodeStringResult ( self )
+    def _hasBufferedReply(self):
+        # TLS records may already have been pulled off the socket, in which
+        # case select would not report the connection as readable
+        return self._tls and \
+            self._socket.pending() > 0
 
-    def decodeBoolResult(self) :
-        return ArakoonProtocol.decodeBoolResult ( self )
+    def _decode(self, decoder):
+        breaker = self._breaker
+        try:
+            if self._hooks is not None:
+                result = self._decodeTraced(decoder)
+            else:
+                result = self._decodeMeasured(decoder)
+        except (ArakoonSocketException, ArakoonGoingDown):
+            if breaker is not None:
+                breaker.failure()
+            raise
+        except ArakoonException:
+            # The node did answer
+            if breaker is not None:
+                breaker.success()
+            raise
+        finally:
+            if self._outstanding > 0:
+                self._outstanding -= 1
+        if breaker is not None:
+            breaker.success()
+        if self._admission is not None:
+            self._admission.charge(self._request, self._received)
+        return result
+
+    def _decodeMeasured(self, decoder):
+        metrics = self._metrics
+        if metrics is None:
+            return decoder(self)
+        try:
+            result = decoder(self)
+        except Exception:
+            metrics.recordRequest(self._request, time.time() - self._sentAt, True)
+            raise
+        metrics.recordRequest(self._request, time.time() - self._sentAt, False)
+        return result
+
+    def _decodeTraced(self, decoder):
+        hooks = self._hooks
+        request = self._hookRequest
+        try:
+            traced(hooks, PHASE_WAIT, request, self._awaitReply)
+            result = traced(hooks, PHASE_DECODE, request, self._decodeMeasured, decoder)
+        except Exception, ex:
+            if request is not None:
+                request.bytesReceived = self._received
+                hooks.requestEnd(request, ex)
+            raise
+        if request is not None:
+            request.bytesReceived = self._received
+            hooks.requestEnd(request, None)
+        return result
+
+    def _awaitReply(self):
+        if not self._connected:
+            # The decoder reports this
+            return
+        try:
+            timeout = self._timeout()
+        except ArakoonTimeout:
+            self.close()
+            raise
+        if not waitForReply([self], timeout):
+            msg = str(self._socketInfo)
+            self.close()
+            self._checkDeadline()
+            raise ArakoonSockNotReadable(msg = msg)
 
-    def decodeVoidResult(self) :
-        ArakoonProtocol.decodeVoidResult ( self )
+    def decodeStringResult(self):
+        return self._decode(ArakoonProtocol.decodeStringResult)
 
-    def decodeStringOptionResult (self):
-        return ArakoonProtocol.decodeStringOptionResult ( self )
+    def decodeBoolResult(self):
+        return self._decode(ArakoonProtocol.decodeBoolResult)
 
-    def decodeStringArrayResult(self) :
-        return ArakoonProtocol.decodeStringArrayResult ( self )
+    def decodeVoidResult(self):
+        return self._decode(ArakoonProtocol.decodeVoidResult)
+
+    def decodeStringOptionResult(self):
+        return self._decode(ArakoonProtocol.decodeStringOptionResult)
+
+    def decodeStringArrayResult(self):
+        return self._decode(ArakoonProtocol.decodeStringArrayResult)
 
     def decodeStringListResult(self):
-        return ArakoonProtocol.decodeStringListResult(self)
+        return self._decode(ArakoonProtocol.decodeStringListResult)
 
     def decodeStringOptionArrayResult(self):
-        return ArakoonProtocol.decodeStringOptionArrayResult(self)
+        return self._decode(ArakoonProtocol.decodeStringOptionArrayResult)
 
-    def decodeStringPairListResult(self) :
-        return ArakoonProtocol.decodeStringPairListResult ( self )
+    def decodeStringPairListResult(self):
+        return self._decode(ArakoonProtocol.decodeStringPairListResult)
 
     def decodeStatistics(self):
-        return ArakoonProtocol.decodeStatistics(self)
+        return self._decode(ArakoonProtocol.decodeStatistics)
 
     def decodeInt64Result(self):
-        return ArakoonProtocol.decodeInt64Result(self)
+        return self._decode(ArakoonProtocol.decodeInt64Result)
 
     def decodeIntResult(self):
-        return ArakoonProtocol.decodeIntResult(self)
+        return self._decode(ArakoonProtocol.decodeIntResult)
 
     def decodeNurseryCfgResult(self):
-        return ArakoonProtocol.decodeNurseryCfgResult(self)
+        return self._decode(ArakoonProtocol.decodeNurseryCfgResult)
 
     def decodeVersionResult(self):
-        return ArakoonProtocol.decodeVersionResult(self)
+        return self._decode(ArakoonProtocol.decodeVersionResult)
 
     def decodeGetTxidResult(self):
-        return ArakoonProtocol.decodeGetTxidResult(self)
-
+        return self._decode(ArakoonProtocol.decodeGetTxidResult)
+
+def waitForReply(connections, timeout):
+    """
+    Wait until at least one of the given connections has a reply to read.
+
+    @type connections: list of L{ArakoonClientConnection}
+    @type timeout: float
+    @param timeout: maximum time to wait, in seconds
+    @rtype: list of L{ArakoonClientConnection}
+    @return: the connections that can be read from (empty if the timeout expired)
+    """
+    ready = [c for c in connections if c._connected and c._hasBufferedReply()]
+    if ready:
+        return ready
+    sockets = dict((c._socket.fileno(), c) for c in connections if c._connected)
+    if not sockets:
+        return []
+    return [sockets[fd] for fd in readable(sockets.keys(), timeout)]
+
+def readable(fds, timeout):
+    """
+    Wait until at least one of the given file descriptors can be read from.
+
+    Uses poll where the platform has it: select can't handle descriptors
+    >= FD_SETSIZE (1024), which a process with many connections reaches.
+
+    @type fds: list of int
+    @type timeout: float
+    @param timeout: maximum time to wait, in seconds, or None to wait forever
+    @rtype: list of int
+    @return: the descriptors that can be read from (or are closed or in error)
+    """
+    if not hasattr(select, 'poll'):
+        result, _, _ = select.select(fds, [], [], timeout)
+        return result
+    poller = select.poll()
+    for fd in fds:
+        poller.register(fd, select.POLLIN | select.POLLPRI)
+    if timeout is not None:
+        timeout = int(math.ceil(timeout * 1000))
+    return [fd for (fd, _) in poller.poll(timeout)]
@@ -0,0 +1,208 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Client side value compression.
+
+A compressed value is stored as MAGIC, a one byte algorithm tag, the
+compressed bytes and a CRC32 of the tag and the compressed bytes. Values
+that are small, or don't get smaller, are stored as is. The rare plain value
+that happens to start with MAGIC is stored behind MAGIC and TAG_ESCAPED (and
+followed by its checksum too), to keep it from being mistaken for a
+compressed one.
+
+Only a value with MAGIC and a matching checksum is decoded, so values written
+without a codec, whatever they start with, read back unchanged (a value
+written without a codec that starts with MAGIC is taken for an encoded one
+only if its last 4 bytes happen to be the checksum of the rest).
+"""
+
+import binascii
+import struct
+import threading
+
+from ArakoonExceptions import ArakoonException
+from ArakoonProtocol import Set, Assert, Sequence
+
+MAGIC = '\x00\xa7\xc0'
+TAG_ESCAPED = '='
+HEADER_SIZE = len(MAGIC) + 1
+CHECKSUM_SIZE = 4
+
+def _checksum(data):
+    return struct.pack("<I", binascii.crc32(data) & 0xffffffff)
+
+def _wrap(tag, data):
+    body = tag + data
+    return MAGIC + body + _checksum(body)
+
+class ZlibAlgorithm :
+    """
+    Compression with zlib. Any object with a one character 'tag' and
+    'compress' and 'decompress' methods can take its place.
+    """
+
+    tag = 'z'
+
+    def __init__(self, level = 6):
+        """
+        @type level: int
+        @param level: zlib compression level, 1 (fastest) to 9 (smallest)
+        """
+        if not 1 <= level <= 9:
+            raise ValueError("level should be in [1,9], got %s" % level)
+        import zlib
+        self._zlib = zlib
+        self._level = level
+
+    def compress(self, data):
+        return self._zlib.compress(data, self._level)
+
+    def decompress(self, data):
+        return self._zlib.decompress(data)
+
+class CompressionCodec :
+
+    def __init__(self, threshold = 1024, algorithm = None, algorithms = ()):
+        """
+        @type threshold: int
+        @param threshold: Values shorter than this (in bytes) are stored as is
+        @param algorithm: Compresses the values written, defaults to a L{ZlibAlgorithm}
+        @type algorithms: list
+        @param algorithms: Other algorithms that values to be read may have been compressed with
+        """
+        if algorithm is None:
+            algorithm = ZlibAlgorithm()
+        self._threshold = threshold
+        self._algorithm = algorithm
+        self._algorithms = {}
+        for a in tuple(algorithms) + (algorithm,):
+            if len(a.tag) != 1 or a.tag == TAG_ESCAPED:
+                raise ValueError("Invalid algorithm tag %r" % a.tag)
+            self._algorithms[a.tag] = a
+        self._lock = threading.Lock()
+        self._values = 0
+        self._compressed = 0
+        self._bytesIn = 0
+        self._bytesOut = 0
+
+    def _pack(self, value):
+        if len(value) >= self._threshold:
+            packed = self._algorithm.compress(value)
+            if len(packed) + HEADER_SIZE + CHECKSUM_SIZE < len(value):
+                return _wrap(self._algorithm.tag, packed), True
+        if value.startswith(MAGIC):
+            return _wrap(TAG_ESCAPED, value), False
+        return value, False
+
+    def encode(self, value):
+        """
+        @type value: string
+        @param value: a value to be written, or None
+        @rtype: string
+        @return: the value as it should be stored
+        """
+        if value is None:
+            return None
+        stored, compressed = self._pack(value)
+        with self._lock:
+            self._values += 1
+            if compressed:
+                self._compressed += 1
+            self._bytesIn += len(value)
+            self._bytesOut += len(stored)
+        return stored
+
+    def encodeExpected(self, value):
+        """
+        Encode a value that is compared with a stored one (e.g. the old value
+        of a testAndSet), without counting it as written.
+        """
+        if value is None:
+            return None
+        return self._pack(value)[0]
+
+    def decode(self, stored):
+        """
+        @type stored: string
+        @param stored: a value as read from the store, or None
+        @rtype: string
+        @return: the value as it was written
+        @raise ArakoonException: stored was compressed with an unknown algorithm,
+            or can't be decompressed
+        """
+        if stored is None or not stored.startswith(MAGIC) or \
+           len(stored) < HEADER_SIZE + CHECKSUM_SIZE:
+            return stored
+        body = stored[len(MAGIC):-CHECKSUM_SIZE]
+        if _checksum(body) != stored[-CHECKSUM_SIZE:]:
+            # Written without a codec
+            return stored
+        tag = body[0]
+        if tag == TAG_ESCAPED:
+            return body[1:]
+        algorithm = self._algorithms.get(tag)
+        if algorithm is None:
+            raise ArakoonException("Value compressed with unknown algorithm %r" % tag)
+        try:
+            return algorithm.decompress(body[1:])
+        except Exception, ex:
+            raise ArakoonException("Could not decompress value (%s: %s)" %
+                                   (ex.__class__.__name__, ex))
+
+    def decodeList(self, stored):
+        return [self.decode(v) for v in stored]
+
+    def decodePairs(self, stored):
+        return [(k, self.decode(v)) for (k, v) in stored]
+
+    def encodeSequence(self, seq):
+        """
+        @type seq: L{Sequence}
+        @rtype: L{Sequence}
+        @return: a copy of seq with the values of its sets and asserts encoded
+        """
+        result = Sequence()
+        for update in seq._updates:
+            if isinstance(update, Set):
+                update = Set(update._key, self.encode(update._value))
+            elif isinstance(update, Assert):
+                update = Assert(update._key, self.encodeExpected(update._vo))
+            elif isinstance(update, Sequence):
+                update = self.encodeSequence(update)
+            result.addUpdate(update)
+        return result
+
+    def statistics(self):
+        """
+        @rtype: dict
+        @return: counters of the values written, and the ratio of stored to original bytes
+        """
+        with self._lock:
+            values = self._values
+            compressed = self._compressed
+            bytesIn = self._bytesIn
+            bytesOut = self._bytesOut
+        ratio = 1.0
+        if bytesIn:
+            ratio = float(bytesOut) / bytesIn
+        return {'values' : values,
+                'compressed' : compressed,
+                'bytes_in' : bytesIn,
+                'bytes_out' : bytesOut,
+                'ratio' : ratio}
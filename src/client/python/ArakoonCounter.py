@@ -0,0 +1,248 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Compare-and-swap loops and counters that hold up under contention.
+
+A testAndSet loop that retries at once turns a hot key into a storm of
+failing proposals. Here the losers back off, for a time that adapts to the
+observed conflict rate, and retry with the value testAndSet returned
+instead of reading again. Sharded counters spread the increments over a
+number of keys, and can combine the increments of concurrent threads into a
+single update.
+"""
+
+import random
+import threading
+
+from ArakoonExceptions import *
+
+class AdaptiveBackoff :
+    """
+    Shared by the callers updating the same keys: every conflict doubles the
+    backoff ceiling, every success halves it. Sleeps are drawn uniformly from
+    [0, ceiling].
+    """
+
+    def __init__(self, base = 0.001, cap = 0.1):
+        """
+        @type base: float
+        @param base: The ceiling (in seconds) after the first conflict
+        @type cap: float
+        @param cap: The highest ceiling
+        """
+        self._base = base
+        self._cap = cap
+        self._ceiling = 0.0
+
+    def conflict(self):
+        """
+        @rtype: float
+        @return: the time to sleep before retrying
+        """
+        ceiling = min(self._cap, max(self._base, self._ceiling * 2))
+        self._ceiling = ceiling
+        return random.uniform(0, ceiling)
+
+    def success(self):
+        ceiling = self._ceiling / 2
+        if ceiling < self._base:
+            ceiling = 0.0
+        self._ceiling = ceiling
+
+def _sleep(client, period):
+    # Through the client, and not beyond the deadline of the call
+    client._sleep(min(period, client._remaining()))
+
+def compareAndSwap(client, key, f, backoff = None, maxAttempts = 100, current = None,
+                   timeout = None):
+    """
+    Replace the value of key by f(value) with testAndSet, retrying on conflicts.
+
+    @type key: string
+    @type f: function
+    @param f: Takes the current value (None if there is none) and returns the new one (None deletes the key)
+    @type backoff: L{AdaptiveBackoff}
+    @param backoff: Share one between callers updating the same key
+    @type maxAttempts: int
+    @param current: The value key probably has, to save the initial read
+    @type timeout: float
+    @param timeout: The time (in seconds) all attempts and sleeps together may take
+    @return: the new value
+    @raise ArakoonAssertionFailed: every one of maxAttempts attempts lost a race
+    @raise ArakoonTimeout: the timeout expired
+    """
+    if timeout is not None:
+        return client._callWithin(timeout, compareAndSwap,
+                                  (key, f, backoff, maxAttempts, current), {})
+    if backoff is None:
+        backoff = AdaptiveBackoff()
+    if current is None:
+        current = client.multiGetOption([key])[0]
+    for attempt in range(maxAttempts):
+        wanted = f(current)
+        previous = client.testAndSet(key, current, wanted)
+        if previous == current:
+            backoff.success()
+            return wanted
+        current = previous
+        _sleep(client, backoff.conflict())
+    raise ArakoonAssertionFailed("%r changed %d times" % (key, maxAttempts))
+
+def _add(delta):
+    def f(value):
+        if value is None:
+            return str(delta)
+        return str(int(value) + delta)
+    return f
+
+class Counter :
+    """
+    An integer, stored as a decimal string under a single key.
+    """
+
+    def __init__(self, client, key, backoff = None):
+        self._client = client
+        self._key = key
+        if backoff is None:
+            backoff = AdaptiveBackoff()
+        self._backoff = backoff
+
+    def increment(self, delta = 1, timeout = None):
+        """
+        @type timeout: float
+        @param timeout: See L{compareAndSwap}
+        @rtype: int
+        @return: the value after the increment
+        """
+        return int(compareAndSwap(self._client, self._key, _add(delta), self._backoff,
+                                  timeout = timeout))
+
+    def value(self):
+        v = self._client.multiGetOption([self._key])[0]
+        if v is None:
+            return 0
+        return int(v)
+
+class _Batch :
+    # Increments combined into one update
+
+    def __init__(self):
+        self.delta = 0
+        self.done = False
+        self.error = None
+
+class ShardedCounter :
+    """
+    An integer stored as the sum of a number of keys, key + '/' + shard.
+
+    Increments go to a random shard, and move to another one after a
+    conflict. The value is read with one multiGetOption of all shards.
+
+    With combine set, threads sharing the counter combine their
+    increments: while one thread is updating a shard, the increments of the
+    others are added up, and sent as one update by the next of them. An
+    increment still returns only once it is stored.
+    """
+
+    def __init__(self, client, key, shards = 16, combine = False, maxAttempts = 100):
+        """
+        @type client: L{ArakoonClient}
+        @type key: string
+        @type shards: int
+        @param shards: The number of keys; more shards allow more concurrent writers
+        @type combine: bool
+        @param combine: Combine the increments of concurrent threads
+        @type maxAttempts: int
+        @param maxAttempts: The number of testAndSets an increment may take
+        """
+        if shards < 1:
+            raise ValueError("shards should be at least 1, got %s" % shards)
+        if maxAttempts < 1:
+            raise ValueError("maxAttempts should be at least 1, got %s" % maxAttempts)
+        self._key = key
+        self._maxAttempts = maxAttempts
+        self._client = client
+        self._keys = ["%s/%d" % (key, i) for i in range(shards)]
+        self._backoffs = [AdaptiveBackoff() for i in range(shards)]
+        self._combine = combine
+        self._cond = threading.Condition()
+        self._open = _Batch()
+        self._flushing = False
+
+    def _add(self, client, delta):
+        for attempt in range(self._maxAttempts):
+            shard = random.randrange(len(self._keys))
+            key = self._keys[shard]
+            backoff = self._backoffs[shard]
+            current = client.multiGetOption([key])[0]
+            previous = client.testAndSet(key, current, _add(delta)(current))
+            if previous == current:
+                backoff.success()
+                return
+            # Somebody else is using this shard: try another one
+            _sleep(client, backoff.conflict())
+        raise ArakoonAssertionFailed("%d attempts to add to %s lost a race" %
+                                     (self._maxAttempts, self._key))
+
+    def _send(self, delta, timeout):
+        if timeout is None:
+            self._add(self._client, delta)
+        else:
+            self._client._callWithin(timeout, self._add, (delta,), {})
+
+    def increment(self, delta = 1, timeout = None):
+        """
+        @type timeout: float
+        @param timeout: The time (in seconds) the update may take; with
+            combine, the timeout of the thread that sends the combined update applies
+        @raise ArakoonAssertionFailed: maxAttempts attempts lost a race
+        @raise ArakoonTimeout: the timeout expired
+        """
+        if not self._combine:
+            self._send(delta, timeout)
+            return
+        with self._cond:
+            batch = self._open
+            batch.delta += delta
+            while not batch.done and self._flushing:
+                self._cond.wait()
+            if batch.done:
+                if batch.error is not None:
+                    raise batch.error
+                return
+            # Send this batch; increments arriving meanwhile go in the next
+            self._flushing = True
+            self._open = _Batch()
+        try:
+            self._send(batch.delta, timeout)
+        except Exception, ex:
+            batch.error = ex
+        with self._cond:
+            batch.done = True
+            self._flushing = False
+            self._cond.notify_all()
+        if batch.error is not None:
+            raise batch.error
+
+    def value(self):
+        """
+        @rtype: int
+        @return: the sum of all shards
+        """
+        return sum(int(v) for v in self._client.multiGetOption(self._keys) if v is not None)
@@ -93,6 +93,25 @@ class ArakoonUserfunctionFailure( ArakoonException ):
 class ArakoonGoingDown(ArakoonException):
     _msg = "Server is going down"
 
+class ArakoonTimeout( ArakoonException ):
+    _msg = "Operation did not complete within its timeout"
+
+class ArakoonNodeUnavailable( ArakoonException ):
+    _msgF = "Circuit breaker of node %s is open"
+
+    def __init__ (self, nodeId):
+        self._msg = ArakoonNodeUnavailable._msgF % nodeId
+        ArakoonException.__init__( self, self._msg )
+
+class ArakoonThrottled( ArakoonException ):
+    _msg = "Request rejected by client side admission control"
+
+class ArakoonBlobCorrupted( ArakoonException ):
+    _msg = "Blob chunk does not match its checksum"
+
+class ArakoonBlobChanged( ArakoonException ):
+    _msg = "Blob was replaced or deleted while it was being read"
+
 class ArakoonSocketException ( ArakoonException ):
     pass
 
@@ -0,0 +1,87 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Consistent hashing of keys over a set of members (nodes, clusters).
+
+Every member is put on a ring at a number of pseudo-random points. A key
+belongs to the member of the first point at or after the hash of the key;
+walking on along the ring gives the other members, in the order to fall
+back to. Adding or removing a member only moves the keys of its own points.
+"""
+
+import bisect
+import hashlib
+import struct
+
+def _hash(s):
+    return struct.unpack(">Q", hashlib.md5(s).digest()[:8])[0]
+
+class HashRing :
+
+    def __init__(self, members, vnodes = 160):
+        """
+        @type members: list of strings
+        @param members: The identifiers of the members
+        @type vnodes: int
+        @param vnodes: The number of points per member; more points spread the keys more evenly
+        """
+        members = sorted(set(members))
+        if not members:
+            raise ValueError("A ring needs at least one member")
+        if vnodes < 1:
+            raise ValueError("vnodes should be at least 1, got %s" % vnodes)
+        self._members = members
+        points = []
+        for member in members:
+            for i in range(vnodes):
+                points.append((_hash("%s#%d" % (member, i)), member))
+        points.sort()
+        self._points = [h for (h, member) in points]
+        # The fallback order for every point, so a lookup is a single bisect
+        owners = [member for (h, member) in points]
+        self._preferences = []
+        for i in range(len(owners)):
+            preference = []
+            j = i
+            while len(preference) < len(members):
+                if owners[j] not in preference:
+                    preference.append(owners[j])
+                j = (j + 1) % len(owners)
+            self._preferences.append(preference)
+
+    def members(self):
+        return list(self._members)
+
+    def preference(self, key):
+        """
+        @type key: string
+        @rtype: list of strings
+        @return: all members, the one key belongs to first; callers should not modify it
+        """
+        i = bisect.bisect_left(self._points, _hash(key))
+        if i == len(self._points):
+            i = 0
+        return self._preferences[i]
+
+    def lookup(self, key):
+        """
+        @rtype: string
+        @return: the member key belongs to
+        """
+        return self.preference(key)[0]
@@ -0,0 +1,126 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Hedged reads: when the replica serving a dirty read does not answer within
+a delay derived from the observed latency distribution, the same request is
+sent to a second replica and whichever answers first wins.
+"""
+
+import threading
+
+class HedgePolicy :
+
+    def __init__(self, percentile = 95.0, minDelay = 0.001, maxDelay = 0.5,
+                 window = 1000, minSamples = 20):
+        """
+        @type percentile: float
+        @param percentile: Hedge once a read takes longer than this percentile of recent reads
+        @type minDelay: float
+        @param minDelay: Lower bound (in seconds) on the hedge delay
+        @type maxDelay: float
+        @param maxDelay: Upper bound (in seconds) on the hedge delay, also used until enough samples are known
+        @type window: int
+        @param window: Number of recent latencies the percentile is computed over
+        @type minSamples: int
+        @param minSamples: Number of samples needed before the percentile is trusted
+        """
+        if not 0.0 < percentile < 100.0:
+            raise ValueError("percentile should be in ]0,100[, got %s" % percentile)
+        if minDelay > maxDelay:
+            raise ValueError("minDelay %s exceeds maxDelay %s" % (minDelay, maxDelay))
+        self._percentile = percentile
+        self._minDelay = minDelay
+        self._maxDelay = maxDelay
+        self._window = window
+        self._minSamples = minSamples
+        self._lock = threading.Lock()
+        self._samples = []
+        self._next = 0
+        self._dirty = 0
+        self._delay = maxDelay
+        self._reads = 0
+        self._hedged = 0
+        self._hedgeWins = 0
+
+    def delay(self):
+        """
+        @rtype: float
+        @return: the time (in seconds) to wait for the first replica before hedging
+        """
+        return self._delay
+
+    def record(self, latency):
+        """
+        Register the time it took for a dirty read to get its first reply.
+        """
+        with self._lock:
+            self._reads += 1
+            if len(self._samples) < self._window:
+                self._samples.append(latency)
+            else:
+                self._samples[self._next] = latency
+                self._next = (self._next + 1) % self._window
+            self._dirty += 1
+            # Sorting the window on every read would dominate a cheap get;
+            # the percentile moves slowly, so refresh it every few samples.
+            if self._dirty * 10 >= len(self._samples) and \
+               len(self._samples) >= self._minSamples:
+                self._recompute()
+
+    def _recompute(self):
+        ordered = sorted(self._samples)
+        index = int(len(ordered) * self._percentile / 100.0)
+        index = min(index, len(ordered) - 1)
+        self._delay = min(self._maxDelay, max(self._minDelay, ordered[index]))
+        self._dirty = 0
+
+    def noteHedged(self, won):
+        """
+        Register that a read was hedged.
+
+        @type won: bool
+        @param won: True if the second replica answered first
+        """
+        with self._lock:
+            self._hedged += 1
+            if won:
+                self._hedgeWins += 1
+
+    def statistics(self):
+        """
+        @rtype: dict
+        @return: counters and rates describing the hedging behaviour so far
+        """
+        with self._lock:
+            reads = self._reads
+            hedged = self._hedged
+            wins = self._hedgeWins
+            delay = self._delay
+        hedgeRate = 0.0
+        if reads:
+            hedgeRate = float(hedged) / reads
+        winRate = 0.0
+        if hedged:
+            winRate = float(wins) / hedged
+        return {'reads' : reads,
+                'hedged' : hedged,
+                'hedge_wins' : wins,
+                'hedge_rate' : hedgeRate,
+                'win_rate' : winRate,
+                'delay' : delay}
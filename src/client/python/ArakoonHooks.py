@@ -0,0 +1,116 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Lifecycle hooks: start and end events for every request sent to a node and
+for the phases a call goes through, so tracers and profilers can follow
+where the time goes.
+"""
+
+from ArakoonMetrics import commandName
+
+# Asking the nodes who is master (spans the whoMaster requests it sends)
+PHASE_DISCOVER = 'discover'
+# Setting up a TCP connection to a node
+PHASE_CONNECT = 'connect'
+# TLS handshake on a fresh connection
+PHASE_TLS = 'tls'
+# From entering a client method until its first request is handed to a connection
+PHASE_ENCODE = 'encode'
+# Writing a request to the socket
+PHASE_SEND = 'send'
+# Waiting for the first bytes of the reply
+PHASE_WAIT = 'wait'
+# Reading and decoding the reply
+PHASE_DECODE = 'decode'
+# Sleeping before another attempt
+PHASE_RETRY_SLEEP = 'retry_sleep'
+
+PHASES = (PHASE_DISCOVER, PHASE_CONNECT, PHASE_TLS, PHASE_ENCODE,
+          PHASE_SEND, PHASE_WAIT, PHASE_DECODE, PHASE_RETRY_SLEEP)
+
+class Request :
+    """
+    A request/reply exchange with one node.
+
+    @ivar header: the first 4 bytes of the request
+    @ivar nodeId: the node the request is sent to
+    @ivar bytesSent: size of the request
+    @ivar bytesReceived: size of the reply, known once it is decoded
+    @ivar attempt: number of failed attempts to send the request so far
+    @ivar userData: free for use by the hooks, e.g. to keep a span
+    """
+
+    def __init__(self, header, nodeId, bytesSent):
+        self.header = header
+        self.nodeId = nodeId
+        self.bytesSent = bytesSent
+        self.bytesReceived = None
+        self.attempt = 0
+        self.userData = None
+
+    def getCommand(self):
+        """
+        @rtype: string
+        @return: the name of the command, e.g. 'get'
+        """
+        return commandName(self.header)
+
+    def __str__(self):
+        return "Request(%s to %s, %s bytes)" % \
+            (self.getCommand(), self.nodeId, self.bytesSent)
+
+    __repr__ = __str__
+
+class ClientHooks :
+    """
+    Base class for lifecycle hooks: override the events of interest.
+
+    Hooks are called synchronously, on the thread doing the call, and
+    should be quick. They must not raise.
+
+    Phases that are not tied to a single exchange (L{PHASE_DISCOVER},
+    L{PHASE_ENCODE} and sleeps between attempts of a whole call) are
+    reported with request None. Failed requests and phases end with the
+    exception as error, otherwise error is None.
+    """
+
+    def requestStart(self, request):
+        pass
+
+    def requestEnd(self, request, error):
+        pass
+
+    def phaseStart(self, phase, request):
+        pass
+
+    def phaseEnd(self, phase, request, error):
+        pass
+
+def traced(hooks, phase, request, f, *args, **kwargs):
+    """
+    Call f(*args, **kwargs) between the start and end events of phase.
+    """
+    hooks.phaseStart(phase, request)
+    try:
+        result = f(*args, **kwargs)
+    except Exception, ex:
+        hooks.phaseEnd(phase, request, ex)
+        raise
+    hooks.phaseEnd(phase, request, None)
+    return result
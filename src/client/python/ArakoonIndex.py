@@ -0,0 +1,205 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Secondary indexes: lookups of records by attributes other than their key.
+
+An index entry is an empty value under a key packed from the attribute and
+the key of the record (see L{ArakoonTuple}), so all records with an
+attribute in a given range are found with one range query on the index.
+Records and their index entries are written in one sequence, which asserts
+that the record did not change since it was read.
+"""
+
+from ArakoonExceptions import *
+from ArakoonProtocol import Sequence
+import ArakoonTuple
+
+INDEX_PREFIX = "@@arakoon_index/"
+
+class SecondaryIndex :
+
+    def __init__(self, name, extract):
+        """
+        @type name: string
+        @param name: The name of the index, part of the keys of its entries
+        @type extract: function
+        @param extract: Called with the value of a record, returns the list of
+            attributes to index it by; each attribute is None, str, unicode,
+            int, float, bool or a tuple of those. Lookups must use the same
+            type: 'Gent' and u'Gent' are different attributes.
+        """
+        self.name = name
+        self._extract = extract
+
+    def attributes(self, value):
+        if value is None:
+            return set()
+        return set(self._extract(value))
+
+class IndexedStore :
+    """
+    Records, stored under their key, that can also be found through a
+    number of secondary indexes.
+
+    Example::
+
+        byCity = SecondaryIndex('city', lambda v: [json.loads(v)['city']])
+        users = IndexedStore(client, [byCity])
+        users.put('user/1', json.dumps({'name': 'jan', 'city': u'Gent'}))
+        for key, value in users.fetch('city', u'Gent'):
+            ...
+
+    All writes to the records must go through the store, or the indexes get
+    out of date.
+    """
+
+    def __init__(self, client, indexes, prefix = INDEX_PREFIX):
+        """
+        @type client: L{ArakoonClient}
+        @type indexes: list of L{SecondaryIndex}
+        @type prefix: string
+        @param prefix: Index entries are kept under prefix + index name + '/'
+        """
+        self._client = client
+        self._indexes = {}
+        for index in indexes:
+            if index.name in self._indexes:
+                raise ValueError("Duplicate index name %r" % index.name)
+            self._indexes[index.name] = index
+        self._prefix = prefix
+
+    def _indexPrefix(self, name):
+        return "%s%s/" % (self._prefix, name)
+
+    def _entryKey(self, name, attribute, key):
+        return ArakoonTuple.pack((attribute, key), self._indexPrefix(name))
+
+    def _index(self, name):
+        try:
+            return self._indexes[name]
+        except KeyError:
+            raise ValueError("Unknown index %r" % name)
+
+    def _update(self, seq, key, old, new):
+        # Add the changes to the entries of all indexes to seq
+        for name, index in self._indexes.items():
+            before = index.attributes(old)
+            after = index.attributes(new)
+            for attribute in before - after:
+                seq.addDelete(self._entryKey(name, attribute, key))
+            for attribute in after - before:
+                seq.addSet(self._entryKey(name, attribute, key), "")
+
+    def get(self, key):
+        """
+        @rtype: string
+        @return: the value of the record with the given key
+        """
+        return self._client.get(key)
+
+    def put(self, key, value):
+        """
+        Write a record and update its index entries, atomically.
+
+        @type key: string
+        @type value: string
+        @raise ArakoonAssertionFailed: the record changed between reading it and writing it
+        """
+        old = self._client.multiGetOption([key])[0]
+        seq = Sequence()
+        seq.addAssert(key, old)
+        seq.addSet(key, value)
+        self._update(seq, key, old, value)
+        self._client.sequence(seq)
+
+    def delete(self, key):
+        """
+        Remove a record and its index entries, atomically.
+
+        @raise ArakoonNotFound: there is no record with the given key
+        @raise ArakoonAssertionFailed: the record changed concurrently
+        """
+        old = self._client.multiGetOption([key])[0]
+        if old is None:
+            raise ArakoonNotFound(key)
+        seq = Sequence()
+        seq.addAssert(key, old)
+        seq.addDelete(key)
+        self._update(seq, key, old, None)
+        self._client.sequence(seq)
+
+    def lookup(self, name, attribute, maxElements = -1):
+        """
+        @type name: string
+        @param name: The name of the index
+        @param attribute: The attribute the records should have
+        @type maxElements: int
+        @param maxElements: The maximum number of keys to return, negative means all
+        @rtype: list of strings
+        @return: the keys of the records with the attribute, in key order
+        """
+        self._index(name)
+        bounds = ArakoonTuple.prefixRange((attribute,), self._indexPrefix(name))
+        return self._keysIn(name, bounds, maxElements)
+
+    def lookupRange(self, name, start, stop, maxElements = -1):
+        """
+        @type name: string
+        @param name: The name of the index
+        @param start: The lowest attribute to return records for
+        @param stop: The first attribute beyond the range
+        @type maxElements: int
+        @param maxElements: The maximum number of keys to return, negative means all
+        @rtype: list of strings
+        @return: the keys of the records with an attribute in [start, stop[, in attribute order
+        """
+        self._index(name)
+        bounds = ArakoonTuple.betweenRange((), start, stop, self._indexPrefix(name))
+        return self._keysIn(name, bounds, maxElements)
+
+    def _keysIn(self, name, bounds, maxElements):
+        begin, beginIncluded, end, endIncluded = bounds
+        prefix = self._indexPrefix(name)
+        entries = self._client.range(begin, beginIncluded, end, endIncluded, maxElements)
+        return [ArakoonTuple.unpack(entry, prefix)[-1] for entry in entries]
+
+    def fetch(self, name, attribute, maxElements = -1):
+        """
+        Like L{lookup}, but returns the records with one multiGetOption.
+
+        @rtype: list of (string, string)
+        @return: the key and value of the records with the attribute
+        """
+        return self._records(self.lookup(name, attribute, maxElements))
+
+    def fetchRange(self, name, start, stop, maxElements = -1):
+        """
+        Like L{lookupRange}, but returns the records with one multiGetOption.
+
+        @rtype: list of (string, string)
+        @return: the key and value of the records with an attribute in [start, stop[
+        """
+        return self._records(self.lookupRange(name, start, stop, maxElements))
+
+    def _records(self, keys):
+        if not keys:
+            return []
+        values = self._client.multiGetOption(keys)
+        # A record can be gone since its entry was read
+        return [(k, v) for (k, v) in zip(keys, values) if v is not None]
@@ -0,0 +1,173 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Background maintenance of the connections of a client.
+
+A daemon thread visits every node of the cluster at a fixed interval. It
+connects to nodes the client has no working connection to, and asks idle
+connections who the master is: that keeps them alive, finds out about
+broken ones before a request does, and tells the client about a new master
+before its next request goes to the old one. When the client probes
+replication, the maintainer asks the nodes which transaction they applied
+as well, so AtLeast reads don't have to.
+
+A connection is only touched while it has no reply outstanding. It is
+taken from the client for the duration of the ping; a request for the node
+meanwhile gets a connection of its own.
+"""
+
+import threading
+import time
+import weakref
+
+from ArakoonExceptions import *
+from ArakoonProtocol import ArakoonProtocol, ArakoonClientLogger, AtLeast
+from ArakoonBreaker import CLOSED, HALF_OPEN
+
+class ConnectionMaintainer :
+
+    def __init__(self, client, interval = 5.0):
+        """
+        Connects and pings take at most the connection timeout.
+
+        @type client: L{ArakoonClient}
+        @type interval: float
+        @param interval: The time (in seconds) between visits of a node; connections idle for this long are pinged
+        """
+        if interval <= 0:
+            raise ValueError("interval should be positive, got %s" % interval)
+        self.interval = interval
+        # Don't keep a client alive that is no longer used
+        self._client = weakref.ref(client)
+        self._stop = threading.Event()
+        self._thread = None
+        self._rounds = 0
+        self._pings = 0
+        self._failures = 0
+        self._masterUpdates = 0
+
+    def start(self):
+        self._thread = threading.Thread(target = self._run,
+                                        name = "arakoon-maintainer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            client = self._client()
+            if client is None:
+                return
+            try:
+                self.maintain(client)
+            except Exception, ex:
+                ArakoonClientLogger.logError("Connection maintenance failed (%s: %s)",
+                                             ex.__class__.__name__, ex)
+            del client
+            self._stop.wait(self.interval)
+
+    def maintain(self, client):
+        """
+        Visit every node once.
+        """
+        self._rounds += 1
+        answers = {}
+        for nodeId in client._config.getNodes().keys():
+            if self._stop.is_set():
+                return
+            masterId = self._visit(client, nodeId)
+            if masterId is not None:
+                answers[nodeId] = masterId
+        self._learnMaster(client, answers)
+        if client._replicationProbeInterval is not None:
+            # Reads need not probe replication themselves
+            client._lastReplicationProbe = time.time()
+
+    def _visit(self, client, nodeId):
+        # Returns who the node says is master, if it was asked
+        breakers = client._breakers
+        breaker = None
+        if breakers is not None:
+            breaker = breakers.breaker(nodeId)
+            if not breaker.available():
+                return None
+        connection = client._takeIdleConnection(nodeId, self.interval)
+        if connection is None:
+            return None
+        state = CLOSED
+        if breaker is not None:
+            state = breaker.acquire()
+            if state != CLOSED and state != HALF_OPEN:
+                client._returnConnection(nodeId, connection)
+                return None
+        try:
+            self._pings += 1
+            connection.send(ArakoonProtocol.encodeWhoMaster())
+            masterId = connection.decodeStringOptionResult()
+            if client._replicationProbeInterval is not None:
+                connection.send(ArakoonProtocol.encodeGetTxid())
+                applied = connection.decodeGetTxidResult()
+                if isinstance(applied, AtLeast):
+                    client._replication.noteApplied(nodeId, applied.getI())
+        except Exception, ex:
+            self._failures += 1
+            connection.close()
+            if state == HALF_OPEN:
+                breaker.probed(False)
+            ArakoonClientLogger.logDebug("Ping of node '%s' failed (%s: %s)",
+                                         nodeId, ex.__class__.__name__, ex)
+            return None
+        if state == HALF_OPEN:
+            breaker.probed(True)
+        client._returnConnection(nodeId, connection)
+        return masterId
+
+    def _learnMaster(self, client, answers):
+        # Only a node that says it is master itself is believed
+        candidates = set(m for (n, m) in answers.items() if answers.get(m) == m)
+        if len(candidates) != 1:
+            return
+        masterId = candidates.pop()
+        current = client._masterId
+        if current == masterId:
+            return
+        if current is not None:
+            if current not in answers or answers[current] == current:
+                # Not asked, or still says it is master: leave it to the requests
+                return
+            client._forgetMaster(ArakoonNodeNotMaster("%s says %s is master" %
+                                                      (current, answers[current])))
+        client._masterId = masterId
+        client._foundMaster()
+        self._masterUpdates += 1
+
+    def statistics(self):
+        """
+        @rtype: dict
+        @return: the number of rounds, pings, failed pings and master changes found
+        """
+        return {'rounds' : self._rounds,
+                'pings' : self._pings,
+                'failures' : self._failures,
+                'master_updates' : self._masterUpdates}
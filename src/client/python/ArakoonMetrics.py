@@ -0,0 +1,258 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Client side instrumentation: latency histograms per command and counters
+for traffic, connects, retries and master changes.
+
+Recording is kept to a few attribute updates, without locking: under
+concurrent use of one client an occasional update can get lost, which is
+acceptable for monitoring purposes.
+"""
+
+import struct
+
+import ArakoonProtocol
+
+# Every power of two is split in 2^SUB_BUCKET_BITS buckets, so values are
+# kept with a relative error below 1/2^SUB_BUCKET_BITS (12.5%)
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# Bucket boundaries (in seconds) used for the Prometheus export
+PROMETHEUS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                      0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _bucketBounds(index):
+    """
+    @return: the range [lower, upper[ of microsecond values in bucket index
+    """
+    if index < SUB_BUCKETS:
+        return index, index + 1
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    top = (index & (SUB_BUCKETS - 1)) + SUB_BUCKETS
+    return top << shift, (top + 1) << shift
+
+def _number(value):
+    # %r would render a long as 123L
+    if isinstance(value, float):
+        return repr(value)
+    return '%d' % value
+
+class LatencyHistogram :
+    """
+    Histogram of durations with logarithmic buckets of microseconds, in the
+    spirit of HdrHistogram.
+    """
+
+    def __init__(self):
+        self._counts = [0] * (64 * SUB_BUCKETS)
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        # This is on the path of every request: the bucket index computation
+        # is inlined, and the count is derived from the buckets when needed.
+        micros = int(seconds * 1000000)
+        if micros < SUB_BUCKETS:
+            self._counts[micros] += 1
+        else:
+            shift = micros.bit_length() - SUB_BUCKET_BITS - 1
+            self._counts[((shift + 1) << SUB_BUCKET_BITS) + (micros >> shift) - SUB_BUCKETS] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def getCount(self):
+        return sum(self._counts)
+
+    def percentile(self, p):
+        """
+        @type p: float
+        @param p: percentile, between 0 and 100
+        @rtype: float
+        @return: the upper bound (in seconds) of the bucket holding the percentile
+        """
+        count = self.getCount()
+        if count == 0:
+            return 0.0
+        rank = p / 100.0 * count
+        seen = 0
+        for index, n in enumerate(self._counts):
+            seen += n
+            if n and seen >= rank:
+                return min(_bucketBounds(index)[1] / 1000000.0, self.max)
+        return self.max
+
+    def countBelow(self, seconds):
+        """
+        @rtype: int
+        @return: the number of recorded values in buckets that end at or before seconds
+        """
+        limit = seconds * 1000000
+        result = 0
+        for index, n in enumerate(self._counts):
+            if n:
+                if _bucketBounds(index)[1] > limit:
+                    break
+                result += n
+        return result
+
+    def summary(self):
+        count = self.getCount()
+        mean = 0.0
+        if count:
+            mean = self.total / count
+        return {'count' : count,
+                'mean' : mean,
+                'max' : self.max,
+                'p50' : self.percentile(50),
+                'p90' : self.percentile(90),
+                'p99' : self.percentile(99),
+                'p999' : self.percentile(99.9)}
+
+_commandNames = None
+
+def commandName(header):
+    """
+    @type header: string
+    @param header: the first 4 bytes of a request
+    @rtype: string
+    @return: the name of the command, e.g. 'get' for ARA_CMD_GET
+    """
+    global _commandNames
+    if _commandNames is None:
+        names = {}
+        for name, value in vars(ArakoonProtocol).items():
+            if name.startswith('ARA_CMD_') and name not in ('ARA_CMD_MAG', 'ARA_CMD_VER'):
+                names[value] = name[len('ARA_CMD_'):].lower()
+        _commandNames = names
+    code = struct.unpack("I", header)[0]
+    return _commandNames.get(code, "0x%08x" % code)
+
+class ClientMetrics :
+
+    def __init__(self):
+        self.requests = {}
+        self.errors = {}
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.connects = 0
+        self.retries = 0
+        self.retrySleep = 0.0
+        self.failovers = 0
+        self.masterChanges = 0
+        self.lockWait = LatencyHistogram()
+        self.throttleWait = LatencyHistogram()
+        self.throttleRejections = 0
+
+    def recordRequest(self, header, seconds, failed):
+        """
+        Register a request/reply exchange.
+
+        @type header: string
+        @param header: the first 4 bytes of the request, identifying the command
+        @type seconds: float
+        @param seconds: time from sending the request until its reply was decoded
+        @type failed: bool
+        @param failed: True if the reply was an error (or could not be read)
+        """
+        try:
+            self.requests[header].record(seconds)
+        except KeyError:
+            self.requests.setdefault(header, LatencyHistogram()).record(seconds)
+        if failed:
+            self.errors[header] = self.errors.get(header, 0) + 1
+
+    def snapshot(self):
+        """
+        @rtype: dict
+        @return: a copy of all metrics, with latency summaries per command name
+        """
+        requests = {}
+        for header, histogram in self.requests.items():
+            summary = histogram.summary()
+            summary['errors'] = self.errors.get(header, 0)
+            requests[commandName(header)] = summary
+        return {'requests' : requests,
+                'bytes_sent' : self.bytesSent,
+                'bytes_received' : self.bytesReceived,
+                'connects' : self.connects,
+                'retries' : self.retries,
+                'retry_sleep_seconds' : self.retrySleep,
+                'failovers' : self.failovers,
+                'master_changes' : self.masterChanges,
+                'lock_wait' : self.lockWait.summary(),
+                'throttle_wait' : self.throttleWait.summary(),
+                'throttle_rejections' : self.throttleRejections}
+
+    def prometheus(self, prefix = 'arakoon_client', labels = None):
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        @type prefix: string
+        @param prefix: prefix of every metric name
+        @type labels: dict
+        @param labels: extra labels added to every sample, e.g. {'cluster': 'ricky'}
+        @rtype: string
+        """
+        extra = ''
+        if labels:
+            extra = ''.join(',%s="%s"' % (k, v) for (k, v) in sorted(labels.items()))
+
+        def sample(name, value, ls = ''):
+            ls = (ls + extra).lstrip(',')
+            if ls:
+                return '%s_%s{%s} %s' % (prefix, name, ls, _number(value))
+            return '%s_%s %s' % (prefix, name, _number(value))
+
+        def histogram(name, h, ls = ''):
+            result = []
+            for le in PROMETHEUS_BUCKETS:
+                result.append(sample(name + '_bucket', h.countBelow(le),
+                                     '%s,le="%r"' % (ls, le)))
+            count = h.getCount()
+            result.append(sample(name + '_bucket', count, '%s,le="+Inf"' % ls))
+            result.append(sample(name + '_sum', h.total, ls))
+            result.append(sample(name + '_count', count, ls))
+            return result
+
+        lines = ['# HELP %s_request_seconds Time from sending a request until its reply is decoded' % prefix,
+                 '# TYPE %s_request_seconds histogram' % prefix]
+        for header, h in sorted(self.requests.items()):
+            lines.extend(histogram('request_seconds', h, ',command="%s"' % commandName(header)))
+        lines.append('# TYPE %s_request_errors_total counter' % prefix)
+        for header, n in sorted(self.errors.items()):
+            lines.append(sample('request_errors_total', n, ',command="%s"' % commandName(header)))
+        for name, value, kind in (('bytes_sent_total', self.bytesSent, 'counter'),
+                                  ('bytes_received_total', self.bytesReceived, 'counter'),
+                                  ('connects_total', self.connects, 'counter'),
+                                  ('retries_total', self.retries, 'counter'),
+                                  ('retry_sleep_seconds_total', self.retrySleep, 'counter'),
+                                  ('failovers_total', self.failovers, 'counter'),
+                                  ('master_changes_total', self.masterChanges, 'counter'),
+                                  ('throttle_rejections_total', self.throttleRejections, 'counter')):
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            lines.append(sample(name, value))
+        lines.append('# HELP %s_lock_wait_seconds Time spent waiting for the client lock before sending' % prefix)
+        lines.append('# TYPE %s_lock_wait_seconds histogram' % prefix)
+        lines.extend(histogram('lock_wait_seconds', self.lockWait))
+        lines.append('# HELP %s_throttle_wait_seconds Time requests waited for admission control' % prefix)
+        lines.append('# TYPE %s_throttle_wait_seconds histogram' % prefix)
+        lines.extend(histogram('throttle_wait_seconds', self.throttleWait))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,329 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Multiplexed requests: one thread keeps requests to many nodes, of one or
+more clusters, in flight at once. Requests are pipelined on the connections
+of the clients, and replies are decoded as they arrive, with the same
+decoders the clients use.
+"""
+
+import time
+import select
+import collections
+
+from ArakoonExceptions import *
+from ArakoonProtocol import ArakoonClientLogger
+
+class PendingReply :
+    """
+    A request sent through a L{Multiplexer}.
+
+    @ivar client: the client the request was sent with
+    @ivar nodeId: the node the request was sent to
+    @ivar tag: the tag given when submitting the request
+    @ivar done: True once the reply is decoded, or the request failed
+    """
+
+    def __init__(self, client, nodeId, header, decode, tag):
+        self.client = client
+        self.nodeId = nodeId
+        self.tag = tag
+        self.done = False
+        self._header = header
+        self._decode = decode
+        self._sentAt = time.time()
+        self._result = None
+        self._error = None
+
+    def _complete(self, result, error):
+        self._result = result
+        self._error = error
+        self.done = True
+
+    def getError(self):
+        """
+        @rtype: L{ArakoonException}
+        @return: the error the request failed with, or None
+        """
+        return self._error
+
+    def result(self):
+        """
+        @return: the decoded reply
+        @raise ArakoonException: the error the request failed with
+        """
+        if not self.done:
+            raise ArakoonException("No reply to the request yet")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+class _Channel :
+    # The requests waiting for a reply on one connection, in order
+
+    def __init__(self, client, nodeId, connection):
+        self.client = client
+        self.nodeId = nodeId
+        self.connection = connection
+        self.fd = connection._socket.fileno()
+        self.pending = collections.deque()
+
+class _Poller :
+    """
+    Readiness of many sockets at once: epoll, poll or (as a last resort)
+    select, in that order of preference.
+    """
+
+    def __init__(self):
+        self._epoll = None
+        self._poll = None
+        self._fds = set()
+        if hasattr(select, 'epoll'):
+            self._epoll = select.epoll()
+        elif hasattr(select, 'poll'):
+            self._poll = select.poll()
+
+    def register(self, fd):
+        if self._epoll is not None:
+            self._epoll.register(fd, select.EPOLLIN | select.EPOLLPRI)
+        elif self._poll is not None:
+            self._poll.register(fd, select.POLLIN | select.POLLPRI)
+        self._fds.add(fd)
+
+    def unregister(self, fd):
+        if fd not in self._fds:
+            return
+        self._fds.discard(fd)
+        try:
+            if self._epoll is not None:
+                self._epoll.unregister(fd)
+            elif self._poll is not None:
+                self._poll.unregister(fd)
+        except (IOError, OSError, KeyError):
+            # Already closed, which removes it from an epoll set by itself
+            pass
+
+    def poll(self, timeout):
+        if self._epoll is not None:
+            if timeout is None:
+                timeout = -1
+            return [fd for (fd, _) in self._epoll.poll(timeout)]
+        if self._poll is not None:
+            if timeout is not None:
+                timeout = int(timeout * 1000 + 0.999)
+            return [fd for (fd, _) in self._poll.poll(timeout)]
+        readable, _, _ = select.select(list(self._fds), [], [], timeout)
+        return readable
+
+    def close(self):
+        if self._epoll is not None:
+            self._epoll.close()
+        self._fds.clear()
+
+class Multiplexer :
+    """
+    Sends requests through any number of clients without waiting for the
+    replies, and collects the replies from all of them in one thread.
+
+    Example::
+
+        mux = Multiplexer()
+        for key in keys:
+            mux.submit(client, ArakoonProtocol.encodeGet(key, Consistent()),
+                       ArakoonClientConnection.decodeStringResult, tag = key)
+        for reply in mux.waitAll(timeout = 5.0):
+            values[reply.tag] = reply.result()
+
+    Requests are not retried: a failed request completes with the error.
+    When a failed send makes a client drop a connection, the requests still
+    waiting for a reply on it fail as well.
+    While requests are outstanding, the clients involved must not be used
+    by other threads, as their replies would get mixed up.
+    """
+
+    def __init__(self):
+        self._poller = _Poller()
+        self._channels = {}
+        self._outstanding = 0
+        # Requests failed by a submit, returned by the next wait
+        self._orphaned = []
+
+    def submit(self, client, msg, decode, nodeId = None, tag = None):
+        """
+        Send a request.
+
+        @type client: L{ArakoonClient}
+        @param client: The client whose connections are used
+        @type msg: string
+        @param msg: The encoded request, from one of the ArakoonProtocol.encode* functions
+        @type decode: function
+        @param decode: The decoder of the reply, one of the ArakoonClientConnection.decode* methods
+        @type nodeId: string
+        @param nodeId: The node to send the request to; the master if None
+        @param tag: Anything that helps the caller to identify the reply
+        @rtype: L{PendingReply}
+        """
+        try:
+            if nodeId is None:
+                client._determineMaster()
+                nodeId = client._masterId
+            reply = PendingReply(client, nodeId, msg[:4], decode, tag)
+            connection = client._sendMessage(nodeId, msg)
+        except ArakoonException, ex:
+            self._failDropped(client, nodeId)
+            reply = PendingReply(client, nodeId, msg[:4], decode, tag)
+            reply._complete(None, ex)
+            return reply
+
+        # A failed send makes the client reconnect, possibly on the same fd
+        self._failDropped(client, nodeId)
+        fd = connection._socket.fileno()
+        channel = self._channels.get(fd)
+        if channel is None or channel.connection is not connection:
+            channel = _Channel(client, nodeId, connection)
+            self._channels[fd] = channel
+        if not channel.pending:
+            self._poller.register(fd)
+        channel.pending.append(reply)
+        self._outstanding += 1
+        return reply
+
+    def _failDropped(self, client, nodeId):
+        # Fail the requests sent on a connection the client dropped since:
+        # their replies will never arrive
+        current = client._connections.get(nodeId)
+        for channel in self._channels.values():
+            if channel.client is client and channel.nodeId == nodeId and \
+               (channel.connection is not current or not current._connected):
+                self._fail(channel, ArakoonSockRecvClosed(), self._orphaned)
+
+    def outstanding(self):
+        """
+        @rtype: int
+        @return: the number of requests waiting for a reply
+        """
+        return self._outstanding
+
+    def wait(self, timeout = None):
+        """
+        Wait until replies arrive, and decode them.
+
+        @type timeout: float
+        @param timeout: Maximum time to wait (in seconds), or None to wait until there is a reply
+        @rtype: list of L{PendingReply}
+        @return: the requests that completed, empty if the timeout expired
+        """
+        completed = self._orphaned
+        self._orphaned = []
+        if not self._outstanding:
+            return completed
+        if completed:
+            return completed
+        # TLS can hold complete records the poller doesn't know about
+        ready = [c for c in self._channels.values()
+                 if c.pending and c.connection._hasBufferedReply()]
+        if not ready:
+            channels = self._channels
+            ready = [channels[fd] for fd in self._poller.poll(timeout) if fd in channels]
+        for channel in ready:
+            self._receive(channel, completed)
+        return completed
+
+    def waitAll(self, timeout = None):
+        """
+        Wait until all outstanding requests completed.
+
+        @type timeout: float
+        @param timeout: Maximum time to wait (in seconds), or None to wait as long as needed
+        @rtype: list of L{PendingReply}
+        @return: the requests that completed
+        @raise ArakoonTimeout: when replies are still outstanding after timeout seconds
+        """
+        completed = self._orphaned
+        self._orphaned = []
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while self._outstanding:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ArakoonTimeout("%d replies still outstanding" % self._outstanding)
+            completed.extend(self.wait(remaining))
+        return completed
+
+    def close(self):
+        """
+        Give up on all outstanding requests: their connections are dropped,
+        as their replies can no longer be matched with requests. The
+        multiplexer can't be used afterwards.
+        """
+        for channel in self._channels.values():
+            if channel.pending:
+                self._fail(channel, ArakoonException("Multiplexer closed"), [])
+        self._channels.clear()
+        self._poller.close()
+
+    def _receive(self, channel, completed):
+        reply = channel.pending.popleft()
+        self._outstanding -= 1
+        connection = channel.connection
+        # Several requests share the connection: account for this one
+        connection._request = reply._header
+        connection._sentAt = reply._sentAt
+        try:
+            result = reply._decode(connection)
+        except (ArakoonSocketException, ArakoonTimeout), ex:
+            reply._complete(None, ex)
+            completed.append(reply)
+            self._fail(channel, ex, completed)
+            return
+        except ArakoonException, ex:
+            # An error reply: the connection is fine
+            reply._complete(None, ex)
+        except Exception, ex:
+            ArakoonClientLogger.logError("Could not decode reply from '%s' (%s: %s)",
+                                         channel.nodeId, ex.__class__.__name__, ex)
+            reply._complete(None, ex)
+            completed.append(reply)
+            self._fail(channel, ex, completed)
+            return
+        else:
+            reply._complete(result, None)
+        completed.append(reply)
+        if not channel.pending:
+            self._poller.unregister(channel.fd)
+            del self._channels[channel.fd]
+
+    def _fail(self, channel, error, completed):
+        # The connection is out of step with its requests: drop it and
+        # fail whatever else was sent on it
+        self._poller.unregister(channel.fd)
+        if self._channels.get(channel.fd) is channel:
+            del self._channels[channel.fd]
+        if channel.client._connections.get(channel.nodeId) is channel.connection:
+            channel.client._dropConnection(channel.nodeId)
+        else:
+            channel.connection.close()
+        while channel.pending:
+            reply = channel.pending.popleft()
+            self._outstanding -= 1
+            reply._complete(None, error)
+            completed.append(reply)
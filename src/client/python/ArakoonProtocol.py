@@ -21,13 +21,11 @@ Module implementing the Arakoon protocol
 """
 from ArakoonExceptions import *
 from ArakoonValidators import SignatureValidator
-from NurseryRouting import RoutingInfo
 
 import os.path
-import ssl
 import struct
 import logging
-import select
+import socket
 import operator
 import cStringIO
 import types
@@ -357,48 +355,50 @@ def _readExactNBytes( con, n ):
         raise ArakoonSockRecvClosed()
     bytesRemaining = n
     tmpResult = ""
-    timeout = ArakoonClientConfig.getConnectionTimeout()
-
-    if isinstance(con._socket, ssl.SSLSocket):
-        s = con._socket
-        pending = s.pending()
-        if pending > 0:
-            tmpResult = s.recv(min(n, pending))
-            bytesRemaining = bytesRemaining - len(tmpResult)
 
+    # Waiting is left to the socket timeout rather than select, which can't
+    # handle descriptors >= FD_SETSIZE and costs an extra system call per read
     while bytesRemaining > 0 :
 
-        tripleList = select.select(  [con._socket] , [] , [] , timeout )
-
-        if ( len ( tripleList [0]) != 0 ) :
-            newChunk = ""
-            try :
-                newChunk =  tripleList [0][0].recv ( bytesRemaining)
-            except Exception, ex:
-                ArakoonClientLogger.logError ("Error while receiving from socket. %s: '%s'" % (ex.__class__.__name__, ex) )
-                con._connected = False
-                raise ArakoonSockRecvError()
-
-            newChunkSize = len( newChunk )
-            if newChunkSize == 0 :
-                try:
-                    con._socket.close()
-                except Exception, ex:
-                    ArakoonClientLogger.logError( "Error while closing socket. %s: %s" % (ex.__class__.__name__,ex))
-                con._connected = False
-                raise ArakoonSockReadNoBytes ()
-            tmpResult = tmpResult + newChunk
-            bytesRemaining = bytesRemaining - newChunkSize
-
-        else :
+        try:
+            timeout = con._timeout()
+        except ArakoonTimeout:
+            con.close()
+            raise
+
+        try :
+            if timeout != con._socketTimeout:
+                con._socket.settimeout(timeout)
+                con._socketTimeout = timeout
+            newChunk = con._socket.recv ( bytesRemaining )
+        except socket.timeout:
             msg = str(con._socketInfo)
             try:
                 con._socket.close()
             except Exception, ex:
                 ArakoonClientLogger.logError( "Error while closing socket. %s: %s" % (ex.__class__.__name__,ex))
             con._connected = False
+            con._checkDeadline()
             raise ArakoonSockNotReadable(msg = msg)
+        except Exception, ex:
+            ArakoonClientLogger.logError ("Error while receiving from socket. %s: '%s'" % (ex.__class__.__name__, ex) )
+            con._connected = False
+            raise ArakoonSockRecvError()
 
+        newChunkSize = len( newChunk )
+        if newChunkSize == 0 :
+            try:
+                con._socket.close()
+            except Exception, ex:
+                ArakoonClientLogger.logError( "Error while closing socket. %s: %s" % (ex.__class__.__name__,ex))
+            con._connected = False
+            raise ArakoonSockReadNoBytes ()
+        tmpResult = tmpResult + newChunk
+        bytesRemaining = bytesRemaining - newChunkSize
+
+    if con._metrics is not None:
+        con._metrics.bytesReceived += n
+    con._received += n
     return tmpResult
 
 def _recvString ( con ):
@@ -530,6 +530,31 @@ class AtLeast(Consistency):
     def isDirty(self):
         return True
 
+    def getI(self):
+        return self._i
+
+def parseConsistency(token):
+    """
+    Inverse of str() on a consistency.
+
+    This allows passing the result of get_txid between processes as a session
+    token, e.g. to read your own writes from a slave in another service.
+
+    @type token: string
+    @param token: "Consistent", "NoGuarantee" or "AtLeast(<i>)"
+    @rtype: Consistency
+    """
+    if token == "Consistent":
+        return Consistent()
+    if token == "NoGuarantee":
+        return NoGuarantee()
+    if token.startswith("AtLeast(") and token.endswith(")"):
+        try:
+            return AtLeast(int(token[len("AtLeast("):-1]))
+        except ValueError:
+            pass
+    raise ArakoonBadInput("Not a consistency: %r" % token)
+
 class Update(object):
     pass
 class Set(Update):
@@ -861,6 +886,8 @@ class ArakoonProtocol :
 
         offset = 0
         encoded = _recvString( con )
+        # Only nursery clients need the routing, keep it out of the import
+        from NurseryRouting import RoutingInfo
         routing, offset = RoutingInfo.unpack(encoded, offset, _unpackBool, _unpackString)
         cfgCount, offset = _unpackInt(encoded, offset)
         resultCfgs = {}
@@ -884,14 +911,14 @@ class ArakoonProtocol :
         x= _readExactNBytes( con, 1)
         r = None
         if x == '\x00':
-            r = NoGuarantees()
+            r = NoGuarantee()
         elif x == '\x01':
             r =  Consistent()
         elif x == '\x02':
             i = _recvInt64(con)
             r =  AtLeast(i)
         else:
-            raise ArakoonException("%c does not denote a consistency")
+            raise ArakoonException("%r does not denote a consistency" % x)
         return r
 
 
@@ -0,0 +1,215 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Work queues on ordered keys.
+
+Jobs are kept under keys ordered by enqueue time. A consumer claims a batch
+of jobs in one sequence that asserts each job is still there, deletes it
+and records the claim with a deadline; a claim that isn't acknowledged
+before its deadline can be put back in the queue. Consumers pick their
+batch at a random offset within the head of the queue, so that concurrent
+consumers rarely go for the same jobs.
+"""
+
+import os
+import random
+import time
+
+from ArakoonExceptions import *
+from ArakoonProtocol import Sequence
+import ArakoonTuple
+
+QUEUE_PREFIX = "@@arakoon_queue/"
+
+class Job :
+    """
+    A claimed job.
+
+    @ivar id: identifies the job, and orders it in the queue
+    @ivar payload: the data given when the job was enqueued
+    @ivar deadline: the time by which the job should be acknowledged
+    """
+
+    def __init__(self, id, payload, deadline, claimValue):
+        self.id = id
+        self.payload = payload
+        self.deadline = deadline
+        self._claimValue = claimValue
+
+    def __str__(self):
+        return "Job(%r)" % (self.id,)
+
+    __repr__ = __str__
+
+class WorkQueue :
+
+    def __init__(self, client, name, visibilityTimeout = 60.0, prefix = QUEUE_PREFIX):
+        """
+        @type client: L{ArakoonClient}
+        @type name: string
+        @param name: The name of the queue
+        @type visibilityTimeout: float
+        @param visibilityTimeout: The time (in seconds) a consumer has to acknowledge a job it claimed
+        @type prefix: string
+        @param prefix: The keys of the queue start with prefix + name + '/'
+        """
+        self._client = client
+        self._visibilityTimeout = visibilityTimeout
+        base = "%s%s/" % (prefix, name)
+        self._ready = base + "r/"
+        self._claimed = base + "c/"
+        self._owner = os.urandom(8).encode('hex')
+
+    def _readyKey(self, id):
+        return ArakoonTuple.pack(id, self._ready)
+
+    def _claimKey(self, id):
+        return ArakoonTuple.pack(id, self._claimed)
+
+    def enqueue(self, payloads):
+        """
+        Add jobs to the end of the queue, in one sequence.
+
+        @type payloads: list of strings
+        @rtype: list
+        @return: the ids of the jobs
+        """
+        seq = Sequence()
+        now = int(time.time() * 1000000)
+        ids = []
+        for i, payload in enumerate(payloads):
+            id = (now, i, os.urandom(6).encode('hex'))
+            seq.addSet(self._readyKey(id), payload)
+            ids.append(id)
+        if ids:
+            self._client.sequence(seq)
+        return ids
+
+    def claim(self, n = 1, window = None, maxAttempts = 10, timeout = None):
+        """
+        Take up to n jobs from the head of the queue.
+
+        @type n: int
+        @param n: The maximum number of jobs to claim
+        @type window: int
+        @param window: The number of jobs at the head of the queue to choose from, 4 * n by default
+        @type maxAttempts: int
+        @param maxAttempts: The number of times to try again when other consumers claim the same jobs
+        @type timeout: float
+        @param timeout: The time (in seconds) all attempts and sleeps together may take
+        @rtype: list of L{Job}
+        @return: the claimed jobs, empty if the queue is empty
+        @raise ArakoonAssertionFailed: every attempt collided with another consumer
+        @raise ArakoonTimeout: the timeout expired
+        """
+        if timeout is not None:
+            return self._client._callWithin(timeout, self._claim,
+                                            (n, window, maxAttempts), {})
+        return self._claim(self._client, n, window, maxAttempts)
+
+    def _claim(self, client, n, window, maxAttempts):
+        if window is None:
+            window = 4 * n
+        window = max(window, n)
+        begin, bi, end, ei = ArakoonTuple.prefixRange((), self._ready)
+        attempt = 0
+        while True:
+            head = client.range_entries(begin, bi, end, ei, window)
+            if not head:
+                return []
+            offset = random.randint(0, max(0, len(head) - n))
+            chosen = head[offset:offset + n]
+            deadline = time.time() + self._visibilityTimeout
+            seq = Sequence()
+            jobs = []
+            for key, payload in chosen:
+                id = ArakoonTuple.unpack(key, self._ready)
+                claimValue = ArakoonTuple.pack((deadline, self._owner, payload))
+                seq.addAssert(key, payload)
+                seq.addDelete(key)
+                seq.addSet(self._claimKey(id), claimValue)
+                jobs.append(Job(id, payload, deadline, claimValue))
+            try:
+                client.sequence(seq)
+                return jobs
+            except ArakoonAssertionFailed:
+                attempt += 1
+                if attempt >= maxAttempts:
+                    raise
+            period = random.uniform(0, 0.001 * 2 ** min(attempt, 7))
+            client._sleep(min(period, client._remaining()))
+
+    def ack(self, jobs):
+        """
+        Remove claimed jobs for good, in one sequence.
+
+        @type jobs: list of L{Job}
+        @raise ArakoonAssertionFailed: one of the claims expired and was taken over
+        """
+        seq = Sequence()
+        for job in jobs:
+            key = self._claimKey(job.id)
+            seq.addAssert(key, job._claimValue)
+            seq.addDelete(key)
+        if jobs:
+            self._client.sequence(seq)
+
+    def release(self, jobs):
+        """
+        Put claimed jobs back in the queue, at their original place.
+
+        @type jobs: list of L{Job}
+        @raise ArakoonAssertionFailed: one of the claims expired and was taken over
+        """
+        seq = Sequence()
+        for job in jobs:
+            self._unclaim(seq, self._claimKey(job.id), job.id, job._claimValue, job.payload)
+        if jobs:
+            self._client.sequence(seq)
+
+    def _unclaim(self, seq, key, id, claimValue, payload):
+        seq.addAssert(key, claimValue)
+        seq.addDelete(key)
+        seq.addSet(self._readyKey(id), payload)
+
+    def requeueExpired(self, maxElements = 1000):
+        """
+        Put jobs whose claim passed its deadline back in the queue.
+
+        Deadlines are compared with the clock of this client.
+
+        @type maxElements: int
+        @param maxElements: The maximum number of claims to look at
+        @rtype: int
+        @return: the number of jobs put back
+        @raise ArakoonAssertionFailed: one of the claims was acknowledged meanwhile
+        """
+        begin, bi, end, ei = ArakoonTuple.prefixRange((), self._claimed)
+        now = time.time()
+        seq = Sequence()
+        count = 0
+        for key, claimValue in self._client.range_entries(begin, bi, end, ei, maxElements):
+            deadline, owner, payload = ArakoonTuple.unpack(claimValue)
+            if deadline < now:
+                id = ArakoonTuple.unpack(key, self._claimed)
+                self._unclaim(seq, key, id, claimValue, payload)
+                count += 1
+        if count:
+            self._client.sequence(seq)
+        return count
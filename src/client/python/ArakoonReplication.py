@@ -0,0 +1,91 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Bookkeeping of how far each node has applied the transaction log, so that
+AtLeast(i) reads can be sent to nodes that are able to serve them.
+"""
+
+import time
+import threading
+
+class ReplicationTracker :
+
+    def __init__(self, behindPeriod = 1.0):
+        """
+        @type behindPeriod: float
+        @param behindPeriod: How long (in seconds) a node that refused a read is avoided for that i
+        """
+        self._behindPeriod = behindPeriod
+        self._lock = threading.Lock()
+        self._applied = {}
+        self._behind = {}
+
+    def noteApplied(self, nodeId, i):
+        """
+        Register that nodeId has applied (at least) transaction i.
+        """
+        with self._lock:
+            if i > self._applied.get(nodeId, -1):
+                self._applied[nodeId] = i
+            behind = self._behind.get(nodeId)
+            if behind is not None and i >= behind[0]:
+                del self._behind[nodeId]
+
+    def noteBehind(self, nodeId, i):
+        """
+        Register that nodeId could not serve a read for AtLeast(i).
+        """
+        with self._lock:
+            self._behind[nodeId] = (i, time.time())
+
+    def getApplied(self, nodeId):
+        """
+        @rtype: int
+        @return: the highest i nodeId is known to have applied, or None
+        """
+        return self._applied.get(nodeId)
+
+    def caughtUp(self, i, nodeIds):
+        """
+        @rtype: list of string
+        @return: the nodes among nodeIds known to have applied i
+        """
+        applied = self._applied
+        return [n for n in nodeIds if applied.get(n, -1) >= i]
+
+    def isBehind(self, nodeId, i):
+        """
+        @rtype: bool
+        @return: True if nodeId recently refused a read for i or less
+        """
+        behind = self._behind.get(nodeId)
+        if behind is None:
+            return False
+        failedI, since = behind
+        if time.time() - since > self._behindPeriod:
+            return False
+        return i >= failedI
+
+    def statistics(self):
+        """
+        @rtype: dict
+        @return: the highest known applied i per node
+        """
+        with self._lock:
+            return dict(self._applied)
@@ -0,0 +1,110 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Retry policies, deciding how long the client sleeps between attempts, and
+the events reported when the client loses and finds back the master.
+"""
+
+import random
+
+class RetryPolicy :
+    """
+    Decides how long to sleep before the next attempt.
+
+    This class is abstract: subclasses implement L{delay}. See
+    L{LinearBackoff}, L{ExponentialBackoff} and L{DecorrelatedJitter}.
+    """
+
+    def delay(self, attempt, previous):
+        """
+        @type attempt: int
+        @param attempt: number of attempts that failed so far, minus one
+        @type previous: float
+        @param previous: the delay returned for the previous attempt (0.0 at first)
+        @rtype: float
+        @return: the time to sleep, in seconds
+        """
+        raise NotImplementedError()
+
+class LinearBackoff(RetryPolicy):
+    """
+    Sleeps step * attempt: the historical behaviour of the client.
+    """
+
+    def __init__(self, step = 0.2):
+        self._step = step
+
+    def delay(self, attempt, previous):
+        return self._step * attempt
+
+class ExponentialBackoff(RetryPolicy):
+    """
+    Capped exponential backoff, with full jitter by default: the sleep is
+    drawn uniformly from [0, min(cap, base * 2^attempt)].
+    """
+
+    def __init__(self, base = 0.05, cap = 2.0, jitter = True):
+        self._base = base
+        self._cap = cap
+        self._jitter = jitter
+
+    def delay(self, attempt, previous):
+        ceiling = min(self._cap, self._base * (2 ** min(attempt, 32)))
+        if self._jitter:
+            return random.uniform(0, ceiling)
+        return ceiling
+
+class DecorrelatedJitter(RetryPolicy):
+    """
+    Decorrelated jitter: the sleep is drawn uniformly from
+    [base, 3 * previous sleep], capped. Clients retrying at the same moment
+    quickly spread out, while the expected sleep still grows.
+    """
+
+    def __init__(self, base = 0.05, cap = 2.0):
+        self._base = base
+        self._cap = cap
+
+    def delay(self, attempt, previous):
+        upper = max(self._base, previous * 3)
+        return min(self._cap, random.uniform(self._base, upper))
+
+class FailoverEvent :
+    """
+    Describes an interruption of contact with the master.
+
+    @ivar oldMaster: the master the client lost contact with
+    @ivar newMaster: the master found afterwards (can be the same node)
+    @ivar cause: description of the error that started the failover
+    @ivar started: time.time() at which the master was lost
+    @ivar duration: seconds until a master was found again
+    """
+
+    def __init__(self, oldMaster, started, cause):
+        self.oldMaster = oldMaster
+        self.newMaster = None
+        self.cause = cause
+        self.started = started
+        self.duration = None
+
+    def __str__(self):
+        return "FailoverEvent(%s -> %s in %.3fs: %s)" % \
+            (self.oldMaster, self.newMaster, self.duration or 0.0, self.cause)
+
+    __repr__ = __str__
@@ -0,0 +1,370 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Client side sharding over independent clusters.
+
+Unlike the nursery, there is no keeper cluster: every client spreads the
+keys over the clusters by consistent hashing of the keys, so all clients
+must be given the same clusters. Operations on one key go to a single
+cluster; operations on several keys are split per cluster and sent to all
+of them at once. Only the part of a sequence on one cluster is atomic.
+"""
+
+from Arakoon import ArakoonClient
+from ArakoonClientConnection import ArakoonClientConnection
+from ArakoonExceptions import *
+from ArakoonHashing import HashRing
+from ArakoonMultiplexer import Multiplexer
+from ArakoonProtocol import ArakoonProtocol, ArakoonClientConfig, Sequence
+
+# Keys starting with this prefix mark, on the cluster a key was moved to,
+# that it was moved; they are removed when the rebalance is done
+MOVED_PREFIX = "@@arakoon_shard_moved/"
+
+# Errors of a request that was not applied, so it can be sent again
+_NOT_APPLIED = (ArakoonNoMaster, ArakoonNodeNotMaster, ArakoonNotConnected,
+                ArakoonNodeUnavailable)
+
+def _flatten(seq, updates):
+    for update in seq._updates:
+        if isinstance(update, Sequence):
+            _flatten(update, updates)
+        else:
+            updates.append(update)
+    return updates
+
+class ShardedClient :
+    """
+    Example::
+
+        client = ShardedClient([cfg0, cfg1, cfg2])
+        client.set('key', 'value')
+
+        client.addShard(cfg3)
+        client.rebalance()
+    """
+
+    def __init__(self, configs, vnodes = 160):
+        """
+        @type configs: list of L{ArakoonClientConfig}
+        @param configs: One per cluster; the cluster ids must differ
+        @type vnodes: int
+        @param vnodes: The number of points per cluster on the hash ring, see L{HashRing}
+        """
+        self._vnodes = vnodes
+        self._clients = {}
+        for config in configs:
+            self._addClient(config)
+        self._ring = HashRing(self._clients.keys(), vnodes)
+        # The ring before the last addShard, until rebalance is done
+        self._previous = None
+
+    def _addClient(self, config):
+        clusterId = config.getClusterId()
+        if clusterId in self._clients:
+            raise ArakoonInvalidConfig("Cluster %s given twice" % clusterId)
+        self._clients[clusterId] = ArakoonClient(config)
+
+    def getClients(self):
+        """
+        The client of every cluster, e.g. to configure them.
+
+        @rtype: dict
+        @return: cluster id -> L{ArakoonClient}
+        """
+        return dict(self._clients)
+
+    def getShard(self, key):
+        """
+        @rtype: string
+        @return: the id of the cluster key belongs to
+        """
+        return self._ring.lookup(key)
+
+    def _client(self, key):
+        return self._clients[self._ring.lookup(key)]
+
+    def _source(self, key):
+        # The cluster key is still on while rebalancing, or None
+        previous = self._previous
+        if previous is None:
+            return None
+        source = previous.lookup(key)
+        if source == self._ring.lookup(key):
+            return None
+        return source
+
+    def get(self, key):
+        """
+        @rtype: string
+        @raise ArakoonNotFound: key has no value
+        """
+        try:
+            return self._client(key).get(key)
+        except ArakoonNotFound:
+            source = self._source(key)
+            if source is None:
+                raise
+            return self._clients[source].get(key)
+
+    def exists(self, key):
+        if self._client(key).exists(key):
+            return True
+        source = self._source(key)
+        return source is not None and self._clients[source].exists(key)
+
+    def set(self, key, value):
+        self._settle(key)
+        self._client(key).set(key, value)
+
+    def delete(self, key):
+        """
+        @raise ArakoonNotFound: key has no value
+        """
+        self._settle(key)
+        self._client(key).delete(key)
+
+    def testAndSet(self, key, oldValue, newValue):
+        """
+        See L{ArakoonClient.testAndSet}.
+        """
+        self._settle(key)
+        return self._client(key).testAndSet(key, oldValue, newValue)
+
+    def multiGet(self, keys):
+        """
+        @rtype: list of strings
+        @raise ArakoonNotFound: one of the keys has no value
+        """
+        values = self.multiGetOption(keys)
+        for key, value in zip(keys, values):
+            if value is None:
+                raise ArakoonNotFound(key)
+        return values
+
+    def multiGetOption(self, keys):
+        """
+        Read the keys of every cluster with one multiGetOption, sent to all
+        clusters at once.
+
+        @rtype: list of string options
+        """
+        values = [None] * len(keys)
+        self._fanOut(keys, range(len(keys)), self._ring.lookup, values)
+        previous = self._previous
+        if previous is not None:
+            # Keys that were not moved yet
+            missing = [i for i in range(len(keys))
+                       if values[i] is None and self._source(keys[i]) is not None]
+            if missing:
+                self._fanOut(keys, missing, previous.lookup, values)
+        return values
+
+    def _fanOut(self, keys, indexes, lookup, values):
+        groups = {}
+        for i in indexes:
+            groups.setdefault(lookup(keys[i]), []).append(i)
+        if len(groups) == 1:
+            shard, group = groups.items()[0]
+            found = self._clients[shard].multiGetOption([keys[i] for i in group])
+            for i, value in zip(group, found):
+                values[i] = value
+            return
+        failed = []
+        mux = Multiplexer()
+        try:
+            for shard, group in groups.items():
+                client = self._clients[shard]
+                msg = ArakoonProtocol.encodeMultiGetOption([keys[i] for i in group],
+                                                           client._consistency)
+                mux.submit(client, msg, ArakoonClientConnection.decodeStringOptionArrayResult,
+                           tag = shard)
+            for reply in mux.waitAll(ArakoonClientConfig.getConnectionTimeout()):
+                if reply.getError() is not None:
+                    failed.append(reply.tag)
+                    continue
+                found = reply.result()
+                codec = reply.client._codec
+                if codec is not None:
+                    found = codec.decodeList(found)
+                for i, value in zip(groups[reply.tag], found):
+                    values[i] = value
+        finally:
+            mux.close()
+        # The multiplexer doesn't retry, the clients do
+        for shard in failed:
+            group = groups[shard]
+            found = self._clients[shard].multiGetOption([keys[i] for i in group])
+            for i, value in zip(group, found):
+                values[i] = value
+
+    def makeSequence(self):
+        return Sequence()
+
+    def sequence(self, seq, sync = False):
+        """
+        Split the updates of seq per cluster, and apply the part of every
+        cluster as one sequence, all at once.
+
+        The part on one cluster is all-or-nothing, but one part can succeed
+        while another fails: an assert only guards the updates on its own
+        cluster.
+
+        @type seq: L{Sequence}
+        @raise ArakoonException: the error of one of the parts that failed
+        """
+        parts = {}
+        for update in _flatten(seq, []):
+            key = getattr(update, '_key', None)
+            if key is None:
+                raise ArakoonBadInput("%s can't be sharded" % update.__class__.__name__)
+            self._settle(key)
+            part = parts.get(self._ring.lookup(key))
+            if part is None:
+                part = Sequence()
+                parts[self._ring.lookup(key)] = part
+            part.addUpdate(update)
+        if len(parts) <= 1:
+            for shard, part in parts.items():
+                self._clients[shard].sequence(part, sync)
+            return
+        sequential = []
+        retry = []
+        errors = []
+        mux = Multiplexer()
+        try:
+            for shard, part in parts.items():
+                client = self._clients[shard]
+                if client._writeMarkerPrefix is not None:
+                    # Idempotent writes need the retries of the client
+                    sequential.append(shard)
+                    continue
+                if client._codec is not None:
+                    part = client._codec.encodeSequence(part)
+                mux.submit(client, ArakoonProtocol.encodeSequence(part, sync),
+                           ArakoonClientConnection.decodeVoidResult, tag = shard)
+            for reply in mux.waitAll(ArakoonClientConfig.getConnectionTimeout()):
+                error = reply.getError()
+                if isinstance(error, _NOT_APPLIED):
+                    retry.append(reply.tag)
+                elif error is not None:
+                    errors.append(error)
+        finally:
+            mux.close()
+        for shard in sequential + retry:
+            try:
+                self._clients[shard].sequence(parts[shard], sync)
+            except ArakoonException, ex:
+                errors.append(ex)
+        if errors:
+            raise errors[0]
+
+    def addShard(self, config):
+        """
+        Add a cluster. The keys that now belong to it stay where they are
+        until L{rebalance} moves them; meanwhile reads look for them on both
+        clusters, and a write moves the key it writes first.
+
+        The previous ring is kept by this object only: ShardedClients of
+        other processes (or other ShardedClients in this one) keep using the
+        old ring until they call addShard themselves, so add the cluster to
+        all of them before writing through any of them, and rebalance once
+        they all have.
+
+        @type config: L{ArakoonClientConfig}
+        """
+        if self._previous is not None:
+            raise ArakoonException("Rebalance before adding another cluster")
+        self._addClient(config)
+        self._previous = self._ring
+        self._ring = HashRing(self._clients.keys(), self._vnodes)
+
+    def rebalance(self, batchSize = 100):
+        """
+        Move the keys that belong to another cluster since L{addShard}.
+
+        Each key is moved with two sequences: a set on its new cluster,
+        together with a marker that it was moved, unless it was moved or
+        written there before; and an asserted delete on the old one. The
+        marker keeps a key that was moved and deleted meanwhile from being
+        moved again. Can be run again after a failure; the markers are
+        removed once all keys are moved.
+
+        @type batchSize: int
+        @param batchSize: The number of keys read at once
+        @rtype: int
+        @return: the number of keys moved
+        """
+        previous = self._previous
+        if previous is None:
+            return 0
+        moved = 0
+        for shard in previous.members():
+            client = self._clients[shard]
+            begin = None
+            included = True
+            while True:
+                entries = client.range_entries(begin, included, None, True, batchSize)
+                if not entries:
+                    break
+                for key, value in entries:
+                    if self._ring.lookup(key) != shard and \
+                       not key.startswith(MOVED_PREFIX):
+                        self._move(key, shard, value)
+                        moved += 1
+                begin = entries[-1][0]
+                included = False
+        self._previous = None
+        for client in self._clients.values():
+            client.deletePrefix(MOVED_PREFIX)
+        return moved
+
+    def _settle(self, key):
+        # While rebalancing, a key is moved before it is written
+        source = self._source(key)
+        if source is None:
+            return
+        value = self._clients[source].multiGetOption([key])[0]
+        if value is not None:
+            self._move(key, source, value)
+
+    def _move(self, key, source, value):
+        marker = MOVED_PREFIX + key
+        seq = Sequence()
+        seq.addAssert(key, None)
+        seq.addAssert(marker, None)
+        seq.addSet(key, value)
+        seq.addSet(marker, "")
+        try:
+            self._client(key).sequence(seq)
+        except ArakoonAssertionFailed:
+            # Moved already, and maybe written or deleted since: value is
+            # outdated
+            pass
+        seq = Sequence()
+        seq.addAssert(key, value)
+        seq.addDelete(key)
+        try:
+            self._clients[source].sequence(seq)
+        except ArakoonAssertionFailed:
+            pass
+
+    def dropConnections(self):
+        for client in self._clients.values():
+            client.dropConnections()
@@ -0,0 +1,117 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Single-flight reads: a read that is identical to one already in flight
+waits for that one, and shares its result or error, instead of sending a
+request of its own. A timeout of the read in flight is not shared: it is
+about the deadline of its caller, so the waiters send a request of their
+own then.
+"""
+
+import os
+import threading
+import time
+
+from ArakoonExceptions import ArakoonTimeout
+
+class _Call :
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight :
+    """
+    A group of reads that can share requests. Clients of the same cluster
+    (e.g. the clients of a pool) can share a group.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._pid = os.getpid()
+        self._reads = 0
+        self._shared = 0
+
+    def do(self, key, deadline, f, *args):
+        """
+        Call f(*args), unless a call with the same key is in flight: then
+        wait for that one to finish.
+
+        @param key: Identifies the read, e.g. the request
+        @type deadline: float
+        @param deadline: The time (as in time.time()) after which waiting gives up, or None
+        @return: the result of the call
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Calls in flight in the parent never finish here
+                self._calls = {}
+                self._pid = os.getpid()
+            self._reads += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self._shared += 1
+
+        if not leader:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.0, deadline - time.time())
+            if not call.done.wait(timeout):
+                raise ArakoonTimeout("Shared read did not complete in time")
+            if isinstance(call.error, ArakoonTimeout):
+                return f(*args)
+            if call.error is not None:
+                raise call.error
+            if isinstance(call.result, list):
+                # Callers may modify their result
+                return list(call.result)
+            return call.result
+
+        try:
+            call.result = f(*args)
+        except Exception, ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def statistics(self):
+        """
+        @rtype: dict
+        @return: the number of reads, and how many of them shared a request
+        """
+        with self._lock:
+            reads = self._reads
+            shared = self._shared
+        ratio = 0.0
+        if reads:
+            ratio = float(shared) / reads
+        return {'reads' : reads,
+                'shared' : shared,
+                'shared_ratio' : ratio}
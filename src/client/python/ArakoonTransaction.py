@@ -0,0 +1,183 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Optimistic transactions: reads are recorded, writes are buffered, and the
+commit is a single sequence that asserts every value read to be unchanged
+before applying the writes. A transaction that lost a race fails on one of
+those asserts, and is run again.
+"""
+
+from ArakoonExceptions import *
+from ArakoonProtocol import Sequence
+from ArakoonRetry import DecorrelatedJitter
+
+class Transaction :
+    """
+    Example::
+
+        def transfer(tx):
+            a = int(tx.get('account/a'))
+            b = int(tx.get('account/b'))
+            tx.set('account/a', str(a - 10))
+            tx.set('account/b', str(b + 10))
+
+        client.runTransaction(transfer)
+
+    A transaction is not thread safe, and is used for a single commit.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._reads = {}
+        self._writes = {}
+        self._done = False
+
+    def _check(self):
+        if self._done:
+            raise ArakoonException("Transaction already committed")
+
+    def _read(self, keys):
+        missing = [k for k in keys if k not in self._writes and k not in self._reads]
+        if missing:
+            # Deduplicated, as the sequence asserts each key once
+            missing = list(set(missing))
+            values = self._client.multiGetOption(missing)
+            self._reads.update(zip(missing, values))
+        result = []
+        for k in keys:
+            if k in self._writes:
+                result.append(self._writes[k])
+            else:
+                result.append(self._reads[k])
+        return result
+
+    def get(self, key):
+        """
+        @rtype: string
+        @return: the value of key, as seen by the transaction
+        @raise ArakoonNotFound: key has no value
+        """
+        self._check()
+        value = self._read([key])[0]
+        if value is None:
+            raise ArakoonNotFound(key)
+        return value
+
+    def getOption(self, key):
+        """
+        @rtype: string option
+        @return: the value of key, or None if it has none
+        """
+        self._check()
+        return self._read([key])[0]
+
+    def multiGetOption(self, keys):
+        """
+        Read the keys the transaction didn't see yet with one request.
+
+        @rtype: list of string option
+        """
+        self._check()
+        return self._read(keys)
+
+    def exists(self, key):
+        self._check()
+        return self._read([key])[0] is not None
+
+    def set(self, key, value):
+        self._check()
+        self._writes[key] = value
+
+    def delete(self, key):
+        """
+        @raise ArakoonNotFound: key has no value
+        """
+        self._check()
+        if key in self._writes:
+            # Written by the transaction: the stored value doesn't matter
+            if self._writes[key] is None:
+                raise ArakoonNotFound(key)
+        elif self._read([key])[0] is None:
+            raise ArakoonNotFound(key)
+        self._writes[key] = None
+
+    def commit(self):
+        """
+        Apply the writes, provided that none of the values read changed.
+
+        A transaction without writes only checks its reads, by reading them
+        again in a single request.
+
+        @raise ArakoonAssertionFailed: a value read by the transaction changed
+        """
+        self._check()
+        self._done = True
+        if not self._writes:
+            self._validate()
+            return
+        seq = Sequence()
+        for key, value in self._reads.items():
+            seq.addAssert(key, value)
+        for key, value in self._writes.items():
+            if value is None:
+                if key not in self._reads:
+                    # Set, then deleted without being read: the set lets the
+                    # delete succeed whatever is stored
+                    seq.addSet(key, "")
+                    seq.addDelete(key)
+                elif self._reads[key] is not None:
+                    seq.addDelete(key)
+            else:
+                seq.addSet(key, value)
+        self._client.sequence(seq)
+
+    def _validate(self):
+        if not self._reads:
+            return
+        keys = self._reads.keys()
+        values = self._client.multiGetOption(keys)
+        for key, value in zip(keys, values):
+            if value != self._reads[key]:
+                raise ArakoonAssertionFailed(key)
+
+def runTransaction(client, f, maxAttempts = 10, policy = None):
+    """
+    Call f with a fresh L{Transaction} and commit it, until the commit
+    succeeds or maxAttempts commits failed on a changed value.
+
+    @rtype: object
+    @return: what f returned for the transaction that committed
+    @raise ArakoonAssertionFailed: the last commit failed
+    """
+    if policy is None:
+        policy = DecorrelatedJitter(base = 0.005, cap = 0.5)
+    attempt = 0
+    delay = 0.0
+    while True:
+        tx = Transaction(client)
+        result = f(tx)
+        try:
+            tx.commit()
+            return result
+        except ArakoonAssertionFailed:
+            attempt += 1
+            if attempt >= maxAttempts:
+                raise
+        delay = policy.delay(attempt - 1, delay)
+        client._sleep(min(delay, client._remaining()))
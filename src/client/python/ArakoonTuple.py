@@ -0,0 +1,212 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+"""
+Order preserving encoding of tuples as keys: the byte order of packed
+tuples is the order of the tuples themselves, so that the keys of a tuple
+prefix, or of a range of tuples, are a range of keys.
+
+Elements can be None, str (bytes), unicode, int, long, float, bool and
+nested tuples. Elements of different types sort by type, in that order.
+The format is that of the FoundationDB tuple layer.
+
+Example, events keyed by (user, timestamp, id)::
+
+    client.set(ArakoonTuple.pack((user, ts, eventId)), event)
+    begin, bi, end, ei = ArakoonTuple.betweenRange((user,), t1, t2)
+    events = client.range_entries(begin, bi, end, ei, -1)
+"""
+
+import struct
+
+_NULL = 0x00
+_BYTES = 0x01
+_STRING = 0x02
+_NESTED = 0x05
+_NEG_INT_START = 0x0b
+_INT_ZERO = 0x14
+_POS_INT_END = 0x1d
+_DOUBLE = 0x21
+_FALSE = 0x26
+_TRUE = 0x27
+
+def _bigEndian(value, size):
+    return ('%0*x' % (2 * size, value)).decode('hex')
+
+def _escape(s):
+    return s.replace('\x00', '\x00\xff') + '\x00'
+
+def _encode(value, nested):
+    if value is None:
+        if nested:
+            return '\x00\xff'
+        return '\x00'
+    if value is True:
+        return chr(_TRUE)
+    if value is False:
+        return chr(_FALSE)
+    if isinstance(value, str):
+        return chr(_BYTES) + _escape(value)
+    if isinstance(value, unicode):
+        return chr(_STRING) + _escape(value.encode('utf-8'))
+    if isinstance(value, (int, long)):
+        if value == 0:
+            return chr(_INT_ZERO)
+        size = (abs(value).bit_length() + 7) // 8
+        if value > 0:
+            if size <= 8:
+                return chr(_INT_ZERO + size) + _bigEndian(value, size)
+            if size > 255:
+                raise ValueError("Integer too large to pack: %d bytes" % size)
+            return chr(_POS_INT_END) + chr(size) + _bigEndian(value, size)
+        # Negative integers are stored in ones' complement
+        complement = value + (1 << (8 * size)) - 1
+        if size <= 8:
+            return chr(_INT_ZERO - size) + _bigEndian(complement, size)
+        if size > 255:
+            raise ValueError("Integer too large to pack: %d bytes" % size)
+        return chr(_NEG_INT_START) + chr(size ^ 0xff) + _bigEndian(complement, size)
+    if isinstance(value, float):
+        b = struct.pack('>d', value)
+        if ord(b[0]) & 0x80:
+            b = ''.join(chr(ord(c) ^ 0xff) for c in b)
+        else:
+            b = chr(ord(b[0]) ^ 0x80) + b[1:]
+        return chr(_DOUBLE) + b
+    if isinstance(value, tuple):
+        return chr(_NESTED) + ''.join(_encode(v, True) for v in value) + '\x00'
+    raise ValueError("Can't pack %r of type %s" % (value, type(value).__name__))
+
+def _endOfString(s, pos):
+    while True:
+        pos = s.find('\x00', pos)
+        if pos == -1:
+            raise ValueError("Unterminated string in packed tuple")
+        if s[pos + 1:pos + 2] != '\xff':
+            return pos
+        pos += 2
+
+def _decodeInt(s, pos, size, negative):
+    b = s[pos:pos + size]
+    if len(b) != size:
+        raise ValueError("Truncated integer in packed tuple")
+    value = int(b.encode('hex'), 16)
+    if negative:
+        value = value - (1 << (8 * size)) + 1
+    return value, pos + size
+
+def _decode(s, pos):
+    code = ord(s[pos])
+    pos += 1
+    if code == _NULL:
+        return None, pos
+    if code == _BYTES or code == _STRING:
+        end = _endOfString(s, pos)
+        raw = s[pos:end].replace('\x00\xff', '\x00')
+        if code == _STRING:
+            raw = raw.decode('utf-8')
+        return raw, end + 1
+    if code == _NESTED:
+        values = []
+        while True:
+            if pos >= len(s):
+                raise ValueError("Unterminated nested tuple in packed tuple")
+            if s[pos] == '\x00':
+                if s[pos + 1:pos + 2] != '\xff':
+                    return tuple(values), pos + 1
+                values.append(None)
+                pos += 2
+            else:
+                value, pos = _decode(s, pos)
+                values.append(value)
+    if _NEG_INT_START < code < _POS_INT_END:
+        size = code - _INT_ZERO
+        if size == 0:
+            return 0, pos
+        return _decodeInt(s, pos, abs(size), size < 0)
+    if code == _POS_INT_END:
+        return _decodeInt(s, pos + 1, ord(s[pos]), False)
+    if code == _NEG_INT_START:
+        return _decodeInt(s, pos + 1, ord(s[pos]) ^ 0xff, True)
+    if code == _DOUBLE:
+        b = s[pos:pos + 8]
+        if len(b) != 8:
+            raise ValueError("Truncated float in packed tuple")
+        if ord(b[0]) & 0x80:
+            b = chr(ord(b[0]) ^ 0x80) + b[1:]
+        else:
+            b = ''.join(chr(ord(c) ^ 0xff) for c in b)
+        return struct.unpack('>d', b)[0], pos + 8
+    if code == _FALSE:
+        return False, pos
+    if code == _TRUE:
+        return True, pos
+    raise ValueError("Unknown type code 0x%02x in packed tuple" % code)
+
+def pack(t, prefix = ''):
+    """
+    @type t: tuple
+    @type prefix: string
+    @param prefix: Raw bytes put in front of the packed tuple, e.g. to keep apart the keys of an application
+    @rtype: string
+    @return: the key for t
+    """
+    return prefix + ''.join(_encode(v, False) for v in t)
+
+def unpack(key, prefix = ''):
+    """
+    @type key: string
+    @param key: A key made by L{pack}
+    @type prefix: string
+    @param prefix: The prefix given to L{pack}
+    @rtype: tuple
+    @raise ValueError: key is not a packed tuple
+    """
+    if not key.startswith(prefix):
+        raise ValueError("Key %r doesn't start with %r" % (key, prefix))
+    values = []
+    pos = len(prefix)
+    try:
+        while pos < len(key):
+            value, pos = _decode(key, pos)
+            values.append(value)
+    except IndexError:
+        raise ValueError("Truncated packed tuple %r" % key)
+    return tuple(values)
+
+def prefixRange(t, prefix = ''):
+    """
+    Bounds for a range query returning the keys of all tuples that start
+    with t and have more elements.
+
+    @rtype: tuple
+    @return: (beginKey, beginKeyIncluded, endKey, endKeyIncluded), as taken by range and range_entries
+    """
+    p = pack(t, prefix)
+    return p + '\x00', True, p + '\xff', False
+
+def betweenRange(t, start, stop, prefix = ''):
+    """
+    Bounds for a range query returning the keys of all tuples that start
+    with t, followed by an element in [start, stop[ (and possibly more
+    elements).
+
+    @rtype: tuple
+    @return: (beginKey, beginKeyIncluded, endKey, endKeyIncluded), as taken by range and range_entries
+    """
+    return pack(t + (start,), prefix), True, pack(t + (stop,), prefix), False
@@ -19,11 +19,30 @@ limitations under the License.
 
 from ArakoonExceptions import ArakoonInvalidArguments
 
+import __builtin__
 import ArakoonProtocol
 import logging
+import utils
 from functools import wraps
 
+# Expressions checking a single argument, per parameter type
+_CHECKS = {
+    'int' : 'isinstance(%s, int)',
+    'string' : 'isinstance(%s, str)',
+    'bool' : 'isinstance(%s, bool)',
+    'string_option' : '(%s is None or isinstance(%s, str))',
+    'sequence' : 'isinstance(%s, _ArakoonProtocol.Sequence)',
+}
+
 class SignatureValidator :
+    """
+    Validates the types of the arguments of a method.
+
+    The check is compiled into a wrapper with the same parameters as the
+    method, so a call costs an isinstance per argument rather than
+    rebuilding and scanning the argument list.
+    """
+
     def __init__ (self, *args ):
         self.param_types = args
         self.param_native_type_mapping = {
@@ -31,49 +50,71 @@ class SignatureValidator :
             'string': str,
             'bool': bool
         }
+        for arg_type in args:
+            if not _CHECKS.has_key( arg_type ):
+                raise RuntimeError( "Invalid argument type supplied: %s" % arg_type )
 
     def __call__ (self, f ):
-        @wraps(f)
-        def my_new_f ( *args, **kwargs ) :
-            new_args = list( args[1:] )
-            missing_args = f.func_code.co_varnames[len(args):]
-            for missing_arg in missing_args:
-                if( len(new_args) == len(self.param_types) ) :
-            
-                    break
-                if( kwargs.has_key(missing_arg) ) :
-                    pos = f.func_code.co_varnames.index( missing_arg )
-#                    if pos > len(new_args):
-#                        new_args.append( None )
-            
-                    new_args.insert(pos, kwargs[missing_arg])
-                    del kwargs[missing_arg]
-            
-            if len( kwargs ) > 0:
-                raise ArakoonInvalidArguments( f.func_name, list(kwargs.iteritems()) )
-            
-            i = 0
-            error_key_values = []
-            for (arg, arg_type) in zip(new_args, self.param_types) :
-                if not self.validate(arg, arg_type):
-                    error_key_values.append( (f.func_code.co_varnames[i+1],new_args[i]) )
-                i += 1
-                
-            if len(error_key_values) > 0 :
-                raise ArakoonInvalidArguments( f.func_name, error_key_values )
-            
-            return f( args[0], *new_args )
-        
-        return my_new_f
+        code = f.func_code
+        names = code.co_varnames[:code.co_argcount]
+        defaults = f.func_defaults or ()
+        firstDefault = len(names) - len(defaults)
+        validated = names[1:len(self.param_types) + 1]
+
+        env = {
+            '_f' : f,
+            '_validator' : self,
+            '_ArakoonProtocol' : ArakoonProtocol,
+            '__builtins__' : __builtin__,
+        }
+        for (i, name) in enumerate(names):
+            if name in env or name == '_extra' or name.startswith('_default_'):
+                raise RuntimeError( "Cannot validate %s: argument '%s' clashes with the wrapper" % (f.func_name, name) )
+            if i >= firstDefault:
+                env['_default_%d' % i] = defaults[i - firstDefault]
+
+        checks = []
+        for (name, arg_type) in zip(validated, self.param_types):
+            check = _CHECKS[arg_type].replace('%s', name)
+            i = names.index(name)
+            if i >= firstDefault:
+                # Defaults are not validated
+                check = '(%s is _default_%d or %s)' % (name, i, check)
+            checks.append(check)
+
+        source = [ 'def _validated(%s, **_extra):' % ', '.join(names),
+                   '    if _extra:',
+                   '        _validator.invalidKeywords(_f, _extra)' ]
+        if checks:
+            source.extend([ '    if not (%s):' % ' and '.join(checks),
+                            '        _validator.invalidArguments(_f, (%s,))' % ', '.join(validated) ])
+        source.append( '    return _f(%s)' % ', '.join(names) )
+
+        validated_f = utils.make_function('\n'.join(source) + '\n', '<SignatureValidator>',
+                                          f.func_name, env, f.func_defaults)
+        return wraps(f)(validated_f)
+
+    def invalidKeywords(self, f, kwargs):
+        raise ArakoonInvalidArguments( f.func_name, list(kwargs.iteritems()) )
+
+    def invalidArguments(self, f, args):
+        error_key_values = []
+        defaults = f.func_defaults or ()
+        names = f.func_code.co_varnames[1:f.func_code.co_argcount]
+        firstDefault = len(names) - len(defaults)
+        for (i, (arg, arg_type)) in enumerate(zip(args, self.param_types)) :
+            if i >= firstDefault and arg is defaults[i - firstDefault]:
+                continue
+            if not self.validate(arg, arg_type):
+                error_key_values.append( (names[i], arg) )
+        raise ArakoonInvalidArguments( f.func_name, error_key_values )
 
     def validate(self,arg,arg_type):
         if self.param_native_type_mapping.has_key( arg_type ):
-            return isinstance(arg,self.param_native_type_mapping[arg_type] )     
+            return isinstance(arg,self.param_native_type_mapping[arg_type] )
         elif arg_type == 'string_option' :
             return isinstance( arg, str ) or arg is None
         elif arg_type == 'sequence' :
             return isinstance( arg, ArakoonProtocol.Sequence )
         else:
             raise RuntimeError( "Invalid argument type supplied: %s" % arg_type )
-        
-    
\ No newline at end of file
@@ -61,6 +61,8 @@ class NurseryClient:
     
     def _fetchNurseryConfig(self):
         (routing,cfgs) = self._keeperClient.getNurseryConfig()
+        # Compile once here, not on the first request
+        routing.compile()
         self._routing = routing
         logging.debug( "Nursery client has routing: %s" % str(routing))
         for (clusterId,client) in self._clusterClients.iteritems() :
@@ -113,6 +115,27 @@ class NurseryClient:
         client = self._getArakoonClient(key)
         return client.get(key)
     
+    @retryDuringMigration
+    def multiGet(self, keys):
+        """
+        Retrieve the values of a number of keys, with one multiGet per cluster.
+
+        @type keys: string list
+        @rtype: string list
+        @return: the values associated with the respective keys
+        """
+        groups = {}
+        for i, clusterId in enumerate(self._routing.getClusterIds(keys)):
+            groups.setdefault(clusterId, []).append(i)
+        values = [None] * len(keys)
+        for clusterId, indexes in groups.iteritems():
+            if not self._clusterClients.has_key( clusterId ):
+                raise NurseryInvalidConfig()
+            client = self._clusterClients[clusterId]
+            for i, value in zip(indexes, client.multiGet([keys[i] for i in indexes])):
+                values[i] = value
+        return values
+
     @retryDuringMigration
     def delete(self, key):
         """
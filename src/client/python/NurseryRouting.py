@@ -15,6 +15,7 @@ limitations under the License.
 """
 
 
+import bisect
 import logging
 
 class RoutingInfo:
@@ -33,6 +34,7 @@ class RoutingInfo:
         
     def __init__(self, rootNode):
         self.__root = rootNode
+        self.__compiled = None
     
     def __str__(self):
         return self.toString(0)
@@ -42,13 +44,68 @@ class RoutingInfo:
     
     def split(self, newBoundary, clusterId):
         self.__root = self.__root.split(newBoundary, clusterId)
+        self.__compiled = None
         
     def serialize(self, serBool, serString):
         return self.__root.serialize(serBool, serString)
     
+    def compile(self):
+        """
+        Flatten the tree into its boundaries, in order, and the clusters
+        between them: keys below boundaries[0] go to clusters[0], keys from
+        boundaries[i] up to the next boundary go to clusters[i + 1].
+
+        Lookups compile the tree the first time they need to; it is
+        compiled again only after a split.
+
+        @rtype: pair(list, list)
+        @return: the boundaries and the clusters
+        """
+        boundaries = []
+        clusters = []
+        # Iteratively: splits in key order grow the tree into one long chain
+        stack = [(False, self.__root)]
+        while stack:
+            isBoundary, item = stack.pop()
+            if isBoundary:
+                boundaries.append(item)
+            elif isinstance(item, InternalRoutingNode):
+                stack.append((False, item._right))
+                stack.append((True, item._boundary))
+                stack.append((False, item._left))
+            else:
+                clusters.append(item._clusterId)
+        self.__compiled = (boundaries, clusters)
+        return self.__compiled
+
     def getClusterId(self, key):
-        return self.__root.getClusterId(key)
-    
+        compiled = self.__compiled
+        if compiled is None:
+            compiled = self.compile()
+        boundaries, clusters = compiled
+        return clusters[bisect.bisect_right(boundaries, key)]
+
+    def getClusterIds(self, keys):
+        """
+        Route many keys at once, in a single pass over the sorted keys.
+
+        @type keys: list of strings
+        @rtype: list of strings
+        @return: the cluster of every key, in the order of keys
+        """
+        compiled = self.__compiled
+        if compiled is None:
+            compiled = self.compile()
+        boundaries, clusters = compiled
+        result = [None] * len(keys)
+        j = 0
+        for i in sorted(range(len(keys)), key = keys.__getitem__):
+            key = keys[i]
+            while j < len(boundaries) and key >= boundaries[j]:
+                j += 1
+            result[i] = clusters[j]
+        return result
+
     def contains(self, clusterId):
         return self.__root.contains(clusterId)
     
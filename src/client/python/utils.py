@@ -23,10 +23,8 @@ limitations under the License.
 #
 # .. _Pyrakoon: https://github.com/Incubaid/pyrakoon
 
-import __builtin__
-import uuid
+import types
 import functools
-import itertools
 
 def update_argspec(*argnames): #pylint: disable-msg=R0912
     '''Wrap a callable to use real argument names
@@ -42,9 +40,7 @@ def update_argspec(*argnames): #pylint: disable-msg=R0912
     arguments.
 
     The given argnames can be strings (for normal named arguments), or tuples
-    of a string and a value (for arguments with default values). Only a couple
-    of default value types are supported, an exception will be thrown when an
-    unsupported value type is given.
+    of a string and a value (for arguments with default values).
 
     Example usage::
 
@@ -103,61 +99,29 @@ def update_argspec(*argnames): #pylint: disable-msg=R0912
     :rtype: `callable`
     '''
 
-    argnames_ = tuple(itertools.chain(argnames, ('', )))
-
-    # Standard execution context, contains only what we actually need in the
-    # function template
-    context = {
-        '__builtins__': None,
-        'dict': __builtin__.dict,
-        'zip': __builtin__.zip,
-        'True': True,
-        'False': False,
-    }
-
-    # Template for the function which will be compiled later on
-    def _format(value):
-        '''Format a value for display in a function signature'''
-
-        if isinstance(value, unicode):
-            return 'u\'%s\'' % value
-        elif isinstance(value, str):
-            return '\'%s\'' % value
-        elif isinstance(value, bool):
-            return 'True' if value else 'False'
-        elif isinstance(value, (int, long)):
-            return '%d' % value
-        elif value is None:
-            return 'None'
-        else:
-            raise TypeError
-
-    def _generate_signature(args):
-        '''Format arguments for display in a function signature'''
-
-        for arg in args:
-            if isinstance(arg, str):
-                yield '%s' % arg
-            else:
-                arg, default = arg
-                yield '%s=%s' % (arg, _format(default))
-
-    template_signature = ', '.join(_generate_signature(argnames_))
-    template_args = ', '.join(name if isinstance(name, str) else name[0] \
-        for name in argnames_) if argnames_ else ''
-    template_argnames = ', '.join(
-        '\'%s\'' % (name if isinstance(name, str) else name[0])
-        for name in argnames_) if argnames_ else ''
-
-    fun_def_template = '''
-def %%(name)s(%(signature)s):
-    %%(kwargs_name)s = dict(zip((%(argnames)s), (%(args)s)))
-
-    return %%(orig_name)s(**%%(kwargs_name)s)
+    names = tuple(name if isinstance(name, str) else name[0] \
+        for name in argnames)
+    defaults = tuple(name[1] for name in argnames \
+        if not isinstance(name, str)) or None
+
+    # We need a name for the wrapped function in the function template which
+    # doesn't conflict with the arguments
+    orig_function_name = '_orig'
+    while orig_function_name in names:
+        orig_function_name = orig_function_name + '_'
+
+    # Template for the function which will be compiled later on. Defaults are
+    # filled in when the function is created, so wrappers of methods with the
+    # same argument names share one compiled template. The arguments are
+    # passed on as keywords directly: this wrapper is on the path of every
+    # client call.
+    fun_def = '''
+def _update_argspec(%(signature)s):
+    return %(orig_name)s(%(kwargs)s)
 ''' % {
-        'signature': template_signature,
-        'args': template_args,
-        'argnames': template_argnames,
+        'signature': ', '.join(names),
+        'kwargs': ', '.join('%s=%s' % (name, name) for name in names),
+        'orig_name': orig_function_name,
     }
 
     def wrapper(fun):
@@ -171,38 +135,15 @@ def %%(name)s(%(signature)s):
         :see: `update_argspec`
         '''
 
-        # We need unique names for the variables used in the function template,
-        # they shouldn't conflict with the arguments
-        random_suffix = lambda: str(uuid.uuid4()).replace('-', '')
-
-        orig_function_name = None
-        while (not orig_function_name) or (orig_function_name in argnames_):
-            orig_function_name = '_orig_%s' % random_suffix()
-
-        kwargs_name = None
-        while (not kwargs_name) or (kwargs_name in argnames_):
-            kwargs_name = '_kwargs_%s' % random_suffix()
-
-
-        # Fill in function template
-        fun_def = fun_def_template % {
-            'name': fun.__name__,
-            'orig_name': orig_function_name,
-            'kwargs_name': kwargs_name,
+        # Create evaluation context, containing only what we actually need in
+        # the function template
+        env = {
+            '__builtins__': None,
+            orig_function_name: fun,
         }
 
-        # Compile function to a code object
-        code = compile(fun_def, '<update_argspec>', 'exec', 0, 1)
-
-        # Create evaluation context
-        env = context.copy()
-        env[orig_function_name] = fun
-
-        # Evaluate the code object in the evaluation context
-        eval(code, env, env)
-
-        # Retrieve the compiled/evaluated function
-        fun_wrapper = env[fun.__name__]
+        fun_wrapper = make_function(fun_def, '<update_argspec>', fun.__name__,
+                                    env, defaults)
 
         # Update __*__ attributes
         updated = functools.update_wrapper(fun_wrapper, fun)
@@ -210,3 +151,43 @@ def %%(name)s(%(signature)s):
         return updated
 
     return wrapper
+
+# Code objects compiled by make_function, per source and file name
+_compiled = {}
+
+def make_function(source, filename, name, env, defaults = None):
+    '''Create a function from source text defining a single function
+
+    Compiling is the expensive part, so the code object is kept and reused
+    for the same source. The function gets the given name and defaults,
+    whatever name the source uses.
+
+    :param source: Source text with a single top-level function definition
+    :type source: `str`
+    :param filename: File name reported in tracebacks
+    :type filename: `str`
+    :param name: Name of the function
+    :type name: `str`
+    :param env: Globals of the function
+    :type env: `dict`
+    :param defaults: Default values of the last arguments
+    :type defaults: `tuple`
+
+    :return: The function
+    :rtype: `function`
+    '''
+
+    key = (source, filename)
+    code = _compiled.get(key)
+    if code is None:
+        module = compile(source, filename, 'exec', 0, 1)
+        code = [c for c in module.co_consts if isinstance(c, types.CodeType)][0]
+        _compiled[key] = code
+
+    # The name in the code object is the one shown in argument errors
+    code = types.CodeType(code.co_argcount, code.co_nlocals, code.co_stacksize,
+        code.co_flags, code.co_code, code.co_consts, code.co_names,
+        code.co_varnames, code.co_filename, name, code.co_firstlineno,
+        code.co_lnotab, code.co_freevars, code.co_cellvars)
+
+    return types.FunctionType(code, env, name, defaults)
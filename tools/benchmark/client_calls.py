@@ -0,0 +1,106 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Microbenchmark of the python client call path, in calls per second.
+
+'wrapper' measures the client-side cost of a call (argument handling,
+validation, retry and timeout wrappers, encoding) by answering reads
+without any I/O. 'standin' measures complete calls against a stand-in
+cluster (see standin_server.py) on the local host.
+
+usage: client_calls.py [wrapper|standin] [seconds]
+"""
+
+import os
+import sys
+import time
+import logging
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+
+def _importClient():
+    # pylabs/arakoon links to src/client/python
+    sys.path.insert(0, os.path.join(here, '..', '..', 'pylabs'))
+    from arakoon import Arakoon
+    return Arakoon
+
+def measure(name, f, seconds):
+    f()
+    count = 0
+    start = time.time()
+    end = start + seconds
+    while True:
+        for _ in xrange(100):
+            f()
+        count += 100
+        now = time.time()
+        if now >= end:
+            break
+    rate = count / (now - start)
+    print "%-30s %10.0f calls/s %8.2f us/call" % (name, rate, 1000000.0 / rate)
+    return rate
+
+def benchWrapper(Arakoon, seconds):
+    config = Arakoon.ArakoonClientConfig("bench", {"bench_0" : (["127.0.0.1"], 1)})
+
+    class NoIOClient(Arakoon.ArakoonClient):
+        def __read__(self, msg, decode):
+            return "value"
+
+    client = NoIOClient(config)
+    client.disableMetrics()
+    get = client.get
+    measure("get (no I/O)", lambda: get("key"), seconds)
+    measure("get with timeout (no I/O)", lambda: get("key", timeout = 10.0), seconds)
+    measure("exists (no I/O)", lambda: client.exists("key"), seconds)
+    measure("multiGet x10 (no I/O)", lambda: client.multiGet(["key"] * 10), seconds)
+
+def benchStandin(Arakoon, seconds):
+    import standin_server
+    cluster = standin_server.Cluster("standin", 3, 7180)
+    cluster.start()
+    try:
+        client = Arakoon.ArakoonClient(Arakoon.ArakoonClientConfig("standin", cluster.clientNodes()))
+        client.set("key", "value")
+        measure("get", lambda: client.get("key"), seconds)
+        measure("set", lambda: client.set("key", "value"), seconds)
+        client.disableMetrics()
+        measure("get (metrics disabled)", lambda: client.get("key"), seconds)
+        client.dropConnections()
+    finally:
+        cluster.stop()
+
+def main(argv):
+    logging.disable(logging.WARNING)
+    mode = 'wrapper'
+    seconds = 2.0
+    if len(argv) > 1:
+        mode = argv[1]
+    if len(argv) > 2:
+        seconds = float(argv[2])
+    Arakoon = _importClient()
+    if mode == 'wrapper':
+        benchWrapper(Arakoon, seconds)
+    elif mode == 'standin':
+        benchStandin(Arakoon, seconds)
+    else:
+        print __doc__
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,80 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Startup benchmark of the python client, as paid by CLI tools and short
+lived workers: time to import the client, to construct a client object and
+to complete the first get, each measured in a fresh interpreter against a
+stand-in cluster (see standin_server.py) on the local host.
+
+usage: client_startup.py [runs]
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+
+import standin_server
+
+# Runs in a fresh interpreter, prints the timings in milliseconds
+CHILD = '''
+import sys, time
+start = time.time()
+sys.path.insert(0, %(pylabs)r)
+from arakoon import Arakoon
+imported = time.time()
+client = Arakoon.ArakoonClient(Arakoon.ArakoonClientConfig("standin", %(nodes)r))
+constructed = time.time()
+client.get("key")
+done = time.time()
+print (imported - start) * 1000, (constructed - imported) * 1000, (done - constructed) * 1000
+'''
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+def main(argv):
+    runs = 20
+    if len(argv) > 1:
+        runs = int(argv[1])
+    cluster = standin_server.Cluster("standin", 3, 7280)
+    cluster.start()
+    try:
+        child = CHILD % {'pylabs' : os.path.join(here, '..', '..', 'pylabs'),
+                         'nodes' : cluster.clientNodes()}
+        # Warm up: compile the client modules to .pyc
+        subprocess.check_output([sys.executable, '-c', 'import sys; sys.path.insert(0, %r); from arakoon import Arakoon' % os.path.join(here, '..', '..', 'pylabs')])
+        cluster.store.data["key"] = "value"
+        samples = []
+        for _ in range(runs):
+            start = time.time()
+            output = subprocess.check_output([sys.executable, '-c', child])
+            total = (time.time() - start) * 1000
+            samples.append([float(x) for x in output.split()] + [total])
+    finally:
+        cluster.stop()
+
+    for (i, name) in enumerate(['import', 'construct', 'first get', 'process total']):
+        print "%-15s median %7.2f ms  min %7.2f ms" % \
+            (name, median([s[i] for s in samples]), min([s[i] for s in samples]))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,506 @@
+"""
+Copyright (2010-2014) INCUBAID BVBA
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+A stand-in for an Arakoon cluster, speaking enough of the client protocol
+to exercise and benchmark the python client without the server binary.
+
+All nodes share one in-memory store. Every node listens on its own port;
+one of them plays master. Per node, a reply delay and a replication lag
+can be configured to mimic stalled or lagging slaves.
+
+Not a test double for consensus: there is no tlog, no paxos and no
+persistence.
+"""
+
+import sys
+import time
+import struct
+import socket
+import threading
+import SocketServer
+
+MAGIC = 0xb1ff0000
+
+CMD_WHO               = 0x02
+CMD_EXISTS            = 0x07
+CMD_GET               = 0x08
+CMD_SET               = 0x09
+CMD_DEL               = 0x0a
+CMD_RAN               = 0x0b
+CMD_PRE               = 0x0c
+CMD_TAS               = 0x0d
+CMD_RAN_E             = 0x0f
+CMD_SEQ               = 0x10
+CMD_MULTI_GET         = 0x11
+CMD_EXPECT_PROGRESS   = 0x12
+CMD_ASSERT            = 0x16
+CMD_KEY_COUNT         = 0x1a
+CMD_CONFIRM           = 0x1c
+CMD_REV_RAN_E         = 0x23
+CMD_SYNCED_SEQ        = 0x24
+CMD_DELETE_PREFIX     = 0x27
+CMD_VERSION           = 0x28
+CMD_ASSERT_EXISTS     = 0x29
+CMD_MULTI_GET_OPTION  = 0x31
+CMD_CURRENT_STATE     = 0x32
+CMD_REPLACE           = 0x33
+CMD_NOP               = 0x41
+CMD_GET_TXID          = 0x43
+
+E_SUCCESS             = 0
+E_NOT_MASTER          = 4
+E_NOT_FOUND           = 5
+E_ASSERTION_FAILED    = 7
+E_ASSERTEXISTS_FAILED = 17
+E_UNKNOWN             = 0xff
+E_INCONSISTENT_READ   = 0x80
+
+class Failure(Exception):
+    def __init__(self, code, msg):
+        Exception.__init__(self, msg)
+        self.code = code
+
+class Store:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}
+        self.i = 0
+
+    def sortedKeys(self):
+        return sorted(self.data.keys())
+
+class Cluster:
+
+    def __init__(self, clusterId, nodeCount, basePort = None, master = 0):
+        # Without a basePort, every node listens on a free port
+        self.clusterId = clusterId
+        self.store = Store()
+        self.nodes = []
+        for n in range(nodeCount):
+            port = 0
+            if basePort is not None:
+                port = basePort + n
+            self.nodes.append(Node(self, "sturdy_%d" % n, port))
+        self.master = self.nodes[master].name
+
+    def clientNodes(self):
+        return dict((n.name, (["127.0.0.1"], n.port)) for n in self.nodes)
+
+    def node(self, name):
+        for n in self.nodes:
+            if n.name == name:
+                return n
+        raise KeyError(name)
+
+    def start(self):
+        for n in self.nodes:
+            n.start()
+
+    def stop(self):
+        for n in self.nodes:
+            n.stop()
+
+class Node:
+
+    def __init__(self, cluster, name, port):
+        self.cluster = cluster
+        self.name = name
+        self.port = port
+        self.delay = 0.0
+        self.lag = 0
+        self.requests = 0
+        self.dropReplies = 0
+        self._server = None
+
+    def applied(self):
+        return max(0, self.cluster.store.i - self.lag)
+
+    def isMaster(self):
+        return self.cluster.master == self.name
+
+    def start(self):
+        node = self
+        class Handler(SocketServer.BaseRequestHandler):
+            def handle(self):
+                Connection(node, self.request).serve()
+        SocketServer.ThreadingTCPServer.allow_reuse_address = True
+        self._server = SocketServer.ThreadingTCPServer(("127.0.0.1", self.port),
+                                                       Handler)
+        self.port = self._server.server_address[1]
+        self._server.daemon_threads = True
+        t = threading.Thread(target = self._server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+class Connection:
+
+    def __init__(self, node, sock):
+        self.node = node
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.out = []
+
+    def _read(self, n):
+        chunks = []
+        while n > 0:
+            chunk = self.sock.recv(n)
+            if not chunk:
+                raise EOFError()
+            chunks.append(chunk)
+            n -= len(chunk)
+        return ''.join(chunks)
+
+    def readInt(self):
+        return struct.unpack("I", self._read(4))[0]
+
+    def readSignedInt(self):
+        return struct.unpack("i", self._read(4))[0]
+
+    def readBool(self):
+        return self._read(1) != '\x00'
+
+    def readString(self):
+        return self._read(self.readInt())
+
+    def readStringOption(self):
+        if self.readBool():
+            return self.readString()
+        return None
+
+    def readConsistency(self):
+        c = self._read(1)
+        if c == '\x02':
+            return struct.unpack("q", self._read(8))[0]
+        return c
+
+    def int(self, i):
+        self.out.append(struct.pack("I", i))
+
+    def int64(self, i):
+        self.out.append(struct.pack("q", i))
+
+    def bool(self, b):
+        self.out.append(struct.pack("?", b))
+
+    def string(self, s):
+        self.out.append(struct.pack("I", len(s)) + s)
+
+    def stringOption(self, s):
+        if s is None:
+            self.bool(False)
+        else:
+            self.bool(True)
+            self.string(s)
+
+    def serve(self):
+        try:
+            magic = self.readInt()
+            version = self.readInt()
+            clusterId = self.readString()
+            if magic != MAGIC or version != 1 or \
+               clusterId != self.node.cluster.clusterId:
+                return
+            while True:
+                cmd = self.readInt()
+                if cmd & 0xffff0000 != MAGIC:
+                    return
+                self.out = []
+                try:
+                    self.dispatch(cmd & 0xffff)
+                except Failure, f:
+                    self.out = []
+                    self.int(f.code)
+                    self.string(str(f))
+                self.node.requests += 1
+                if self.node.delay:
+                    time.sleep(self.node.delay)
+                if self.node.dropReplies > 0:
+                    # the request was handled, but the client never hears
+                    self.node.dropReplies -= 1
+                    return
+                self.sock.sendall(''.join(self.out))
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.sock.close()
+
+    def _checkRead(self, consistency):
+        if consistency == '\x00':
+            self._checkMaster()
+        elif not isinstance(consistency, str):
+            if self.node.applied() < consistency:
+                raise Failure(E_INCONSISTENT_READ,
+                              "%s < %s" % (self.node.applied(), consistency))
+
+    def _checkMaster(self):
+        if not self.node.isMaster():
+            raise Failure(E_NOT_MASTER, self.node.cluster.master)
+
+    def _get(self, key):
+        try:
+            return self.node.cluster.store.data[key]
+        except KeyError:
+            raise Failure(E_NOT_FOUND, key)
+
+    def _write(self, updates):
+        store = self.node.cluster.store
+        with store.lock:
+            data = dict(store.data)
+            for u in updates:
+                self._apply(data, u)
+            store.data = data
+            store.i += 1
+
+    def _apply(self, data, u):
+        kind = u[0]
+        if kind == 1:
+            data[u[1]] = u[2]
+        elif kind == 2:
+            if u[1] not in data:
+                raise Failure(E_NOT_FOUND, u[1])
+            del data[u[1]]
+        elif kind == 8:
+            if data.get(u[1]) != u[2]:
+                raise Failure(E_ASSERTION_FAILED, u[1])
+        elif kind == 15:
+            if u[1] not in data:
+                raise Failure(E_ASSERTEXISTS_FAILED, u[1])
+        elif kind == 5:
+            for sub in u[1]:
+                self._apply(data, sub)
+
+    def _parseUpdate(self, buf, offset):
+        kind, = struct.unpack_from("I", buf, offset)
+        offset += 4
+        def string(offset):
+            n, = struct.unpack_from("I", buf, offset)
+            return buf[offset + 4: offset + 4 + n], offset + 4 + n
+        if kind == 1:
+            k, offset = string(offset)
+            v, offset = string(offset)
+            return (1, k, v), offset
+        if kind in (2, 15):
+            k, offset = string(offset)
+            return (kind, k), offset
+        if kind == 8:
+            k, offset = string(offset)
+            isSet = buf[offset] != '\x00'
+            offset += 1
+            vo = None
+            if isSet:
+                vo, offset = string(offset)
+            return (8, k, vo), offset
+        if kind == 5:
+            n, = struct.unpack_from("I", buf, offset)
+            offset += 4
+            subs = []
+            for _ in range(n):
+                sub, offset = self._parseUpdate(buf, offset)
+                subs.append(sub)
+            return (5, subs), offset
+        raise Failure(E_UNKNOWN, "update %d" % kind)
+
+    def _range(self, first, finc, last, linc, maxCount):
+        result = []
+        for k in self.node.cluster.store.sortedKeys():
+            if first is not None and (k < first or (k == first and not finc)):
+                continue
+            if last is not None and (k > last or (k == last and not linc)):
+                break
+            result.append(k)
+            if maxCount >= 0 and len(result) == maxCount:
+                break
+        return result
+
+    def dispatch(self, cmd):
+        store = self.node.cluster.store
+        if cmd == CMD_WHO:
+            self.int(E_SUCCESS)
+            self.stringOption(self.node.cluster.master)
+        elif cmd == CMD_GET:
+            c = self.readConsistency()
+            key = self.readString()
+            self._checkRead(c)
+            v = self._get(key)
+            self.int(E_SUCCESS)
+            self.string(v)
+        elif cmd == CMD_EXISTS:
+            c = self.readConsistency()
+            key = self.readString()
+            self._checkRead(c)
+            self.int(E_SUCCESS)
+            self.bool(key in store.data)
+        elif cmd in (CMD_ASSERT, CMD_ASSERT_EXISTS):
+            c = self.readConsistency()
+            key = self.readString()
+            if cmd == CMD_ASSERT:
+                vo = self.readStringOption()
+            self._checkRead(c)
+            if cmd == CMD_ASSERT and store.data.get(key) != vo:
+                raise Failure(E_ASSERTION_FAILED, key)
+            if cmd == CMD_ASSERT_EXISTS and key not in store.data:
+                raise Failure(E_ASSERTEXISTS_FAILED, key)
+            self.int(E_SUCCESS)
+        elif cmd in (CMD_MULTI_GET, CMD_MULTI_GET_OPTION):
+            c = self.readConsistency()
+            keys = [self.readString() for _ in range(self.readInt())]
+            self._checkRead(c)
+            if cmd == CMD_MULTI_GET:
+                values = [self._get(k) for k in keys]
+                self.int(E_SUCCESS)
+                self.int(len(values))
+                for v in reversed(values):
+                    self.string(v)
+            else:
+                self.int(E_SUCCESS)
+                self.int(len(keys))
+                for k in keys:
+                    self.stringOption(store.data.get(k))
+        elif cmd in (CMD_RAN, CMD_RAN_E, CMD_REV_RAN_E):
+            c = self.readConsistency()
+            first = self.readStringOption()
+            finc = self.readBool()
+            last = self.readStringOption()
+            linc = self.readBool()
+            maxCount = self.readSignedInt()
+            self._checkRead(c)
+            if cmd == CMD_REV_RAN_E:
+                keys = [k for k in reversed(store.sortedKeys())
+                        if (first is None or k < first or (k == first and finc))
+                        and (last is None or k > last or (k == last and linc))]
+                if maxCount >= 0:
+                    keys = keys[:maxCount]
+            else:
+                keys = self._range(first, finc, last, linc, maxCount)
+            self.int(E_SUCCESS)
+            self.int(len(keys))
+            for k in reversed(keys):
+                self.string(k)
+                if cmd != CMD_RAN:
+                    self.string(store.data[k])
+        elif cmd == CMD_PRE:
+            c = self.readConsistency()
+            prefix = self.readString()
+            maxCount = self.readSignedInt()
+            self._checkRead(c)
+            keys = [k for k in store.sortedKeys() if k.startswith(prefix)]
+            if maxCount >= 0:
+                keys = keys[:maxCount]
+            self.int(E_SUCCESS)
+            self.int(len(keys))
+            for k in reversed(keys):
+                self.string(k)
+        elif cmd == CMD_SET:
+            key = self.readString()
+            value = self.readString()
+            self._checkMaster()
+            self._write([(1, key, value)])
+            self.int(E_SUCCESS)
+        elif cmd == CMD_CONFIRM:
+            key = self.readString()
+            value = self.readString()
+            self._checkMaster()
+            if store.data.get(key) != value:
+                self._write([(1, key, value)])
+            self.int(E_SUCCESS)
+        elif cmd == CMD_DEL:
+            key = self.readString()
+            self._checkMaster()
+            self._write([(2, key)])
+            self.int(E_SUCCESS)
+        elif cmd in (CMD_SEQ, CMD_SYNCED_SEQ):
+            buf = self.readString()
+            self._checkMaster()
+            update, _ = self._parseUpdate(buf, 0)
+            self._write([update])
+            self.int(E_SUCCESS)
+        elif cmd in (CMD_TAS, CMD_REPLACE):
+            key = self.readString()
+            if cmd == CMD_TAS:
+                old = self.readStringOption()
+            new = self.readStringOption()
+            self._checkMaster()
+            with store.lock:
+                current = store.data.get(key)
+                if cmd == CMD_REPLACE or current == old:
+                    if new is None:
+                        if current is not None:
+                            self._write([(2, key)])
+                    else:
+                        self._write([(1, key, new)])
+            self.int(E_SUCCESS)
+            self.stringOption(current)
+        elif cmd == CMD_DELETE_PREFIX:
+            prefix = self.readString()
+            self._checkMaster()
+            with store.lock:
+                keys = [k for k in store.data if k.startswith(prefix)]
+                self._write([(2, k) for k in keys])
+            self.int(E_SUCCESS)
+            self.int(len(keys))
+        elif cmd == CMD_NOP:
+            self._checkMaster()
+            self._write([])
+            self.int(E_SUCCESS)
+        elif cmd == CMD_GET_TXID:
+            self.int(E_SUCCESS)
+            self.out.append('\x02')
+            self.int64(self.node.applied())
+        elif cmd == CMD_KEY_COUNT:
+            self._checkMaster()
+            self.int(E_SUCCESS)
+            self.int64(len(store.data))
+        elif cmd == CMD_EXPECT_PROGRESS:
+            self.int(E_SUCCESS)
+            self.bool(True)
+        elif cmd == CMD_VERSION:
+            self.int(E_SUCCESS)
+            self.int(1)
+            self.int(8)
+            self.int(0)
+            self.string("stand-in")
+        elif cmd == CMD_CURRENT_STATE:
+            self.int(E_SUCCESS)
+            self.string("stand-in")
+        else:
+            raise Failure(E_UNKNOWN, "unsupported command 0x%x" % cmd)
+
+def main(argv):
+    nodeCount = 3
+    basePort = 7080
+    if len(argv) > 1:
+        nodeCount = int(argv[1])
+    if len(argv) > 2:
+        basePort = int(argv[2])
+    cluster = Cluster("standin", nodeCount, basePort)
+    cluster.start()
+    print "stand-in cluster 'standin' on ports %d-%d, master %s" % \
+        (basePort, basePort + nodeCount - 1, cluster.master)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        cluster.stop()
+
+if __name__ == '__main__':
+    main(sys.argv)